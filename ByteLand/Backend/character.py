@@ -0,0 +1,208 @@
+""" character.py
+
+File containing the AI agents and the parts of their commands which do not need a frontend
+
+"""
+
+from Backend.llm_backend import get_shared_llm, stream_completion, submit_completion
+from Backend.memory import MemoryStream, stream_memory_class
+from Backend.prompts import COUNTER, PromptBuilder
+from Backend.commands import CommandParser, split_items
+from Backend.tracing import TRACER
+
+# Locations an agent may [MOVE] to, and the most tokens a turn's command may use
+TURN_LOCATIONS = ('TOWNSQUARE', 'TAVERN', 'MARKET')
+TURN_MAX_TOKENS = 24
+
+class Character():
+    """ Character()
+
+    Class which controls the functionality of the AI agents
+
+    """
+    def __init__(self, name = "", bio = "", location = "TOWNSQUARE", hand_item = "", coordinates = (0,0), llm = None, token_budget = 1024, verbose = True, locations = TURN_LOCATIONS, strict_budget = False):
+        self.name = name
+        self.location = location
+        self.hand_item = hand_item
+        self.coordinates = coordinates
+        self.verbose = verbose
+        
+        # Any LangChain LLM can be passed in, otherwise prompts go through the shared batched backend
+        self.llm = llm if llm is not None else get_shared_llm()
+        self.memory_stream = MemoryStream(self.name, llm=self.llm)
+        self.memory = stream_memory_class()(stream=self.memory_stream, memory_key='history', input_key='input', ai_prefix=f"Human {self.name}", counter=COUNTER)
+        
+        # Static prompt segments are built and counted once
+        self.bio = bio
+        self.prompts = PromptBuilder(bio, locations=locations, token_budget=token_budget, strict=strict_budget)
+        # Simulation.add_character shares the set of every character's name with the parser
+        self.parser = CommandParser(locations=locations)
+        self.turn_template = self.prompts.turn_template
+        self.talk_template = self.prompts.talk_template
+        self.pending_turn = None
+    
+    # Input: A string of a list of people, and a string of a list of items
+    # Output: The command given and the variable for that command. Both are None if input was invalid
+    def turn(self, people="", items = ""):
+        return self.end_turn(self.begin_turn(people, items).result())
+
+    # Input: A string of a list of people, and a string of a list of items
+    # Output: A Future of the turn's completion. With a batched LLM the prompt is only queued,
+    #         so the scheduler can submit every agent's turn before any request is sent.
+    def begin_turn(self, people="", items = ""):
+        # People looks like 'NOBODY' or 'JOAN, JOHN'. Items looks like 'NOTHING' or 'HAMMER, SHOVEL, SINK'
+        inputs = {'location':self.location, 'people':people, 'items':items, 'hand_item':self.hand_item}
+        with TRACER.span('character.turn', agent=self.name) as span:
+            used, self.memory.token_budget = self.prompts.history_budget('turn', inputs)
+            history = self.memory.load_memory_variables(inputs)[self.memory.memory_key]
+            prompt = self.turn_template.format(history=history, **inputs)
+            span['prompt_tokens'] = used + self.memory.last_tokens
+        self.pending_turn = (inputs, used + self.memory.last_tokens)
+        if self.verbose:
+            print(f"\n\n|||PROMPT: {prompt}")
+
+        # A turn is a single short command, so generation stops at its "|" terminator
+        return submit_completion(self.llm, prompt, stop=['|'], max_tokens=TURN_MAX_TOKENS)
+
+    # Input: The completion of the prompt begin_turn submitted
+    # Output: The command given and the variable for that command, as turn returns them
+    def end_turn(self, response):
+        inputs, prompt_tokens = self.pending_turn
+        self.pending_turn = None
+        self.memory.save_context(inputs, {'command': response})
+        self.prompts.record_usage('turn', prompt_tokens, response)
+        if self.verbose:
+            print(f"\n\n|||RESPONSE: {response}")
+        return self.command_parsing(response, inputs['items'])
+
+    # Input: The command the AI gives, and the ITEMS string it was shown
+    # Output: Divides the command into the command itself and the variable for that command
+    def command_parsing(self, input, items=None):
+        # Commands are: [MOVE] (LOCATION) | [TALK] (NAME) | [PICKUP] (ITEM) | [USE] (ITEM)
+        # Without an ITEMS string there is nothing to check a [PICKUP] against
+        item_list = split_items(items) if items else None
+        return tuple(self.parser.parse(input, items=item_list, hand_item=self.hand_item, speaker=self.name))
+        
+    # Input: Other character's name and their previous dialogue
+    # Output: This character's respone, and a true/false if they ended conversation.
+    def talk(self, char, prev_dialogue = ""):
+        
+        response = "".join(self.talk_stream(char, prev_dialogue))
+        
+        if self.parser.is_stop(response):
+            return response, True
+        
+        return response, False
+
+    # Input: Other character's name and their previous dialogue
+    # Output: Yields this character's response token by token. Generation stops as soon as
+    #         [STOPTALKING] appears, so the tokens after it are never paid for.
+    def talk_stream(self, char, prev_dialogue = ""):
+        inputs = {'other_char':char, 'location':self.location, 'prev_dialogue':prev_dialogue}
+        with TRACER.span('character.talk', agent=self.name) as span:
+            used, self.memory.token_budget = self.prompts.history_budget('talk', inputs)
+            history = self.memory.load_memory_variables(inputs)[self.memory.memory_key]
+            prompt = self.talk_template.format(history=history, **inputs)
+
+            response = ""
+            tokens = stream_completion(self.llm, prompt)
+            try:
+                for token in tokens:
+                    response += token
+                    yield token
+                    if self.parser.is_stop(response):
+                        break
+            finally:
+                tokens.close()
+
+            self.memory.save_context(inputs, {'dialogue': response})
+            usage = self.prompts.record_usage('talk', used + self.memory.last_tokens, response)
+            span['prompt_tokens'] = usage['prompt_tokens']
+            span['completion_tokens'] = usage['completion_tokens']
+        if self.verbose:
+            print(f"\n\n|||{self.name} TO {char}: {response}")
+    
+# Input: The character who started the conversation and the one they are talking to
+# Output: Yields (name, dialogue) for each line, asking the LLM for a line only when the next one is needed
+def dialogue_lines(character, other_char, rounds=2):
+    prev_dialogue = ""
+    for i in range(rounds):
+        dialogue, end = character.talk(other_char.name, prev_dialogue)
+        yield character.name, dialogue
+        if end:
+            break
+
+        prev_dialogue, end = other_char.talk(character.name, dialogue)
+        yield other_char.name, prev_dialogue
+        if end:
+            break
+
+# Input: The moving character, the location name and the world it moves in
+# Output: The path taken, or None if the location does not exist
+# With a MovementSystem the character only sets off; it walks a tile per step and
+# its location changes when it arrives. Without one it is placed at the end at once.
+def move_character(character, variable, collision_map, opt, occupancy=None, movement=None):
+    if variable not in opt['coordinates']:
+        return None
+    if movement is not None:
+        return movement.set_destination(character, opt['coordinates'][variable], variable)
+    character.location = variable
+    path = collision_map.find_path(character.coordinates, opt['coordinates'][variable])
+    # Directly iterate over the path
+    for location in path:
+        character.coordinates = location
+    if occupancy is not None:
+        occupancy.update(character)
+    return path
+
+# Output: A tracing span named after the command, e.g. 'command.move'
+def command_span(character, command, variable):
+    name = command.strip('[]').lower() if command else 'none'
+    return TRACER.span(f'command.{name}', agent=character.name, variable=variable)
+
+# Input: A command and the callback every event is passed to, e.g. EventLog.write
+# Plays out the command like general.run_command, without Streamlit or text to speech.
+# With a ConversationManager a [TALK] starts a conversation which goes on over the next
+# ticks, and with stream_tokens every token of it is emitted as it is generated.
+def run_command_headless(character, command, variable, collision_map, opt, CHARACTERS={}, occupancy=None, emit=print, movement=None, conversations=None, stream_tokens=False):
+    with command_span(character, command, variable):
+        _run_command_headless(character, command, variable, collision_map, opt, CHARACTERS, occupancy, emit, movement, conversations, stream_tokens)
+
+def _run_command_headless(character, command, variable, collision_map, opt, CHARACTERS, occupancy, emit, movement, conversations, stream_tokens):
+    if command == "[MOVE]":
+        origin = character.location
+        path = move_character(character, variable, collision_map, opt, occupancy, movement)
+        if path:
+            emit({'type': 'move', 'name': character.name, 'from': origin, 'to': variable, 'steps': len(path)})
+    elif command == "[TALK]":
+        other_char = CHARACTERS.get(variable)
+        if other_char is None:
+            emit({'type': 'invalid', 'name': character.name, 'command': command, 'variable': variable})
+            return
+        if conversations is not None:
+            start_conversation(character, other_char, conversations, emit, stream_tokens)
+            return
+        for name, dialogue in dialogue_lines(character, other_char):
+            emit({'type': 'talk', 'name': name, 'to': variable if name == character.name else character.name, 'dialogue': dialogue})
+    elif command in ("[PICKUP]", "[USE]"):
+        emit({'type': command.strip('[]').lower(), 'name': character.name, 'variable': variable})
+    else:
+        emit({'type': 'invalid', 'name': character.name, 'command': command, 'variable': variable})
+
+def start_conversation(character, other_char, conversations, emit, stream_tokens):
+    def listener(conversation, name):
+        return conversation.names[1] if name == conversation.names[0] else conversation.names[0]
+
+    def on_token(conversation, name, token):
+        emit({'type': 'token', 'conversation': conversation.id, 'name': name, 'token': token})
+
+    def on_line(conversation, name, line):
+        emit({'type': 'talk', 'conversation': conversation.id, 'name': name, 'to': listener(conversation, name), 'dialogue': line})
+        if conversation.done:
+            emit({'type': 'talk_end', 'conversation': conversation.id, 'lines': len(conversation.lines), 'stopped_by': conversation.stopped_by})
+
+    conversation = conversations.start(character, other_char, on_token=on_token if stream_tokens else None, on_line=on_line)
+    if conversation is None:
+        emit({'type': 'busy', 'name': character.name, 'to': other_char.name})
+        return
+    emit({'type': 'talk_start', 'conversation': conversation.id, 'name': character.name, 'to': other_char.name})
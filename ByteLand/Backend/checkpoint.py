@@ -0,0 +1,411 @@
+""" checkpoint.py
+
+File containing the binary checkpoints of a simulation and resuming from them
+
+A checkpoint file is the magic bytes, a header and a list of sections:
+
+    header:  magic b'BYLD' | version u16 | kind u8 (0 full, 1 incremental) | sequence u32
+    section: tag 4s | flags u8 (1 = zlib) | length u64 | payload
+
+Every integer is little-endian. The sections are:
+
+    META  JSON of the scalars: tick count, movement clock, map size and any extra fields
+    GRID  the tile codes as a raw height x width uint8 array
+    CHAR  the characters as columns: names, bios, locations, hand items, coordinates
+    MEMS  each character's new memories as columns: texts, timestamps, importance
+    EVNT  the map's events as columns: x, y, expires_at (NaN for never), JSON payloads
+    WALK  the walkers as columns: names, locations, goals and their remaining paths
+
+An incremental checkpoint only holds the memories made since the previous
+checkpoint, and only holds GRID if the grid changed. Resuming loads the
+last full checkpoint and applies the incremental ones after it in order.
+
+"""
+
+import glob
+import json
+import math
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+from Backend.movement import Walker
+from Backend.utilities import TILE_CHARS, TILE_CODES
+
+MAGIC = b'BYLD'
+VERSION = 1
+FULL = 0
+INCREMENTAL = 1
+
+HEADER = struct.Struct('<4sHBI')
+SECTION = struct.Struct('<4sBQ')
+COMPRESSED = 1
+
+class CheckpointError(Exception):
+    pass
+
+# Output: The bytes of an array in little-endian order
+def array_bytes(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+# Output: The column of strings as a count, count + 1 byte offsets and the UTF-8 blob
+def pack_strings(strings):
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = array('I', [0])
+    total = 0
+    for data in encoded:
+        total += len(data)
+        offsets.append(total)
+    return struct.pack('<I', len(encoded)) + array_bytes(offsets) + b''.join(encoded)
+
+class Reader:
+    """ Reader()
+
+    Class which reads the columns of a section payload in order
+
+    """
+    def __init__(self, payload):
+        self.payload = memoryview(payload)
+        self.position = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.payload, self.position)
+        self.position += struct.calcsize(fmt)
+        return values
+
+    def array(self, typecode, count):
+        values = array(typecode)
+        size = values.itemsize * count
+        values.frombytes(self.payload[self.position:self.position + size])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        self.position += size
+        return values
+
+    def strings(self):
+        count, = self.unpack('<I')
+        offsets = self.array('I', count + 1)
+        blob = bytes(self.payload[self.position:self.position + offsets[-1]])
+        self.position += offsets[-1]
+        text = blob.decode('utf-8')
+        if len(text) == len(blob):
+            # ASCII, so the byte offsets are character offsets too and one decode does
+            return [text[offsets[i]:offsets[i + 1]] for i in range(count)]
+        return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(count)]
+
+# Input: A GameMap
+# Output: Its tile codes as height x width bytes
+def grid_bytes(game_map):
+    if game_map.map_file is not None:
+        return b''.join(game_map.map_file.row(y) for y in range(game_map.height))
+    if game_map.use_array:
+        return game_map.map_data.tobytes()
+    return bytes(TILE_CODES.get(tile, tile) for row in game_map.map_data for tile in row)
+
+def restore_grid(game_map, collision_map, data):
+    if game_map.map_file is not None:
+        if data != grid_bytes(game_map):
+            for y in range(game_map.height):
+                for x, code in enumerate(data[y * game_map.width:(y + 1) * game_map.width]):
+                    game_map.set_tile(x, y, code)
+    elif game_map.use_array:
+        # Copy into the existing array since the collision map shares its buffer
+        memoryview(game_map.map_data).cast('B')[:] = data
+    else:
+        for y in range(game_map.height):
+            row = data[y * game_map.width:(y + 1) * game_map.width]
+            game_map.map_data[y] = [TILE_CHARS[code] for code in row]
+    collision_map.build()
+
+class Checkpointer:
+    """ Checkpointer()
+
+    Class which writes checkpoints of a simulation into a directory. Every
+    `every` ticks a checkpoint is written. One in full_every is full, and
+    the rest only hold what changed since the previous one. Files are
+    written under a temporary name and renamed, so a crash never leaves a
+    half-written checkpoint behind. A directory which already holds
+    checkpoints is only accepted when resuming=True, so one run never
+    overwrites part of another's chain.
+
+    """
+    def __init__(self, directory, every=100, full_every=10, compress_level=1, resuming=False):
+        self.directory = directory
+        self.every = every
+        self.full_every = full_every
+        self.compress_level = compress_level
+        os.makedirs(directory, exist_ok=True)
+        if not resuming and checkpoint_paths(directory):
+            raise CheckpointError(f"{directory} already holds checkpoints, resume from them or use an empty directory")
+
+        self.sequence = 0
+        self.saved_memories = {}  # name -> memories already in a checkpoint
+        self.grid_crc = None
+
+    # Output: The path written, or None if it is not time for a checkpoint
+    def maybe_save(self, simulation, **extra):
+        if self.every and simulation.tick_count % self.every == 0:
+            return self.save(simulation, **extra)
+        return None
+
+    # Input: The simulation and any JSON fields to keep in META, e.g. the day
+    # Output: The path of the checkpoint
+    def save(self, simulation, full=None, **extra):
+        if full is None:
+            full = self.sequence % self.full_every == 0
+        kind = FULL if full else INCREMENTAL
+        if full:
+            self.saved_memories = {}
+
+        game_map = simulation.game_map
+        grid = grid_bytes(game_map)
+        grid_crc = zlib.crc32(grid)
+        sections = [(b'META', json.dumps({
+            'tick_count': simulation.tick_count,
+            'movement_time': simulation.movement.time,
+            'width': game_map.width,
+            'height': game_map.height,
+            'extra': extra,
+        }).encode('utf-8'), False)]
+        if full or grid_crc != self.grid_crc:
+            sections.append((b'GRID', grid, True))
+        characters = list(simulation.characters.values())
+        sections.append((b'CHAR', self.pack_characters(characters), True))
+        sections.append((b'MEMS', self.pack_memories(characters), True))
+        sections.append((b'EVNT', self.pack_events(game_map.events), True))
+        sections.append((b'WALK', self.pack_walkers(simulation.movement.walkers.values()), True))
+
+        path = os.path.join(self.directory, f"checkpoint-{self.sequence:06d}.{'full' if full else 'incr'}")
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as checkpoint_file:
+            checkpoint_file.write(HEADER.pack(MAGIC, VERSION, kind, self.sequence))
+            for tag, payload, compress in sections:
+                flags = 0
+                if compress and self.compress_level:
+                    payload = zlib.compress(payload, self.compress_level)
+                    flags = COMPRESSED
+                checkpoint_file.write(SECTION.pack(tag, flags, len(payload)))
+                checkpoint_file.write(payload)
+        os.replace(temporary, path)
+
+        self.grid_crc = grid_crc
+        self.sequence += 1
+        return path
+
+    @staticmethod
+    def pack_characters(characters):
+        coordinates = array('i')
+        for character in characters:
+            coordinates.extend(character.coordinates)
+        return b''.join((
+            pack_strings([character.name for character in characters]),
+            pack_strings([getattr(character, 'bio', '') for character in characters]),
+            pack_strings([character.location for character in characters]),
+            pack_strings([character.hand_item for character in characters]),
+            array_bytes(coordinates),
+        ))
+
+    # Only the memories made since the last checkpoint are packed. A stream which
+    # shrank was cleared, so it is written again from the start.
+    def pack_memories(self, characters):
+        starts = array('I')
+        counts = array('I')
+        texts = []
+        timestamps = array('d')
+        importance = array('f')
+        for character in characters:
+            stream = character.memory_stream
+            with stream.lock:
+                start = self.saved_memories.get(character.name, 0)
+                if start > len(stream.texts):
+                    start = 0
+                texts.extend(stream.texts[start:])
+                timestamps.extend(stream.timestamps[start:])
+                importance.extend(stream.importance[start:])
+                starts.append(start)
+                counts.append(len(stream.texts) - start)
+                self.saved_memories[character.name] = len(stream.texts)
+        return b''.join((struct.pack('<I', len(characters)), array_bytes(starts), array_bytes(counts),
+                         pack_strings(texts), array_bytes(timestamps), array_bytes(importance)))
+
+    @staticmethod
+    def pack_events(events):
+        records = list(events.records.values())
+        xs = array('i', [record[0] for record in records])
+        ys = array('i', [record[1] for record in records])
+        expires = array('d', [math.nan if record[3] is None else record[3] for record in records])
+        payloads = [json.dumps(record[2], separators=(',', ':'), default=str) for record in records]
+        return struct.pack('<I', len(records)) + array_bytes(xs) + array_bytes(ys) + array_bytes(expires) + pack_strings(payloads)
+
+    @staticmethod
+    def pack_walkers(walkers):
+        walkers = list(walkers)
+        goals = array('i')
+        lengths = array('I')
+        cells = array('i')
+        for walker in walkers:
+            goals.extend(walker.goal)
+            # Reserved cells are walked again from the path, the reservations are made anew
+            path = list(walker.planned) + list(walker.path)
+            lengths.append(len(path))
+            for cell in path:
+                cells.extend(cell)
+        return b''.join((
+            pack_strings([walker.character.name for walker in walkers]),
+            pack_strings([walker.location or '' for walker in walkers]),
+            array_bytes(goals), array_bytes(lengths), array_bytes(cells),
+        ))
+
+def check_header(path, data):
+    if len(data) < HEADER.size:
+        raise CheckpointError(f"{path} is too short to be a checkpoint")
+    magic, version, kind, sequence = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CheckpointError(f"{path} is not a checkpoint")
+    if version > VERSION:
+        raise CheckpointError(f"{path} is version {version}, this build reads up to {VERSION}")
+    return kind, sequence
+
+# Output: (kind, sequence) from the header of a checkpoint file
+def read_header(path):
+    with open(path, 'rb') as checkpoint_file:
+        return check_header(path, checkpoint_file.read(HEADER.size))
+
+# Output: (kind, sequence, {tag: payload}) of a checkpoint file
+def read_checkpoint(path):
+    with open(path, 'rb') as checkpoint_file:
+        data = checkpoint_file.read()
+    kind, sequence = check_header(path, data)
+
+    sections = {}
+    position = HEADER.size
+    while position < len(data):
+        tag, flags, length = SECTION.unpack_from(data, position)
+        position += SECTION.size
+        payload = data[position:position + length]
+        position += length
+        sections[tag] = zlib.decompress(payload) if flags & COMPRESSED else payload
+    return kind, sequence, sections
+
+def checkpoint_paths(directory):
+    return glob.glob(os.path.join(directory, 'checkpoint-*.full')) + glob.glob(os.path.join(directory, 'checkpoint-*.incr'))
+
+# Output: The paths of the last full checkpoint in the directory and the incremental ones
+#         which follow it, in the sequence order of their headers up to the first gap
+def checkpoint_chain(directory):
+    headers = sorted((sequence, kind, path) for path in checkpoint_paths(directory)
+                     for kind, sequence in [read_header(path)])
+    fulls = [index for index, (_, kind, _) in enumerate(headers) if kind == FULL]
+    if not fulls:
+        return []
+    chain = [headers[fulls[-1]]]
+    for sequence, kind, path in headers[fulls[-1] + 1:]:
+        if sequence != chain[-1][0] + 1 or kind != INCREMENTAL:
+            break
+        chain.append((sequence, kind, path))
+    return [path for _, _, path in chain]
+
+# Input: A simulation built with the same options, the directory of checkpoints and
+#        a Character class to create characters the simulation does not have yet
+# Output: The META fields of the last checkpoint, or None if there is nothing to resume.
+#         The checkpointer, if given, carries on the chain after it.
+def resume(simulation, directory, character_class, checkpointer=None):
+    chain = checkpoint_chain(directory)
+    if not chain:
+        return None
+
+    meta = None
+    memories = {}
+    for path in chain:
+        _, sequence, sections = read_checkpoint(path)
+        meta = json.loads(bytes(sections[b'META']).decode('utf-8'))
+        if (meta['width'], meta['height']) != (simulation.game_map.width, simulation.game_map.height):
+            raise CheckpointError(f"{path} is for a {meta['width']}x{meta['height']} map")
+        if b'GRID' in sections:
+            restore_grid(simulation.game_map, simulation.collision_map, sections[b'GRID'])
+        names = restore_characters(simulation, Reader(sections[b'CHAR']), character_class)
+        apply_memories(memories, names, Reader(sections[b'MEMS']))
+        events, walkers = sections[b'EVNT'], sections[b'WALK']
+
+    for name, (texts, timestamps, importance) in memories.items():
+        simulation.characters[name].memory_stream.restore(texts, timestamps, importance)
+    restore_events(simulation.game_map, Reader(events))
+    simulation.movement.time = meta['movement_time']
+    restore_walkers(simulation.movement, simulation.characters, Reader(walkers))
+    for character in simulation.characters.values():
+        simulation.occupancy.update(character)
+    simulation.tick_count = meta['tick_count']
+
+    if checkpointer is not None:
+        checkpointer.sequence = sequence + 1
+        checkpointer.saved_memories = {name: len(columns[0]) for name, columns in memories.items()}
+        checkpointer.grid_crc = zlib.crc32(grid_bytes(simulation.game_map))
+    return meta
+
+# Output: The names of the characters in the section, in order
+def restore_characters(simulation, reader, character_class):
+    names = reader.strings()
+    bios = reader.strings()
+    locations = reader.strings()
+    hand_items = reader.strings()
+    coordinates = reader.array('i', 2 * len(names))
+    for number, name in enumerate(names):
+        position = (coordinates[2 * number], coordinates[2 * number + 1])
+        character = simulation.characters.get(name)
+        if character is None:
+            character = character_class(name, bios[number], locations[number], coordinates=position)
+            simulation.add_character(character)
+        character.location = locations[number]
+        character.hand_item = hand_items[number]
+        character.coordinates = position
+    return names
+
+def apply_memories(memories, names, reader):
+    count, = reader.unpack('<I')
+    starts = reader.array('I', count)
+    counts = reader.array('I', count)
+    texts = reader.strings()
+    timestamps = reader.array('d', len(texts))
+    importance = reader.array('f', len(texts))
+    offset = 0
+    for number, name in enumerate(names):
+        start, added = starts[number], counts[number]
+        columns = memories.setdefault(name, ([], [], []))
+        for column, values in zip(columns, (texts, timestamps, importance)):
+            del column[start:]
+            column.extend(values[offset:offset + added])
+        offset += added
+
+def restore_events(game_map, reader):
+    count, = reader.unpack('<I')
+    xs = reader.array('i', count)
+    ys = reader.array('i', count)
+    expires = reader.array('d', count)
+    payloads = reader.strings()
+    game_map.events = type(game_map.events)(game_map.events.chunk_size)
+    game_map.events.add_many(
+        (xs[number], ys[number], json.loads(payloads[number]), None if math.isnan(expires[number]) else expires[number])
+        for number in range(count)
+    )
+
+def restore_walkers(movement, characters, reader):
+    names = reader.strings()
+    locations = reader.strings()
+    goals = reader.array('i', 2 * len(names))
+    lengths = reader.array('I', len(names))
+    cells = reader.array('i', 2 * sum(lengths))
+    movement.walkers = {}
+    movement.table = type(movement.table)(movement.table.shared)
+    offset = 0
+    for number, name in enumerate(names):
+        path = [(cells[2 * index], cells[2 * index + 1]) for index in range(offset, offset + lengths[number])]
+        offset += lengths[number]
+        goal = (goals[2 * number], goals[2 * number + 1])
+        movement.walkers[name] = Walker(characters[name], goal, locations[number] or None, path)
+        # As in set_destination, the tile it stands on is held until it plans
+        movement.table.rest(name, movement.time, tuple(characters[name].coordinates))
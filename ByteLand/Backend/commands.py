@@ -0,0 +1,113 @@
+""" commands.py
+
+File containing the parser of the commands the AI agents give
+
+"""
+
+import difflib
+import re
+from collections import namedtuple
+
+# A parsed command. command is e.g. '[MOVE]', variable is e.g. 'TAVERN' or None.
+Command = namedtuple('Command', ['command', 'variable'])
+
+COMMANDS = ('MOVE', 'TALK', 'PICKUP', 'USE', 'STOPTALKING')
+
+# One pass finds the first bracketed command and everything up to the "|" terminator or end of text
+COMMAND_PATTERN = re.compile(r'\[\s*(' + '|'.join(COMMANDS) + r')\s*\]([^|\[]*)', re.IGNORECASE)
+
+# Local retry when there are no brackets, e.g. "I will MOVE to the TAVERN"
+LOOSE_PATTERN = re.compile(r'\b(' + '|'.join(COMMANDS) + r')\b(?:\s+TO)?(?:\s+THE)?([^|\[.]*)', re.IGNORECASE)
+
+STOP_PATTERN = re.compile(r'\[\s*STOPTALKING\s*\]', re.IGNORECASE)
+
+class CommandParser:
+    """ CommandParser()
+
+    Class which turns an agent's completion into a Command and checks it
+    against the known locations, characters and items. When the first
+    reading is invalid it retries locally: it looks for an unbracketed
+    command and snaps the variable to the closest valid name. It does not
+    ask the LLM again. A None set means any value is accepted.
+
+    """
+    def __init__(self, locations=None, characters=None, items=None, cutoff=0.75):
+        self.locations = locations
+        self.characters = characters
+        self.items = items
+        self.cutoff = cutoff
+        self.stats = {'parsed': 0, 'repaired': 0, 'invalid': 0}
+
+    @staticmethod
+    def normalize(variable):
+        # '(WIZARD HOUSE)' -> 'WIZARD_HOUSE'
+        variable = variable.strip().strip('(){}<>"\'.,:; ').upper()
+        return re.sub(r'\s+', '_', variable)
+
+    # Output: The valid names a command's variable is checked against, or None for anything
+    def choices(self, name, items=None, speaker=None):
+        if name == 'MOVE':
+            return self.locations
+        if name == 'TALK':
+            if self.characters is None:
+                return None
+            return [character for character in self.characters if character != speaker]
+        if name == 'PICKUP':
+            return items if items is not None else self.items
+        return None
+
+    # Input: The completion, the items in view, what is in hand and who is speaking
+    # Output: A valid Command, or Command(None, None) if none could be read
+    def parse(self, text, items=None, hand_item="", speaker=None):
+        for attempt, pattern in enumerate((COMMAND_PATTERN, LOOSE_PATTERN)):
+            match = pattern.search(text)
+            if match is None:
+                continue
+            command = self.validate(match.group(1).upper(), self.normalize(match.group(2)), items, hand_item, speaker)
+            if command is not None:
+                if attempt == 0 and command.variable in (None, self.normalize(match.group(2))):
+                    self.stats['parsed'] += 1
+                else:
+                    self.stats['repaired'] += 1
+                return command
+
+        self.stats['invalid'] += 1
+        return Command(None, None)
+
+    def validate(self, name, variable, items, hand_item, speaker):
+        if name == 'USE':
+            if hand_item in ("", "NOTHING"):
+                return None
+            return Command('[USE]', None)
+        if name == 'STOPTALKING':
+            return Command('[STOPTALKING]', None)
+
+        if not variable:
+            return None
+        choices = self.choices(name, items, speaker)
+        if choices is None or variable in choices:
+            return Command(f'[{name}]', variable)
+
+        # Keep a valid name followed by extra words, e.g. 'TAVERN_TO_DRINK'
+        prefixes = [choice for choice in choices if variable.startswith(choice + '_')]
+        if prefixes:
+            return Command(f'[{name}]', max(prefixes, key=len))
+
+        # Snap near misses such as 'TOWN_SQUARE' to 'TOWNSQUARE'
+        squashed = {choice.replace('_', ''): choice for choice in choices}
+        if variable.replace('_', '') in squashed:
+            return Command(f'[{name}]', squashed[variable.replace('_', '')])
+        close = difflib.get_close_matches(variable, list(choices), n=1, cutoff=self.cutoff)
+        if close:
+            return Command(f'[{name}]', close[0])
+        return None
+
+    @staticmethod
+    def is_stop(text):
+        return STOP_PATTERN.search(text) is not None
+
+# Input: An ITEMS string like 'NOTHING' or 'HAMMER, SHOVEL, SINK'
+# Output: The list of items, empty for 'NOTHING'
+def split_items(items):
+    names = [CommandParser.normalize(item) for item in items.split(',')]
+    return [name for name in names if name and name != 'NOTHING']
@@ -0,0 +1,165 @@
+""" conversation.py
+
+File containing the conversations between AI agents and the manager running them side by side
+
+"""
+
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from Backend.tracing import TRACER
+
+class Conversation:
+    """ Conversation()
+
+    Class which holds one conversation as a state machine. Each call to
+    speak() streams the next line from whoever's turn it is, then moves
+    the state on. A conversation ends after max_lines lines or when a line
+    contains [STOPTALKING], and can be picked up again at any point between
+    lines. on_token(conversation, name, token) is called for every token
+    and on_line(conversation, name, line) for every finished line. A
+    speaker with a ready() method, like a villager in another shard, may
+    not have its next line yet; the conversation waits for it.
+
+    """
+    def __init__(self, conversation_id, starter, other, max_lines=4, on_token=None, on_line=None):
+        self.id = conversation_id
+        self.speakers = (starter, other)
+        self.max_lines = max_lines
+        self.on_token = on_token
+        self.on_line = on_line
+
+        self.lines = []  # (name, line) in the order they were said
+        self.heard = ""
+        self.done = False
+        self.stopped_by = None
+
+    @property
+    def names(self):
+        return tuple(speaker.name for speaker in self.speakers)
+
+    # Output: (speaker, listener) of the next line
+    def turn(self):
+        number = len(self.lines)
+        return self.speakers[number % 2], self.speakers[(number + 1) % 2]
+
+    # Output: True if whoever's turn it is can say their line now
+    def ready(self):
+        speaker, _ = self.turn()
+        return not hasattr(speaker, 'ready') or speaker.ready()
+
+    # Output: Yields the tokens of the next line as they are generated
+    def speak(self):
+        speaker, listener = self.turn()
+        line = ""
+        for token in speaker.talk_stream(listener.name, self.heard):
+            line += token
+            if self.on_token is not None:
+                self.on_token(self, speaker.name, token)
+            yield token
+
+        self.lines.append((speaker.name, line))
+        self.heard = line
+        if speaker.parser.is_stop(line):
+            self.done = True
+            self.stopped_by = speaker.name
+        elif len(self.lines) >= self.max_lines:
+            self.done = True
+        if self.on_line is not None:
+            self.on_line(self, speaker.name, line)
+
+    # Output: The finished line
+    def advance(self):
+        with TRACER.span('conversation.line', conversation=self.id, line=len(self.lines)):
+            for _ in self.speak():
+                pass
+        return self.lines[-1]
+
+    # Output: Yields ('token', name, token) while a line streams and ('line', name, line) once
+    #         it is finished, until the conversation is over
+    def events(self):
+        while not self.done:
+            speaker, _ = self.turn()
+            for token in self.speak():
+                yield 'token', speaker.name, token
+            yield 'line', speaker.name, self.lines[-1][1]
+
+class ConversationManager:
+    """ ConversationManager()
+
+    Class which runs every open conversation in the village. A character is
+    in at most one conversation at a time. step() says the next line of
+    every open conversation at once on a thread pool, so conversations run
+    alongside each other and across ticks instead of blocking one.
+
+    """
+    def __init__(self, max_workers=8, max_lines=4):
+        self.max_lines = max_lines
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='conversation')
+        self.active = {}   # conversation id -> Conversation
+        self.talking = {}  # character name -> conversation id
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+
+        # Conversation statistics
+        self.started = 0
+        self.finished = 0
+        self.stopped_early = 0
+
+    def __len__(self):
+        return len(self.active)
+
+    def is_talking(self, name):
+        return name in self.talking
+
+    # Output: The open Conversation with that id, or None
+    def get(self, conversation_id):
+        with self.lock:
+            return self.active.get(conversation_id)
+
+    # Input: conversation_id is given when another process already numbered the conversation
+    # Output: The new Conversation, or None if either character is already talking
+    def start(self, starter, other, on_token=None, on_line=None, max_lines=None, conversation_id=None):
+        with self.lock:
+            if starter.name == other.name or starter.name in self.talking or other.name in self.talking:
+                return None
+            if conversation_id is None:
+                conversation_id = next(self.ids)
+            conversation = Conversation(conversation_id, starter, other, max_lines or self.max_lines, on_token, on_line)
+            self.active[conversation.id] = conversation
+            self.talking[starter.name] = self.talking[other.name] = conversation.id
+            self.started += 1
+        return conversation
+
+    def finish(self, conversation):
+        with self.lock:
+            if self.active.pop(conversation.id, None) is None:
+                return
+            for name in conversation.names:
+                self.talking.pop(name, None)
+            self.finished += 1
+            if conversation.stopped_by is not None:
+                self.stopped_early += 1
+
+    # Say the next line of every open conversation that is not waiting on a line, all at the same time
+    # Output: The (conversation, name, line) of every line said
+    def step(self):
+        with self.lock:
+            conversations = [conversation for conversation in self.active.values() if conversation.ready()]
+        futures = [(conversation, self.executor.submit(conversation.advance)) for conversation in conversations]
+
+        said = []
+        for conversation, future in futures:
+            try:
+                name, line = future.result()
+                said.append((conversation, name, line))
+            except Exception as exception:
+                print(f"Conversation between {' and '.join(conversation.names)} failed: {exception}")
+                conversation.done = True
+            if conversation.done:
+                self.finish(conversation)
+        return said
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,64 @@
+""" eventlog.py
+
+File containing the event log of a simulation run
+
+"""
+
+import json
+import threading
+import time
+
+class EventLog:
+    """ EventLog()
+
+    Class which writes every event of a run to a JSON Lines file. The
+    fields in context (e.g. the current day and tick) are added to every
+    event written. Events may be written from several threads. Each run is
+    appended to the file, which is only truncated with append=False, and
+    every run begins with a {'type': 'run', ...} record holding the run's
+    fields, so read_runs can tell the runs in a file apart.
+
+    """
+    def __init__(self, path, append=True, run=None):
+        self.path = path
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8', buffering=1 << 16)
+        self.context = {}
+        self.count = 0
+        self.lock = threading.Lock()
+        self.file.write(json.dumps({'type': 'run', 'started': time.time(), **(run or {})}, separators=(',', ':')) + '\n')
+
+    def write(self, event):
+        line = json.dumps({**self.context, **event}, separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Output: Every event in a log file, in the order they were written
+def read_events(path):
+    with open(path, encoding='utf-8') as log_file:
+        return [json.loads(line) for line in log_file if line.strip()]
+
+# Output: [(run record, events of the run)] for every run in a log file, in order
+def read_runs(path):
+    runs = []
+    for event in read_events(path):
+        if event.get('type') == 'run':
+            runs.append((event, []))
+        elif runs:
+            runs[-1][1].append(event)
+        else:
+            # Written before logs had run records
+            runs.append((None, [event]))
+    return runs
@@ -0,0 +1,129 @@
+""" events.py
+
+File containing the spatial index of events happening on the map
+
+"""
+
+import heapq
+import itertools
+
+class EventIndex:
+    """ EventIndex()
+
+    Class which stores events by tile and by chunk (chunk_size x chunk_size
+    tiles), so tile lookups cost O(1) and radius queries only visit the
+    chunks they overlap. Events with an expiry time also go on a heap
+    ordered by that time, so expiring them costs O(log n) each. Removed
+    events are dropped from the heap lazily.
+
+    """
+    def __init__(self, chunk_size=16):
+        self.chunk_size = chunk_size
+        self.records = {}  # event id -> (x, y, event, expires_at)
+        self.tiles = {}    # (x, y) -> {event id: event}
+        self.chunks = {}   # (chunk x, chunk y) -> {event id: (x, y)}
+        self.expiry = []   # heap of (expires_at, event id)
+        self.ids = itertools.count()
+
+    def __len__(self):
+        return len(self.records)
+
+    def chunk_of(self, x, y):
+        return (x // self.chunk_size, y // self.chunk_size)
+
+    # Output: The id of the new event, used to remove it
+    def add(self, x, y, event, expires_at=None):
+        event_id = next(self.ids)
+        self.records[event_id] = (x, y, event, expires_at)
+        self.tiles.setdefault((x, y), {})[event_id] = event
+        self.chunks.setdefault(self.chunk_of(x, y), {})[event_id] = (x, y)
+        if expires_at is not None:
+            heapq.heappush(self.expiry, (expires_at, event_id))
+        return event_id
+
+    # Input: An iterable of (x, y, event, expires_at)
+    # Output: The ids of the new events
+    def add_many(self, events):
+        event_ids = []
+        timed = []
+        for x, y, event, expires_at in events:
+            event_id = next(self.ids)
+            self.records[event_id] = (x, y, event, expires_at)
+            self.tiles.setdefault((x, y), {})[event_id] = event
+            self.chunks.setdefault(self.chunk_of(x, y), {})[event_id] = (x, y)
+            if expires_at is not None:
+                timed.append((expires_at, event_id))
+            event_ids.append(event_id)
+
+        # Re-heapifying once beats pushing one at a time when the batch is large
+        if len(timed) > len(self.expiry):
+            self.expiry.extend(timed)
+            heapq.heapify(self.expiry)
+        else:
+            for item in timed:
+                heapq.heappush(self.expiry, item)
+        return event_ids
+
+    # Output: The removed event, or None if it was already gone
+    def remove(self, event_id):
+        record = self.records.pop(event_id, None)
+        if record is None:
+            return None
+        x, y, event, _ = record
+        tile = self.tiles[(x, y)]
+        del tile[event_id]
+        if not tile:
+            del self.tiles[(x, y)]
+        chunk_key = self.chunk_of(x, y)
+        chunk = self.chunks[chunk_key]
+        del chunk[event_id]
+        if not chunk:
+            del self.chunks[chunk_key]
+        return event
+
+    # Remove the first event at the tile equal to the given one
+    def remove_matching(self, x, y, event):
+        for event_id, other in self.tiles.get((x, y), {}).items():
+            if other == event:
+                self.remove(event_id)
+                return True
+        return False
+
+    # Input: The current time, in the same units as expires_at
+    # Output: The (x, y, event) of every event which expired
+    def expire(self, now):
+        expired = []
+        while self.expiry and self.expiry[0][0] <= now:
+            _, event_id = heapq.heappop(self.expiry)
+            record = self.records.get(event_id)
+            if record is not None:
+                self.remove(event_id)
+                expired.append(record[:3])
+        return expired
+
+    def at(self, x, y):
+        return list(self.tiles.get((x, y), {}).values())
+
+    # Output: The (x, y, event) of every event with x_min <= x < x_max and y_min <= y < y_max
+    def in_window(self, x_min, y_min, x_max, y_max):
+        found = []
+        size = self.chunk_size
+        for chunk_x in range(x_min // size, (x_max - 1) // size + 1):
+            for chunk_y in range(y_min // size, (y_max - 1) // size + 1):
+                chunk = self.chunks.get((chunk_x, chunk_y))
+                if not chunk:
+                    continue
+                for event_id, (x, y) in chunk.items():
+                    if x_min <= x < x_max and y_min <= y < y_max:
+                        found.append((x, y, self.records[event_id][2]))
+        return found
+
+    # Output: The (x, y, event) of every event within radius tiles on both axes, like GameMap.get_nearby_tiles
+    def within_radius(self, x, y, radius):
+        return self.in_window(x - radius, y - radius, x + radius + 1, y + radius + 1)
+
+# Output: The name to show an event under in a prompt's ITEMS field
+def event_name(event):
+    if isinstance(event, dict):
+        return str(event.get('name', event.get('type', 'SOMETHING')))
+    return str(event)
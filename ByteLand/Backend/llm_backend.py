@@ -0,0 +1,430 @@
+""" llm_backend.py
+
+File containing the shared LLM backends and the prompt batcher every Character talks through
+
+LangChain takes a while to import, so it is only imported once an LLM is
+built or called. BatchedLLM, which subclasses LangChain's LLM, is defined
+on first use by batched_llm_class and can still be imported by name.
+
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any
+
+from Backend.tracing import TRACER
+
+# Splits a completion into word-sized tokens for backends which cannot stream
+TOKEN_PATTERN = re.compile(r'\s*\S+|\s+')
+
+class LLMBackend:
+    """ LLMBackend()
+
+    Class which every LLM backend extends. A backend turns a list of prompts
+    into a list of completions in one request.
+
+    """
+    name = "backend"
+
+    def generate(self, prompts, stop=None, max_tokens=None):
+        raise NotImplementedError
+
+    # Output: An iterator over the tokens of one completion. Closing it early ends the request.
+    def stream(self, prompt, stop=None, max_tokens=None):
+        yield self.generate([prompt], stop=stop, max_tokens=max_tokens)[0]
+
+    def identifying_params(self):
+        return {'backend': self.name}
+
+# Output: The OpenAI key from $OPENAI_API_KEY, or else from apikey2.py
+def resolve_api_key():
+    if os.environ.get('OPENAI_API_KEY'):
+        return os.environ['OPENAI_API_KEY']
+    try:
+        from apikey2 import apikey
+    except ImportError:
+        raise RuntimeError("Set OPENAI_API_KEY or add apikey2.py, or run with BYTELAND_LLM_BACKEND=local") from None
+    return apikey
+
+class OpenAIBackend(LLMBackend):
+    """ OpenAIBackend()
+
+    Class which sends each batch of prompts to the OpenAI completions API as
+    a single request
+
+    """
+    name = "openai"
+
+    def __init__(self, temperature=0.9, batch_size=20, **kwargs):
+        # Imported here so the local backend never loads the OpenAI client
+        from langchain.llms import OpenAI
+
+        kwargs.setdefault('openai_api_key', resolve_api_key())
+        # The batched LLM in front of this backend already consults the completion cache
+        self.llm = OpenAI(temperature=temperature, batch_size=batch_size, cache=False, **kwargs)
+
+    def generate(self, prompts, stop=None, max_tokens=None):
+        kwargs = {} if max_tokens is None else {'max_tokens': max_tokens}
+        result = self.llm.generate(prompts, stop=stop, **kwargs)
+        return [generations[0].text for generations in result.generations]
+
+    # Closing the iterator closes the HTTP stream, so the tokens after it are not generated
+    def stream(self, prompt, stop=None, max_tokens=None):
+        kwargs = {} if max_tokens is None else {'max_tokens': max_tokens}
+        tokens = self.llm.stream(prompt, stop=stop, **kwargs)
+        try:
+            yield from tokens
+        finally:
+            tokens.close()
+
+    def identifying_params(self):
+        return {'backend': self.name, **self.llm._identifying_params}
+
+# The people in view on the last line of a turn prompt, see TURN_TEMPLATE
+PEOPLE_PATTERN = re.compile(r'\| PEOPLE: ([^|\n]*) \| ITEMS:')
+
+class LocalBackend(LLMBackend):
+    """ LocalBackend()
+
+    Class which stands in for a real LLM with no network. Each completion is
+    picked from a hash of its prompt, so runs are repeatable. Turns mix
+    moves, talks, repairable and unreadable commands, and latency,
+    per_prompt_latency and token_latency simulate the cost of a request.
+
+    """
+    name = "local"
+
+    def __init__(self, locations=('TOWNSQUARE', 'TAVERN', 'MARKET'), latency=0.0, per_prompt_latency=0.0, token_latency=0.0):
+        self.locations = tuple(locations)
+        self.latency = latency
+        self.per_prompt_latency = per_prompt_latency
+        self.token_latency = token_latency
+        self.requests = 0
+        self.prompts = 0
+        self.streamed_tokens = 0
+
+    def complete(self, prompt):
+        digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        if "Your response:" in prompt:
+            if digest % 4 == 0:
+                return " Farewell for now. [STOPTALKING] |"
+            return " Good day to you, neighbour. How fares the village? |"
+        if "Enter a single command" in prompt:
+            return self.command(prompt, digest)
+        return " The villagers went about their day."
+
+    # Output: A turn's command, mixed like a real model's: mostly [MOVE], a [TALK] with
+    #         someone in view, one the parser has to repair and one it cannot read
+    def command(self, prompt, digest):
+        location = self.locations[digest // 10 % len(self.locations)]
+        people = PEOPLE_PATTERN.findall(prompt)
+        people = [name.strip() for name in people[-1].split(',') if name.strip()] if people else []
+        roll = digest % 10
+        if roll == 0:
+            return " I think I will rest here a while. |"
+        if roll == 1:
+            return f" [MOVE] {location[:-1].lower()} |"
+        if roll in (2, 3, 4) and people:
+            return f" [TALK] {people[digest // 10 % len(people)]} |"
+        return f" [MOVE] {location} |"
+
+    def generate(self, prompts, stop=None, max_tokens=None):
+        time.sleep(self.latency + self.per_prompt_latency * len(prompts))
+        self.requests += 1
+        self.prompts += len(prompts)
+        completions = [self.complete(prompt) for prompt in prompts]
+        if stop:
+            completions = [truncate_at_stop(completion, stop) for completion in completions]
+        return completions
+
+    def stream(self, prompt, stop=None, max_tokens=None):
+        time.sleep(self.latency + self.per_prompt_latency)
+        self.requests += 1
+        self.prompts += 1
+        completion = self.complete(prompt)
+        if stop:
+            completion = truncate_at_stop(completion, stop)
+        for token in TOKEN_PATTERN.findall(completion):
+            time.sleep(self.token_latency)
+            self.streamed_tokens += 1
+            yield token
+
+    def identifying_params(self):
+        return {'backend': self.name, 'locations': self.locations}
+
+def truncate_at_stop(text, stop):
+    for sequence in stop:
+        index = text.find(sequence)
+        if index != -1:
+            text = text[:index]
+    return text
+
+class PromptBatcher:
+    """ PromptBatcher()
+
+    Class which coalesces prompts submitted from many threads into batched
+    backend requests. A batch is sent once it holds max_batch prompts or
+    window seconds after its first prompt arrived, whichever comes first.
+    Inside gather() nothing is sent on a timer: every prompt of a tick is
+    submitted first and they go out together when it ends. Prompts with
+    different stop sequences or max_tokens go in different batches.
+
+    """
+    def __init__(self, backend, max_batch=20, window=0.02):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.window = window
+        self.pending = {}  # (stop sequences, max_tokens) -> [(prompt, future)]
+        self.lock = threading.Lock()
+        self.timer = None
+        self.gathering = 0
+
+        # Throughput statistics
+        self.batches = 0
+        self.prompts = 0
+
+    # Output: A Future which resolves to the completion of the prompt
+    def submit(self, prompt, stop=None, max_tokens=None):
+        future = Future()
+        key = (tuple(stop) if stop else (), max_tokens)
+        ready = None
+        with self.lock:
+            batch = self.pending.setdefault(key, [])
+            batch.append((prompt, future))
+            if len(batch) >= self.max_batch:
+                ready = self.pending.pop(key)
+            elif self.timer is None and not self.gathering:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if ready is not None:
+            self._send(key, ready)
+        return future
+
+    # Hold every prompt submitted inside the block and send them all, in as few
+    # batches as max_batch allows, when it ends
+    @contextmanager
+    def gather(self):
+        with self.lock:
+            self.gathering += 1
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.gathering -= 1
+                outermost = not self.gathering
+            if outermost:
+                self.flush()
+
+    # Send every pending batch now
+    def flush(self):
+        with self.lock:
+            batches = self.pending
+            self.pending = {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        for key, batch in batches.items():
+            self._send(key, batch)
+
+    def _send(self, key, batch):
+        try:
+            with TRACER.span('llm.request', backend=self.backend.name, prompts=len(batch)):
+                completions = self.backend.generate([prompt for prompt, _ in batch], stop=list(key[0]) or None, max_tokens=key[1])
+        except Exception as exception:
+            for _, future in batch:
+                future.set_exception(exception)
+            return
+
+        with self.lock:
+            self.batches += 1
+            self.prompts += len(batch)
+        for (_, future), completion in zip(batch, completions):
+            future.set_result(completion)
+
+    # Output: An iterator over the tokens of the completion. A stream is its own request
+    # since its tokens are wanted as soon as they exist.
+    def stream(self, prompt, stop=None, max_tokens=None):
+        with self.lock:
+            self.batches += 1
+            self.prompts += 1
+        tokens = self.backend.stream(prompt, stop=stop, max_tokens=max_tokens)
+        try:
+            with TRACER.span('llm.stream', backend=self.backend.name) as span:
+                count = 0
+                for token in tokens:
+                    count += 1
+                    yield token
+                span['tokens'] = count
+        finally:
+            tokens.close()
+
+# Keyword arguments of a call which change its completion (the ones the batcher passes on),
+# so they are part of its cache key
+CALL_PARAMS = ('max_tokens',)
+
+BATCHED_LLM_CLASS = None
+BATCHED_LLM_LOCK = threading.Lock()
+
+# Output: The BatchedLLM class, defined the first time it is asked for
+def batched_llm_class():
+    global BATCHED_LLM_CLASS
+    with BATCHED_LLM_LOCK:
+        if BATCHED_LLM_CLASS is None:
+            BATCHED_LLM_CLASS = define_batched_llm()
+        return BATCHED_LLM_CLASS
+
+def define_batched_llm():
+    from langchain.llms.base import LLM
+    from langchain.schema.output import GenerationChunk
+
+    class BatchedLLM(LLM):
+        """ BatchedLLM()
+
+        LangChain LLM which hands every prompt to a shared PromptBatcher and
+        waits for its completion, so concurrent agents share backend requests.
+        LangChain keys its cache on dict() and stop only, so per-call sampling
+        parameters such as max_tokens are moved into call_params, which
+        dict() includes, before a call.
+
+        """
+        batcher: Any
+        call_params: dict = {}
+
+        @property
+        def _llm_type(self):
+            return "byteland-batched"
+
+        @property
+        def _identifying_params(self):
+            return {**self.batcher.backend.identifying_params(), **self.call_params}
+
+        # Output: This LLM, or a copy of it sharing the batcher with the sampling parameters in call_params
+        def with_call_params(self, **kwargs):
+            params = {key: kwargs[key] for key in CALL_PARAMS if kwargs.get(key) is not None}
+            if not params:
+                return self
+            # copy() leaves out LangChain's excluded fields, e.g. callbacks, so every field is passed on
+            fields = {name: getattr(self, name) for name in self.__fields__}
+            return self.copy(update={**fields, 'call_params': {**self.call_params, **params}})
+
+        def generate(self, prompts, stop=None, callbacks=None, **kwargs):
+            llm = self.with_call_params(**kwargs)
+            kwargs = {key: value for key, value in kwargs.items() if key not in CALL_PARAMS}
+            return super(BatchedLLM, llm).generate(prompts, stop=stop, callbacks=callbacks, **kwargs)
+
+        def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+            return self.batcher.submit(prompt, stop, kwargs.get('max_tokens', self.call_params.get('max_tokens'))).result()
+
+        def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+            for token in self.batcher.stream(prompt, stop, kwargs.get('max_tokens', self.call_params.get('max_tokens'))):
+                if run_manager is not None:
+                    run_manager.on_llm_new_token(token)
+                yield GenerationChunk(text=token)
+
+    # Named as if it were defined at the top of the module, so its instances pickle
+    BatchedLLM.__qualname__ = 'BatchedLLM'
+    return BatchedLLM
+
+# Lets `from Backend.llm_backend import BatchedLLM` define the class
+def __getattr__(name):
+    if name == 'BatchedLLM':
+        return batched_llm_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Output: The completion cache's key for the LLM called with these parameters, the same one
+#         LangChain uses when the LLM is called directly
+def completion_key(llm, stop, params):
+    return str(sorted({**llm.dict(), **params, 'stop': stop}.items()))
+
+# Input: Any LangChain LLM, a prompt and per-call sampling parameters such as max_tokens
+# Output: A Future which resolves to the completion. A BatchedLLM only queues the prompt with
+#         its batcher, so many can be submitted before any is sent (see PromptBatcher.gather);
+#         any other LLM is called at once. The completion cache is used like LLM calls use it.
+def submit_completion(llm, prompt, stop=None, **kwargs):
+    from langchain.globals import get_llm_cache
+    from langchain.schema import Generation
+
+    params = {key: value for key, value in kwargs.items() if value is not None}
+    if not isinstance(llm, batched_llm_class()):
+        future = Future()
+        try:
+            future.set_result(llm(prompt, stop=stop, **params))
+        except Exception as exception:
+            future.set_exception(exception)
+        return future
+
+    max_tokens = params.get('max_tokens', llm.call_params.get('max_tokens'))
+    cache = get_llm_cache()
+    if cache is None:
+        return llm.batcher.submit(prompt, stop, max_tokens)
+
+    llm_string = completion_key(llm, stop, params)
+    cached = cache.lookup(prompt, llm_string)
+    if cached:
+        future = Future()
+        future.set_result(cached[0].text)
+        return future
+
+    def save(future):
+        if future.exception() is None:
+            cache.update(prompt, llm_string, [Generation(text=future.result())])
+
+    future = llm.batcher.submit(prompt, stop, max_tokens)
+    future.add_done_callback(save)
+    return future
+
+# Input: Any LangChain LLM, a prompt and per-call sampling parameters such as max_tokens
+# Output: An iterator over the tokens of the completion. Closing it early ends the request,
+#         so the tokens after it are never generated. Completions are looked up in and saved
+#         to the completion cache like LLM calls are, with an early stop saving what was read.
+def stream_completion(llm, prompt, stop=None, **kwargs):
+    from langchain.globals import get_llm_cache
+    from langchain.schema import Generation
+
+    cache = get_llm_cache()
+    params = {key: value for key, value in kwargs.items() if value is not None}
+    llm_string = completion_key(llm, stop, params) if cache is not None else None
+    if cache is not None:
+        cached = cache.lookup(prompt, llm_string)
+        if cached:
+            yield cached[0].text
+            return
+
+    text = ""
+    tokens = llm.stream(prompt, stop=stop, **params)
+    try:
+        for token in tokens:
+            text += token
+            yield token
+    except GeneratorExit:
+        if cache is not None:
+            cache.update(prompt, llm_string, [Generation(text=text)])
+        raise
+    finally:
+        tokens.close()
+    if cache is not None:
+        cache.update(prompt, llm_string, [Generation(text=text)])
+
+SHARED_LLM = None
+SHARED_LLM_LOCK = threading.Lock()
+
+# Output: The BatchedLLM shared by every Character. Set BYTELAND_LLM_BACKEND=local to run offline.
+def get_shared_llm():
+    global SHARED_LLM
+    with SHARED_LLM_LOCK:
+        if SHARED_LLM is None:
+            if os.environ.get('BYTELAND_LLM_BACKEND') == 'local':
+                backend = LocalBackend()
+            else:
+                backend = OpenAIBackend()
+            SHARED_LLM = batched_llm_class()(batcher=PromptBatcher(backend))
+        return SHARED_LLM
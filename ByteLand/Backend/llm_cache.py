@@ -0,0 +1,197 @@
+""" llm_cache.py
+
+File containing the content-addressed cache of LLM completions
+
+"""
+
+import atexit
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langchain.globals import set_llm_cache
+from langchain.schema import Generation
+from langchain.schema.cache import BaseCache
+
+CACHE_MODES = ('cache', 'record', 'replay')
+
+class ReplayMissError(KeyError):
+    """ ReplayMissError()
+
+    Raised in replay mode when a prompt was never recorded
+
+    """
+
+class CompletionCache(BaseCache):
+    """ CompletionCache()
+
+    Class which caches completions keyed by a hash of the prompt and the
+    LLM string LangChain builds from the model name and sampling params.
+    Entries sit in an in-memory LRU in front of a SQLite store that is
+    trimmed back to max_bytes, least recently used first. Hits only note
+    when an entry was used; the notes are written with the next update,
+    flush() or close(), so a hit never waits on a commit.
+
+    Modes:
+        cache  - serve hits, call the API on a miss and store the result
+        record - always call the API and store every completion in order
+        replay - only serve recorded completions and raise on a miss
+
+    Record and replay number repeated prompts, so the n-th time a prompt is
+    sent in a replay it gets the n-th completion from the recording.
+
+    """
+    def __init__(self, path="llm_cache.sqlite", mode="cache", max_entries=1024, max_bytes=64 * 1024 * 1024):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode}, expected one of {CACHE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.memory = OrderedDict()  # (key, occurrence) -> list of Generation
+        self.occurrences = {}        # key -> times seen this run, for record/replay
+        self.accessed = {}           # (key, occurrence) -> last hit not yet written to SQLite
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT, occurrence INTEGER, value TEXT, size INTEGER, accessed REAL, "
+            "PRIMARY KEY (key, occurrence))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed)")
+        self.connection.commit()
+        self.stored_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    @staticmethod
+    def make_key(prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    # Output: The (key, occurrence) slot this request reads from or writes to
+    def _slot(self, prompt, llm_string, advance):
+        key = self.make_key(prompt, llm_string)
+        if self.mode == 'cache':
+            return key, 0
+        occurrence = self.occurrences.get(key, 0)
+        if advance:
+            self.occurrences[key] = occurrence + 1
+        return key, occurrence
+
+    def lookup(self, prompt, llm_string):
+        with self.lock:
+            if self.mode == 'record':
+                self.misses += 1
+                return None
+
+            # Replay advances on lookup since nothing is written back afterwards
+            slot = self._slot(prompt, llm_string, advance=self.mode == 'replay')
+            if slot in self.memory:
+                self.memory.move_to_end(slot)
+                self.accessed[slot] = time.time()
+                self.hits += 1
+                return self.memory[slot]
+
+            row = self.connection.execute(
+                "SELECT value FROM completions WHERE key = ? AND occurrence = ?", slot
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                if self.mode == 'replay':
+                    raise ReplayMissError(f"No recorded completion for prompt: {prompt[:80]!r}")
+                return None
+
+            self.accessed[slot] = time.time()
+            generations = [Generation(**generation) for generation in json.loads(row[0])]
+            self._remember(slot, generations)
+            self.hits += 1
+            return generations
+
+    def update(self, prompt, llm_string, return_val):
+        with self.lock:
+            slot = self._slot(prompt, llm_string, advance=True)
+            value = json.dumps([{'text': generation.text, 'generation_info': generation.generation_info}
+                                for generation in return_val])
+            size = len(value)
+
+            old = self.connection.execute(
+                "SELECT size FROM completions WHERE key = ? AND occurrence = ?", slot
+            ).fetchone()
+            if old is not None:
+                self.stored_bytes -= old[0]
+            self.connection.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)", (*slot, value, size, time.time())
+            )
+            self.stored_bytes += size
+            self._evict()
+            self.connection.commit()
+            self._remember(slot, list(return_val))
+
+    def _remember(self, slot, generations):
+        self.memory[slot] = generations
+        self.memory.move_to_end(slot)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    # Write the pending access times, within the caller's transaction
+    def _write_accessed(self):
+        if self.accessed:
+            self.connection.executemany(
+                "UPDATE completions SET accessed = ? WHERE key = ? AND occurrence = ?",
+                [(accessed, *slot) for slot, accessed in self.accessed.items()]
+            )
+            self.accessed.clear()
+
+    def flush(self):
+        with self.lock:
+            if self.connection is None:
+                return
+            self._write_accessed()
+            self.connection.commit()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _evict(self):
+        self._write_accessed()
+        while self.stored_bytes > self.max_bytes:
+            rows = self.connection.execute(
+                "SELECT key, occurrence, size FROM completions ORDER BY accessed LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self.stored_bytes = 0
+                return
+            for key, occurrence, size in rows:
+                self.connection.execute("DELETE FROM completions WHERE key = ? AND occurrence = ?", (key, occurrence))
+                self.memory.pop((key, occurrence), None)
+                self.stored_bytes -= size
+                if self.stored_bytes <= self.max_bytes:
+                    break
+
+    def clear(self, **kwargs):
+        with self.lock:
+            self.memory.clear()
+            self.occurrences.clear()
+            self.accessed.clear()
+            self.connection.execute("DELETE FROM completions")
+            self.connection.commit()
+            self.stored_bytes = 0
+
+# Input: Where to store completions and which mode to run in ('cache', 'record' or 'replay')
+# Output: The cache, now used by every LangChain LLM including each Character.llm. Its access
+#         times are flushed when the process exits.
+def enable_completion_cache(path="llm_cache.sqlite", mode="cache", **kwargs):
+    cache = CompletionCache(path, mode=mode, **kwargs)
+    set_llm_cache(cache)
+    # Writes the access times of the last hits
+    atexit.register(cache.flush)
+    return cache
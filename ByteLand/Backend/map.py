@@ -4,71 +4,162 @@ File containing the GameMap functionality
 
 """
 
+import numbers
+
 from Backend.utilities import *
+from Backend.events import EventIndex
+from Backend.mapfile import MapFile
+
+# Output: The tile code of a tile character or code, see TILE_CODES
+def tile_code(tile_value):
+    if tile_value in TILE_CODES:
+        return TILE_CODES[tile_value]
+    if isinstance(tile_value, numbers.Integral) and 0 <= tile_value < len(TILE_CHARS):
+        return int(tile_value)
+    raise ValueError(f"Unknown tile {tile_value!r}, expected one of {list(TILE_CHARS)}")
 
 class GameMap:
     """ GameMap()
 
     Class which the design of the GameMap
 
+    With use_array=True the map is stored as a (height, width) uint8 array
+    of tile codes (see TILE_CODES) instead of a list of lists, so boundary
+    and vision operations are vectorized and CollisionMap can share the
+    buffer without copying it. get_nearby_view then gives the tiles around
+    a point as an array view.
+
+    GameMap.open(path) instead backs the map with a map file (see
+    mapfile.py), whose tiles are read from disk as they are used. Tiles are
+    stored as tile codes as in array mode, and the boundaries are already in the file.
+
+    Whichever way the map is stored, get_tile returns a tile character from
+    TILE_CHARS, and set_tile rejects anything that is not one.
+
     """
-    def __init__(self, width, height, tile_size):
+    def __init__(self, width, height, tile_size, use_array=False, chunk_size=16, map_file=None):
         self.width = width
         self.height = height
         self.tile_size = tile_size
-        self.map_data = [[0 for _ in range(width)] for _ in range(height)]
+        self.use_array = use_array
+        self.map_file = map_file
+        self.events = EventIndex(chunk_size)
+        if map_file is not None:
+            self.map_data = map_file
+        elif use_array:
+            # Only array mode needs numpy, so it is not imported with the module
+            import numpy as np
+            self.map_data = np.zeros((height, width), dtype=np.uint8)
+        else:
+            self.map_data = [[0 for _ in range(width)] for _ in range(height)]
+
+    # Input: The path of a map file, and whether tiles may be changed (written through to the file)
+    @classmethod
+    def open(cls, path, writable=False, chunk_size=16):
+        map_file = MapFile(path, writable)
+        return cls(map_file.width, map_file.height, map_file.tile_size, chunk_size=chunk_size, map_file=map_file)
+
+    def close(self):
+        if self.map_file is not None:
+            self.map_file.close()
 
+    # Input: A tile character from TILE_CHARS (or its tile code)
     def set_tile(self, x, y, tile_value):
         if 0 <= x < self.width and 0 <= y < self.height:
-            self.map_data[y][x] = tile_value
+            code = tile_code(tile_value)
+            if self.map_file is not None:
+                self.map_file.set(y, x, code)
+            elif self.use_array:
+                self.map_data[y][x] = code
+            else:
+                self.map_data[y][x] = TILE_CHARS[code]
 
+    # Output: The tile character at (x, y) whichever way the map is stored, or None off the map
     def get_tile(self, x, y):
         if 0 <= x < self.width and 0 <= y < self.height:
-            return self.map_data[y][x]
+            if self.map_file is not None:
+                return TILE_CHARS[self.map_file.get(y, x)]
+            return TILE_CHARS[tile_code(self.map_data[y][x])]
         else:
             return None
 
+    # Output: The clipped (x_min, y_min, x_max, y_max) window of a vision query, max exclusive
+    def nearby_bounds(self, x, y, vision_radius):
+        return (max(x - vision_radius, 0), max(y - vision_radius, 0),
+                min(x + vision_radius + 1, self.width), min(y + vision_radius + 1, self.height))
+
+    # Output: A list of nearby (x, y) coordinates, whichever way the map is stored
     def get_nearby_tiles(self, x, y, vision_radius):
+        x_min, y_min, x_max, y_max = self.nearby_bounds(x, y, vision_radius)
         nearby_tiles = []
-        for i in range(x - vision_radius, x + vision_radius + 1):
-            for j in range(y - vision_radius, y + vision_radius + 1):
-                if 0 <= i < self.width and 0 <= j < self.height:
-                    nearby_tiles.append((i, j))
+        for i in range(x_min, x_max):
+            for j in range(y_min, y_max):
+                nearby_tiles.append((i, j))
         return nearby_tiles
 
-    def set_event(self, x, y, event):
+    # Output: A view of the tile codes in the get_nearby_tiles window, rows by y, whose [0][0]
+    #         entry is the tile at (x_min, y_min) from nearby_bounds. Array mode only.
+    def get_nearby_view(self, x, y, vision_radius):
+        if not self.use_array or self.map_file is not None:
+            raise ValueError("get_nearby_view needs a map made with use_array=True")
+        x_min, y_min, x_max, y_max = self.nearby_bounds(x, y, vision_radius)
+        return self.map_data[y_min:y_max, x_min:x_max]
+
+    # Output: The id of the event, or None if the tile is off the map. The event
+    # is dropped by expire_events once its expires_at time has passed.
+    def set_event(self, x, y, event, expires_at=None):
         if 0 <= x < self.width and 0 <= y < self.height:
-            # You can store events in a dictionary where the key is the tile coordinates (x, y)
-            # and the value is a list of events.
-            if (x, y) not in self.events:
-                self.events[(x, y)] = [event]
-            else:
-                self.events[(x, y)].append(event)
+            return self.events.add(x, y, event, expires_at)
+        return None
+
+    # Input: An iterable of (x, y, event, expires_at), e.g. everything that happened this tick
+    def set_events(self, events):
+        return self.events.add_many((x, y, event, expires_at) for x, y, event, expires_at in events
+                                    if 0 <= x < self.width and 0 <= y < self.height)
 
     def remove_event(self, x, y, event):
-        if (x, y) in self.events and event in self.events[(x, y)]:
-            self.events[(x, y)].remove(event)
+        return self.events.remove_matching(x, y, event)
 
     def get_events(self, x, y):
-        return self.events.get((x, y), [])
+        return self.events.at(x, y)
+
+    # Output: The (x, y, event) of every event in the same window get_nearby_tiles covers
+    def get_nearby_events(self, x, y, vision_radius):
+        return self.events.in_window(*self.nearby_bounds(x, y, vision_radius))
+
+    def expire_events(self, now):
+        return self.events.expire(now)
 
     def set_boundaries(self, opt):
-            for y in range(self.height):
-                for x in range(self.width):
-                    if x == 0 or x == self.width - 1 or y == 0 or y == self.height - 1:
-                        self.map_data[y][x] = '#'
-                    else:
-                        self.map_data[y][x] = ' '
-            self.map_data[opt['coordinates']['TAVERN'][0]][opt['coordinates']['TAVERN'][1]] = '#'
-            self.map_data[opt['coordinates']['TOWNSQUARE'][0]][opt['coordinates']['TOWNSQUARE'][1]] = '#'
-            self.map_data[opt['coordinates']['SMITHY'][0]][opt['coordinates']['SMITHY'][1]] = '#'
-            self.map_data[opt['coordinates']['WIZARD_HOUSE'][0]][opt['coordinates']['WIZARD_HOUSE'][1]] = '#'
-            self.map_data[opt['coordinates']['JESTER_THEATRE'][0]][opt['coordinates']['JESTER_THEATRE'][1]] = '#'
-            self.map_data[opt['coordinates']['GABE_HOUSE'][0]][opt['coordinates']['GABE_HOUSE'][1]] = '#'
-            self.map_data[opt['coordinates']['MARKET'][0]][opt['coordinates']['MARKET'][1]] = '#'
+        if self.map_file is not None:
+            # Drawn when the map file was written, see mapfile.convert_opt
+            return
+        if self.use_array:
+            self.map_data[:, :] = TILE_CODES[' ']
+            self.map_data[[0, -1], :] = TILE_CODES['#']
+            self.map_data[:, [0, -1]] = TILE_CODES['#']
+            if opt['coordinates']:
+                rows, cols = zip(*opt['coordinates'].values())
+                self.map_data[list(rows), list(cols)] = TILE_CODES['#']
+            return
+
+        for y in range(self.height):
+            for x in range(self.width):
+                if x == 0 or x == self.width - 1 or y == 0 or y == self.height - 1:
+                    self.map_data[y][x] = '#'
+                else:
+                    self.map_data[y][x] = ' '
+        for row, col in opt['coordinates'].values():
+            self.map_data[row][col] = '#'
 
     def print_map(self, opt):
         self.set_boundaries(opt)
+        if self.map_file is not None:
+            for y in range(self.height):
+                print(" ".join(TILE_CHARS[code] for code in self.map_file.row(y)))
+            return
         for row in self.map_data:
-            print(" ".join(map(str, row)))
-
+            if self.use_array:
+                print(" ".join(TILE_CHARS[code] for code in row))
+            else:
+                print(" ".join(map(str, row)))
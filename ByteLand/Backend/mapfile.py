@@ -0,0 +1,212 @@
+""" mapfile.py
+
+File containing the binary map format, opened through mmap so maps load lazily
+
+A map file is a header, a table of named locations and the collision layer.
+Every integer is little-endian:
+
+    header     magic b'BYMAP\0\0\0' | version u16 | tile_size u16 | chunk_size u16 | reserved u16 |
+               width u32 | height u32 | location count u32 | reserved u32 |
+               location table offset u64 | tiles offset u64
+    location   row i32 | col i32 | name length u16 | UTF-8 name
+    tiles      one uint8 tile code (see TILE_CODES) per tile, in chunks of chunk_size x
+               chunk_size tiles stored one after another, row by row of chunks. Edge
+               chunks are padded to full size, so any tile's offset is a calculation.
+
+The tiles start on a page boundary and a 64 x 64 chunk is exactly one page,
+so the operating system reads a chunk from disk the first time it is
+touched and can drop it again under memory pressure. Opening a map only
+reads the header and the location table, however large the world is.
+
+Convert the map in configure_opt with:
+
+    python -m Backend.mapfile byteland.bymap
+
+"""
+
+import argparse
+import mmap
+import os
+import struct
+
+from Backend.utilities import TILE_CHARS, TILE_CODES, configure_opt
+
+MAGIC = b'BYMAP\0\0\0'
+VERSION = 1
+HEADER = struct.Struct('<8sHHHHIIIIQQ')
+LOCATION = struct.Struct('<iiH')
+PAGE_SIZE = mmap.ALLOCATIONGRANULARITY
+
+class MapFileError(Exception):
+    pass
+
+class ChunkedCells:
+    """ ChunkedCells()
+
+    Flat view of a map file's tiles, indexed by row * width + col like the
+    buffer CollisionMap searches, which reads through to the chunks
+
+    """
+    __slots__ = ('map_file', 'width')
+
+    def __init__(self, map_file):
+        self.map_file = map_file
+        self.width = map_file.width
+
+    def __len__(self):
+        return self.map_file.width * self.map_file.height
+
+    def __getitem__(self, index):
+        row, col = divmod(index, self.width)
+        return self.map_file.data[self.map_file.offset(row, col)]
+
+    def __setitem__(self, index, code):
+        row, col = divmod(index, self.width)
+        self.map_file.data[self.map_file.offset(row, col)] = code
+
+class MapFile:
+    """ MapFile()
+
+    Class which opens a map file through mmap. Tiles are read and written
+    in place (writes need writable=True), so nothing is loaded until it is
+    used. chunk() hands out zero-copy views of whole chunks and records
+    which ones have been touched.
+
+    """
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        self.file = open(path, 'r+b' if writable else 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+        if len(self.data) < HEADER.size:
+            self.close()
+            raise MapFileError(f"{path} is too short to be a map file")
+        (magic, version, self.tile_size, self.chunk_size, _, self.width, self.height,
+         location_count, _, locations_offset, self.tiles_offset) = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.close()
+            raise MapFileError(f"{path} is not a map file")
+        if version > VERSION:
+            self.close()
+            raise MapFileError(f"{path} is version {version}, this build reads up to {VERSION}")
+
+        self.chunks_x = -(-self.width // self.chunk_size)
+        self.chunks_y = -(-self.height // self.chunk_size)
+        self.chunk_bytes = self.chunk_size * self.chunk_size
+        self.locations = read_locations(self.data, locations_offset, location_count)
+        self.loaded = {}  # (chunk x, chunk y) -> view of the chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.loaded = {}
+        if not self.data.closed:
+            self.data.close()
+        self.file.close()
+
+    # Output: The byte offset of the tile at (row, col)
+    def offset(self, row, col):
+        size = self.chunk_size
+        chunk = (row // size) * self.chunks_x + col // size
+        return self.tiles_offset + chunk * self.chunk_bytes + (row % size) * size + col % size
+
+    def get(self, row, col):
+        return self.data[self.offset(row, col)]
+
+    def set(self, row, col, code):
+        self.data[self.offset(row, col)] = code
+
+    # Output: A chunk_size * chunk_size view of the chunk's tile codes, row by row
+    def chunk(self, chunk_x, chunk_y):
+        view = self.loaded.get((chunk_x, chunk_y))
+        if view is None:
+            start = self.tiles_offset + (chunk_y * self.chunks_x + chunk_x) * self.chunk_bytes
+            view = memoryview(self.data)[start:start + self.chunk_bytes]
+            self.loaded[(chunk_x, chunk_y)] = view
+        return view
+
+    # Output: The tile codes of one row
+    def row(self, row):
+        size = self.chunk_size
+        start = (row % size) * size
+        codes = bytearray()
+        for chunk_x in range(self.chunks_x):
+            codes += self.chunk(chunk_x, row // size)[start:start + size]
+        return bytes(codes[:self.width])
+
+    def flat_cells(self):
+        return ChunkedCells(self)
+
+    # Input: Where to write, the size of the world, {name: (row, col)} and the chunk size
+    # Output: The path. Tiles start as TILE_CODES[' ']; the file is sparse where the OS allows,
+    #         so a world larger than memory is created without writing every tile.
+    @staticmethod
+    def create(path, width, height, tile_size=1, locations=None, chunk_size=64):
+        locations = locations or {}
+        table = b''.join(LOCATION.pack(row, col, len(name.encode('utf-8'))) + name.encode('utf-8')
+                         for name, (row, col) in locations.items())
+        tiles_offset = -(-(HEADER.size + len(table)) // PAGE_SIZE) * PAGE_SIZE
+        chunks = -(-width // chunk_size) * -(-height // chunk_size)
+        with open(path, 'wb') as map_file:
+            map_file.write(HEADER.pack(MAGIC, VERSION, tile_size, chunk_size, 0, width, height,
+                                       len(locations), 0, HEADER.size, tiles_offset))
+            map_file.write(table)
+            map_file.truncate(tiles_offset + chunks * chunk_size * chunk_size)
+        return path
+
+def read_locations(data, offset, count):
+    locations = {}
+    for _ in range(count):
+        row, col, length = LOCATION.unpack_from(data, offset)
+        offset += LOCATION.size
+        locations[bytes(data[offset:offset + length]).decode('utf-8')] = (row, col)
+        offset += length
+    return locations
+
+# Input: The options from configure_opt and where to write the map
+# Output: The path, holding the same boundaries GameMap.set_boundaries draws
+def convert_opt(opt, path, chunk_size=64):
+    width, height = opt['map_width'], opt['map_height']
+    MapFile.create(path, width, height, opt['tile_size'], opt['coordinates'], chunk_size)
+    wall = TILE_CODES[opt['collision_char']]
+    with MapFile(path, writable=True) as map_file:
+        for col in range(width):
+            map_file.set(0, col, wall)
+            map_file.set(height - 1, col, wall)
+        for row in range(height):
+            map_file.set(row, 0, wall)
+            map_file.set(row, width - 1, wall)
+        for row, col in opt['coordinates'].values():
+            map_file.set(row, col, wall)
+        map_file.data.flush()
+    return path
+
+# Output: The options from configure_opt, with the size and locations read from the map file
+def configure_opt_from_map(path):
+    opt = configure_opt({})
+    with MapFile(path) as map_file:
+        opt['map_width'] = map_file.width
+        opt['map_height'] = map_file.height
+        opt['tile_size'] = map_file.tile_size
+        opt['coordinates'] = dict(map_file.locations)
+    opt['map_file'] = path
+    return opt
+
+def print_map_file(map_file):
+    for row in range(map_file.height):
+        print(" ".join(TILE_CHARS[code] for code in map_file.row(row)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the map in configure_opt to a map file")
+    parser.add_argument('path', help="Map file to write")
+    parser.add_argument('--chunk-size', type=int, default=64, help="Width and height of a chunk in tiles")
+    args = parser.parse_args()
+    convert_opt(configure_opt({}), args.path, args.chunk_size)
+    with MapFile(args.path) as map_file:
+        print_map_file(map_file)
+        print(f"Wrote {os.path.getsize(args.path)} bytes to {args.path}")
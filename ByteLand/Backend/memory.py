@@ -0,0 +1,282 @@
+""" memory.py
+
+File containing the retrieval-based memory stream of the AI agents
+
+"""
+
+import hashlib
+import math
+import re
+import threading
+import time
+import uuid
+from typing import Any
+
+from Backend.tracing import TRACER
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+# Words which make an observation worth remembering for longer
+IMPORTANT_WORDS = {'talk', 'said', 'replied', 'met', 'meet', 'prank', 'newcomer', 'smith', 'wizard', 'stoptalking'}
+
+REFLECTION_TEMPLATE = 'Summarize what {name} has experienced in a few sentences:\n{memories}\nSummary:'
+
+class HashingEmbedder:
+    """ HashingEmbedder()
+
+    Class which embeds text locally with the hashing trick: every word adds
+    +1 or -1 to one of dim buckets and the vector is normalized. It needs no
+    model or network and can be passed to chromadb as an embedding function.
+
+    """
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, text):
+        vector = [0.0] * self.dim
+        for word in WORD_PATTERN.findall(text.lower()):
+            digest = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), 'little')
+            vector[digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def __call__(self, input):
+        return [self.embed(text) for text in input]
+
+class LocalIndex:
+    """ LocalIndex()
+
+    Class which keeps embeddings in a list and searches them by brute force.
+    Used when chromadb is not installed.
+
+    """
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.vectors = []
+
+    def add(self, memory_id, text):
+        self.vectors.append((memory_id, self.embedder([text])[0]))
+
+    # Output: Up to n (memory id, cosine distance) pairs, closest first
+    def query(self, text, n):
+        query = self.embedder([text])[0]
+        scored = [(memory_id, 1.0 - sum(a * b for a, b in zip(query, vector))) for memory_id, vector in self.vectors]
+        scored.sort(key=lambda pair: pair[1])
+        return scored[:n]
+
+CHROMA_CLIENT = None
+
+class ChromaIndex:
+    """ ChromaIndex()
+
+    Class which stores one agent's memory embeddings in a chromadb collection
+
+    """
+    def __init__(self, embedder):
+        global CHROMA_CLIENT
+        import chromadb
+
+        if CHROMA_CLIENT is None:
+            CHROMA_CLIENT = chromadb.EphemeralClient()
+        self.collection = CHROMA_CLIENT.create_collection(
+            f"memory-{uuid.uuid4().hex}", embedding_function=embedder, metadata={'hnsw:space': 'cosine'}
+        )
+
+    def add(self, memory_id, text):
+        self.collection.add(ids=[str(memory_id)], documents=[text])
+
+    def query(self, text, n):
+        n = min(n, self.collection.count())
+        if n == 0:
+            return []
+        result = self.collection.query(query_texts=[text], n_results=n, include=['distances'])
+        return [(int(memory_id), distance) for memory_id, distance in zip(result['ids'][0], result['distances'][0])]
+
+def make_index(embedder):
+    try:
+        return ChromaIndex(embedder)
+    except ImportError:
+        return LocalIndex(embedder)
+
+# Input: An observation
+# Output: How important it is, from 1 (mundane) to 10 (life changing)
+def score_importance(text):
+    words = set(WORD_PATTERN.findall(text.lower()))
+    return min(10, 2 + 2 * len(words & IMPORTANT_WORDS))
+
+class MemoryStream:
+    """ MemoryStream()
+
+    Class which holds everything an agent has observed. Observations are kept
+    in columns (text, timestamp, importance) and embedded into an index. A
+    retrieval ranks candidates by recency, importance and relevance. Every
+    reflect_every observations, the recent ones are summarized into a single
+    reflection on a background thread. Restored memories are embedded on
+    the first retrieval instead of up front.
+
+    """
+    def __init__(self, name, embedder=None, index=None, llm=None, reflect_every=20, decay=0.995):
+        self.name = name
+        self.embedder = embedder or HashingEmbedder()
+        self.index = index or make_index(self.embedder)
+        self.llm = llm
+        self.reflect_every = reflect_every
+        self.decay = decay  # Recency multiplier per hour since the memory was made
+
+        self.texts = []
+        self.timestamps = []
+        self.importance = []
+        self.indexed = 0  # Memories before this id are in the index
+        self.lock = threading.Lock()
+        self.unreflected = 0
+        self.reflecting = False
+
+    def __len__(self):
+        return len(self.texts)
+
+    def clear(self):
+        with self.lock:
+            self.texts = []
+            self.timestamps = []
+            self.importance = []
+            self.index = make_index(self.embedder)
+            self.indexed = 0
+            self.unreflected = 0
+
+    # Input: The columns of a saved stream, e.g. from a checkpoint
+    def restore(self, texts, timestamps, importance):
+        with self.lock:
+            if self.indexed:
+                self.index = make_index(self.embedder)
+            self.texts = list(texts)
+            self.timestamps = list(timestamps)
+            self.importance = list(importance)
+            self.indexed = 0
+            self.unreflected = 0
+
+    # Embed the memories which are not in the index yet. Called with the lock held.
+    def index_pending(self):
+        for memory_id in range(self.indexed, len(self.texts)):
+            self.index.add(memory_id, self.texts[memory_id])
+        self.indexed = len(self.texts)
+
+    def add(self, text, importance=None, timestamp=None):
+        with self.lock:
+            memory_id = len(self.texts)
+            self.texts.append(text)
+            self.timestamps.append(time.time() if timestamp is None else timestamp)
+            self.importance.append(score_importance(text) if importance is None else importance)
+            if self.indexed == memory_id:
+                self.index.add(memory_id, text)
+                self.indexed += 1
+            self.unreflected += 1
+            reflect = self.llm is not None and self.unreflected >= self.reflect_every and not self.reflecting
+            if reflect:
+                self.reflecting = True
+                recent = self.texts[-self.unreflected:]
+                self.unreflected = 0
+        if reflect:
+            threading.Thread(target=self.reflect, args=(recent,), daemon=True).start()
+        return memory_id
+
+    # Summarize a batch of memories into a single important memory
+    def reflect(self, memories):
+        try:
+            with TRACER.span('memory.reflect', agent=self.name, memories=len(memories)):
+                summary = self.llm(REFLECTION_TEMPLATE.format(name=self.name, memories="\n".join(memories)))
+                self.add(summary.strip(), importance=8)
+        except Exception as exception:
+            print(f"{self.name} failed to reflect: {exception}")
+        finally:
+            self.reflecting = False
+
+    # Output: The k best memories for the query, oldest first
+    def retrieve(self, query, k=5):
+        with self.lock, TRACER.span('memory.retrieve', agent=self.name, memories=len(self.texts)):
+            if not self.texts:
+                return []
+            self.index_pending()
+            now = time.time()
+            candidates = self.index.query(query, max(4 * k, 20))
+            scored = []
+            for memory_id, distance in candidates:
+                hours = (now - self.timestamps[memory_id]) / 3600
+                score = self.decay ** hours + self.importance[memory_id] / 10 + (1.0 - distance)
+                scored.append((score, memory_id))
+            best = sorted(memory_id for _, memory_id in sorted(scored, reverse=True)[:k])
+            return [self.texts[memory_id] for memory_id in best]
+
+STREAM_MEMORY_CLASS = None
+STREAM_MEMORY_LOCK = threading.Lock()
+
+# Output: The StreamMemory class, defined the first time it is asked for so that
+#         importing this module does not load LangChain
+def stream_memory_class():
+    global STREAM_MEMORY_CLASS
+    with STREAM_MEMORY_LOCK:
+        if STREAM_MEMORY_CLASS is None:
+            STREAM_MEMORY_CLASS = define_stream_memory()
+        return STREAM_MEMORY_CLASS
+
+def define_stream_memory():
+    from langchain.schema import BaseMemory
+
+    class StreamMemory(BaseMemory):
+        """ StreamMemory()
+
+        LangChain memory which fills {history} from a MemoryStream instead of a
+        running summary, so no extra LLM call is made after each turn
+
+        """
+        stream: Any
+        memory_key: str = 'history'
+        input_key: str = 'input'
+        ai_prefix: str = 'AI'
+        k: int = 5
+        counter: Any = None     # Token counter used to enforce token_budget
+        token_budget: Any = None  # Most tokens the history may use, or None for no limit
+        last_tokens: int = 0
+
+        @property
+        def memory_variables(self):
+            return [self.memory_key]
+
+        def load_memory_variables(self, inputs):
+            query = " ".join(str(value) for key, value in inputs.items() if key not in ('bio', 'stop', self.input_key))
+            memories = self.stream.retrieve(query, self.k)
+
+            if self.counter is None:
+                history = "\n".join(memories)
+                return {self.memory_key: history}
+
+            # Drop the oldest memories until the history fits in the budget
+            sizes = [self.counter.count(memory) + 1 for memory in memories]
+            total = sum(sizes)
+            start = 0
+            while self.token_budget is not None and total > self.token_budget and start < len(memories):
+                total -= sizes[start]
+                start += 1
+            self.last_tokens = total
+            return {self.memory_key: "\n".join(memories[start:])}
+
+        def save_context(self, inputs, outputs):
+            output = next(iter(outputs.values())).strip()
+            if inputs.get('other_char'):
+                observation = f"At {inputs.get('location')}, {inputs['other_char']} said \"{inputs.get('prev_dialogue', '')}\" and {self.ai_prefix} replied \"{output}\""
+            else:
+                observation = f"At {inputs.get('location')} with {inputs.get('people') or 'nobody'}, {self.ai_prefix} chose {output}"
+            with TRACER.span('memory.save', agent=self.stream.name):
+                self.stream.add(observation)
+
+        def clear(self):
+            self.stream.clear()
+
+    # Named as if it were defined at the top of the module, so its instances pickle
+    StreamMemory.__qualname__ = 'StreamMemory'
+    return StreamMemory
+
+# Lets `from Backend.memory import StreamMemory` define the class
+def __getattr__(name):
+    if name == 'StreamMemory':
+        return stream_memory_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
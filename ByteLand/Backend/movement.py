@@ -0,0 +1,381 @@
+""" movement.py
+
+File containing the tick-based movement of entities with cooperative pathfinding
+
+"""
+
+import heapq
+from collections import deque
+
+from Backend.tracing import TRACER
+
+# Moves in space-time: the four neighbours and waiting in place
+STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1), (0, 0))
+
+class ReservationTable:
+    """ ReservationTable()
+
+    Class which records which agent will stand on which tile at which tick,
+    and which edge it crosses to get there. The last reserved tile of each
+    agent stays held from that tick on, until the agent reserves further,
+    so nobody plans through a tile someone will still be standing on.
+    Shared tiles (named locations, which are buildings) never conflict,
+    but two agents may never swap tiles, not even with a building.
+
+    """
+    def __init__(self, shared=()):
+        self.slots = {}    # tick -> {(row, col): name}
+        self.edges = {}    # tick -> {((row, col), (row, col)): name} for a move from tick to tick + 1
+        self.resting = {}  # (row, col) -> (name, tick it is held from)
+        self.rest_of = {}  # name -> (row, col)
+        self.shared = set(shared)
+
+    # Input: Who, the tick they stand on cell and the cell they stood on the tick before
+    def reserve(self, name, tick, cell, previous=None):
+        if cell not in self.shared:
+            self.slots.setdefault(tick, {})[cell] = name
+        if previous is not None and previous != cell:
+            self.edges.setdefault(tick - 1, {})[(previous, cell)] = name
+
+    # Hold the agent's last reserved tile from the tick on
+    def rest(self, name, tick, cell):
+        self.unrest(name)
+        if cell not in self.shared:
+            self.resting[cell] = (name, tick)
+            self.rest_of[name] = cell
+
+    def unrest(self, name):
+        cell = self.rest_of.pop(name, None)
+        if cell is not None and self.resting.get(cell, (None,))[0] == name:
+            del self.resting[cell]
+
+    def owner(self, tick, cell):
+        slot = self.slots.get(tick)
+        return slot.get(cell) if slot else None
+
+    # Output: True if name may move from cell to next_cell between tick and tick + 1
+    def is_free(self, name, tick, cell, next_cell):
+        if next_cell not in self.shared:
+            owner = self.owner(tick + 1, next_cell)
+            if owner is not None and owner != name:
+                return False
+            rest = self.resting.get(next_cell)
+            if rest is not None and rest[0] != name and tick + 1 >= rest[1]:
+                return False
+        # Two agents may not swap tiles, head-on or with a building
+        if cell != next_cell:
+            edges = self.edges.get(tick)
+            other = edges.get((next_cell, cell)) if edges else None
+            if other is not None and other != name:
+                return False
+        return True
+
+    # Output: True if name may stay on cell from the tick on, so nobody has reserved it later
+    def can_rest(self, name, tick, cell):
+        if cell in self.shared:
+            return True
+        for later, slot in self.slots.items():
+            if later >= tick and slot.get(cell, name) != name:
+                return False
+        rest = self.resting.get(cell)
+        return rest is None or rest[0] == name
+
+    def release(self, name):
+        self.unrest(name)
+        for reserved in (self.slots, self.edges):
+            for slot in reserved.values():
+                for key in [key for key, owner in slot.items() if owner == name]:
+                    del slot[key]
+
+    # Drop every reservation before the tick
+    def prune(self, tick):
+        for old in [old for old in self.slots if old < tick]:
+            del self.slots[old]
+        for old in [old for old in self.edges if old < tick]:
+            del self.edges[old]
+
+class Walker:
+    """ Walker()
+
+    The movement state of one character: the remaining static path to its
+    destination, the cells it has reserved for the coming ticks and how
+    long it has been stuck
+
+    """
+    def __init__(self, character, goal, location, path):
+        self.character = character
+        self.goal = goal
+        self.location = location
+        self.path = deque(path)    # cells still to walk after the reserved ones
+        self.planned = deque()     # reserved cells for the next ticks, in order
+        self.waiting = 0           # steps in a row it has not moved
+        self.yielding_to = None    # name of the walker it last stepped aside for
+        self.pushed_by = None      # name of a yielding walker which needs its tile
+
+class MovementSystem:
+    """ MovementSystem()
+
+    Class which walks characters one tile per step along stored paths.
+    Conflicts are resolved with a space-time reservation table in the style
+    of windowed cooperative A* (WHCA*). Every `window` steps each walker
+    reserves its next cells. If the stored path is free it is reserved as
+    it is. If not, a space-time A* runs only from the walker to a waypoint
+    window tiles ahead, and its result is spliced into the stored path.
+    Walkers are planned in name order so runs are repeatable, and a walker
+    with no conflict-free move waits in place. After `patience` steps
+    without moving it searches the whole map for a path around the other
+    walkers. If there is none, as when two walkers meet head-on in a
+    corridor, the later name yields: it steps aside, off the other's route
+    where it can, and pushes back whoever stands behind it if it cannot. In
+    a dead end the other walker makes room instead. Walkers only stop on
+    tiles nobody will walk through later, so they never share a tile.
+
+    """
+    def __init__(self, collision_map, shared=(), window=8, patience=3):
+        self.collision_map = collision_map
+        self.window = window
+        self.patience = patience
+        self.table = ReservationTable(shared)
+        self.walkers = {}
+        self.time = 0
+
+        # Movement statistics
+        self.local_repaths = 0
+        self.waits = 0
+        self.full_repaths = 0
+        self.yields = 0
+
+    def __len__(self):
+        return len(self.walkers)
+
+    def is_moving(self, name):
+        return name in self.walkers
+
+    # Input: The character, the (row, col) it should walk to and the location name it arrives at
+    # Output: The static path it will follow, or None if the goal cannot be reached
+    def set_destination(self, character, goal, location=None):
+        self.cancel(character.name)
+        start = tuple(character.coordinates)
+        path = self.collision_map.find_path(start, goal)
+        if not path:
+            return None
+        self.walkers[character.name] = Walker(character, tuple(goal), location, path[1:])
+        # Hold the tile it stands on until it plans, so nobody walks into it first
+        self.table.rest(character.name, self.time, start)
+        return path
+
+    def cancel(self, name):
+        if self.walkers.pop(name, None) is not None:
+            self.table.release(name)
+
+    # Advance every walker one tile
+    # Output: The walkers which arrived at their goal this step
+    def step(self):
+        with TRACER.span('movement.step', walkers=len(self.walkers)):
+            tick = self.time
+            self.table.prune(tick)
+            for name in sorted(self.walkers):
+                walker = self.walkers[name]
+                if not walker.planned:
+                    self.plan(walker, tick)
+
+            arrived = []
+            for name in sorted(self.walkers):
+                walker = self.walkers[name]
+                position = tuple(walker.character.coordinates)
+                walker.character.coordinates = walker.planned.popleft()
+                walker.waiting = walker.waiting + 1 if walker.character.coordinates == position else 0
+                if not walker.planned and not walker.path and walker.character.coordinates == walker.goal:
+                    arrived.append(walker)
+            for walker in arrived:
+                self.cancel(walker.character.name)
+
+            self.time += 1
+            return arrived
+
+    # Reserve the walker's cells for the next window ticks
+    def plan(self, walker, tick):
+        position = tuple(walker.character.coordinates)
+        if walker.pushed_by is not None or walker.yielding_to is not None or walker.waiting >= self.patience:
+            if self.unstick(walker, tick, position):
+                return
+
+        ahead = list(walker.path)[:self.window]
+        if not ahead:
+            self.wait(walker, tick, position)
+            return
+
+        # Fast path: the stored path is free for the whole window
+        cell = position
+        for offset, next_cell in enumerate(ahead):
+            if not self.table.is_free(walker.character.name, tick + offset, cell, next_cell):
+                break
+            cell = next_cell
+        else:
+            if self.table.can_rest(walker.character.name, tick + len(ahead), ahead[-1]):
+                self.reserve(walker, tick, position, ahead)
+                for _ in ahead:
+                    walker.path.popleft()
+                return
+
+        # Local repath: head for the waypoint at the end of the window without conflicts
+        self.local_repaths += 1
+        segment, reached = self.space_time_search(walker.character.name, position, ahead[-1], tick)
+        if not segment:
+            self.wait(walker, tick, position)
+            return
+        for _ in ahead:
+            walker.path.popleft()
+        if not reached:
+            # Only part of the way there, so bridge from where the segment ends back to the waypoint
+            bridge = self.collision_map.find_path(segment[-1], ahead[-1])
+            walker.path.extendleft(reversed(bridge[1:]))
+        self.reserve(walker, tick, position, segment)
+
+    # Reserve the cells the walker steps through from the tick on and hold the last one
+    def reserve(self, walker, tick, position, cells):
+        previous = position
+        for offset, next_cell in enumerate(cells):
+            self.table.reserve(walker.character.name, tick + offset + 1, next_cell, previous)
+            previous = next_cell
+        self.table.rest(walker.character.name, tick + len(cells), cells[-1])
+        walker.planned.extend(cells)
+
+    def wait(self, walker, tick, position):
+        self.waits += 1
+        self.table.reserve(walker.character.name, tick + 1, position)
+        self.table.rest(walker.character.name, tick + 1, position)
+        walker.planned.append(position)
+
+    # Output: The first other walker standing on the walker's path within the window, if any
+    def blocker(self, walker):
+        standing = {tuple(other.character.coordinates): other for other in self.walkers.values() if other is not walker}
+        for cell in list(walker.path)[:self.window]:
+            if cell in standing and cell not in self.table.shared:
+                return standing[cell]
+        return None
+
+    # Output: True if either walker stands on the other's way within the window
+    def in_way(self, walker, other):
+        return (tuple(other.character.coordinates) in list(walker.path)[:self.window] or
+                tuple(walker.character.coordinates) in list(other.planned) + list(other.path)[:self.window])
+
+    # Get a walker which has not moved for a while going again
+    # Output: True if its cells for the next tick are reserved, False to plan as usual
+    def unstick(self, walker, tick, position):
+        name = walker.character.name
+        pusher = self.walkers.get(walker.pushed_by)
+        walker.pushed_by = None
+        yielding = self.walkers.get(walker.yielding_to)
+        if yielding is None or not self.in_way(walker, yielding):
+            walker.yielding_to = yielding = None
+        if pusher is not None or yielding is not None:
+            return self.step_aside(walker, tick, position, pusher or yielding, pusher is None)
+
+        if walker.waiting < self.patience:
+            return False
+        if walker.waiting % self.patience == 0:
+            # Search the whole map again, treating the other walkers where they stand as walls
+            self.full_repaths += 1
+            occupied = {tuple(other.character.coordinates) for other in self.walkers.values() if other is not walker}
+            path = self.collision_map.find_path(position, walker.goal, obstacles=occupied - self.table.shared)
+            # The goal is always enterable, so a path straight into a walker on it is no way around
+            if len(path) > 1 and path[1] not in occupied:
+                walker.path = deque(path[1:])
+                return False
+
+        # The earlier name has priority, so only the later one of the two steps aside,
+        # unless the earlier one is already making room for it
+        blocker = self.blocker(walker)
+        if blocker is None or blocker.character.name > name or blocker.yielding_to == name:
+            return False
+        walker.yielding_to = blocker.character.name
+        return self.step_aside(walker, tick, position, blocker, True)
+
+    # Move the walker off the other walker's route, or if it cannot, further along it away
+    # from the other walker. With nowhere to go it pushes whoever stands next to it, and the
+    # other walker has to make room instead (unless the other only pushed it).
+    # Output: True, as its cell for the next tick is reserved either way
+    def step_aside(self, walker, tick, position, other, may_swap):
+        name = walker.character.name
+        route = set(other.planned) | set(list(other.path)[:self.window]) | {tuple(other.character.coordinates)}
+        other_row, other_col = other.character.coordinates
+        options = []
+        occupants = []
+        for d_row, d_col in STEPS[:4]:
+            cell = (position[0] + d_row, position[1] + d_col)
+            if not self.collision_map.in_bounds(cell) or (self.collision_map.is_blocked(cell) and cell not in self.table.shared):
+                continue
+            if cell == tuple(other.character.coordinates):
+                continue
+            if self.table.is_free(name, tick, position, cell) and self.table.can_rest(name, tick + 1, cell):
+                options.append((cell in route, -abs(cell[0] - other_row) - abs(cell[1] - other_col), cell))
+                continue
+            occupant = next((candidate for candidate in self.walkers.values() if tuple(candidate.character.coordinates) == cell), None)
+            if occupant is not None:
+                occupants.append((cell in route, occupant.character.name))
+
+        if not options:
+            if occupants:
+                self.walkers[min(occupants)[1]].pushed_by = name
+            if may_swap:
+                other.yielding_to = name
+                walker.yielding_to = None
+            self.wait(walker, tick, position)
+            return True
+
+        self.yields += 1
+        aside = min(options)[2]
+        self.reserve(walker, tick, position, [aside])
+        walker.path = deque(self.collision_map.find_path(aside, walker.goal)[1:])
+        return True
+
+    # Input: Who is searching, from where, towards which waypoint and from which tick
+    # Output: (cells from (not including) start, whether they reach the goal). If the goal
+    #         cannot be reached within the window the cells lead to the closest tile reached.
+    #         Either way the last cell is one the walker may stay on afterwards.
+    def space_time_search(self, name, start, goal, tick):
+        collision_map = self.collision_map
+        table = self.table
+        goal_row, goal_col = goal
+
+        def heuristic(cell):
+            return abs(cell[0] - goal_row) + abs(cell[1] - goal_col)
+
+        open_heap = [(heuristic(start), 0, start)]
+        came_from = {(start, 0): None}
+        best = (heuristic(start), 0, start)
+        while open_heap:
+            _, elapsed, cell = heapq.heappop(open_heap)
+            if cell == goal:
+                if table.can_rest(name, tick + elapsed, cell):
+                    return self.unwind(came_from, (cell, elapsed)), True
+            else:
+                candidate = (heuristic(cell), elapsed, cell)
+                if candidate < best and table.can_rest(name, tick + elapsed, cell):
+                    best = candidate
+            if elapsed >= self.window:
+                continue
+            for d_row, d_col in STEPS:
+                next_cell = (cell[0] + d_row, cell[1] + d_col)
+                state = (next_cell, elapsed + 1)
+                if state in came_from or not collision_map.in_bounds(next_cell):
+                    continue
+                if next_cell != goal and next_cell != cell and collision_map.is_blocked(next_cell):
+                    continue
+                if not table.is_free(name, tick + elapsed, cell, next_cell):
+                    continue
+                came_from[state] = (cell, elapsed)
+                heapq.heappush(open_heap, (elapsed + 1 + heuristic(next_cell), elapsed + 1, next_cell))
+
+        _, elapsed, cell = best
+        return self.unwind(came_from, (cell, elapsed)), False
+
+    @staticmethod
+    def unwind(came_from, state):
+        segment = []
+        while came_from[state] is not None:
+            segment.append(state[0])
+            state = came_from[state]
+        segment.reverse()
+        return segment
@@ -4,76 +4,33 @@ File containing the Entity Pathfinding functionality
 
 """
 
+import heapq
+import math
+
+from Backend.tracing import TRACER
+from Backend.utilities import TILE_CODES
+
+SQRT2 = math.sqrt(2)
+
+# (row offset, column offset, step length) for every move an entity can make
+ORTHOGONAL_MOVES = ((-1, 0, 1.0), (1, 0, 1.0), (0, -1, 1.0), (0, 1, 1.0))
+DIAGONAL_MOVES = ((-1, -1, SQRT2), (-1, 1, SQRT2), (1, -1, SQRT2), (1, 1, SQRT2))
+
 def print_maze(maze):
     for row in maze:
         for item in row:
             print(item, end='')
         print()
 
+# Input: A maze, the start and end (row, col) positions and the character that blocks movement
+# Output: The shortest path from start to end as a list of (row, col), or False if there is none
 def path_finder(maze, start, end, collision_block_char, verbose=False):
-    def prepare_maze(maze, start, end):
-        maze[start[0]][start[1]] = "S"
-        maze[end[0]][end[1]] = "E"
-        return maze
-
-    def find_start(maze):
-        for row in range(len(maze)):
-            for col in range(len(maze[0])):
-                if maze[row][col] == 'S':
-                    return row, col
-
-    def is_valid_position(maze, pos_r, pos_c):
-        if pos_r < 0 or pos_c < 0:
-            return False
-        if pos_r >= len(maze) or pos_c >= len(maze[0]):
-            return False
-        if maze[pos_r][pos_c] in ' E':
-            return True
-        return False
-
-    def solve_maze(maze, start, verbose=False):
-        path = []
-        stack = []
-        stack.append(start)
-        while len(stack) > 0:
-            pos_r, pos_c = stack.pop()
-            if verbose:
-                print("Current position", pos_r, pos_c)
-            if maze[pos_r][pos_c] == 'E':
-                path += [(pos_r, pos_c)]
-                return path
-            if maze[pos_r][pos_c] == 'X':
-                continue
-            maze[pos_r][pos_c] = 'X'
-            path += [(pos_r, pos_c)]
-            if is_valid_position(maze, pos_r - 1, pos_c):
-                stack.append((pos_r - 1, pos_c))
-            if is_valid_position(maze, pos_r + 1, pos_c):
-                stack.append((pos_r + 1, pos_c))
-            if is_valid_position(maze, pos_r, pos_c - 1):
-                stack.append((pos_r, pos_c - 1))
-            if is_valid_position(maze, pos_r, pos_c + 1):
-                stack.append((pos_r, pos_c + 1))
-            if verbose:
-                print('Stack:', stack)
-                print_maze(maze)
-        return False
-
-    new_maze = []
-    for row in maze:
-        new_row = []
-        for j in row:
-            if j == collision_block_char:
-                new_row += ["#"]
-            else:
-                new_row += [" "]
-        new_maze += [new_row]
-
-    maze = new_maze
-    maze = prepare_maze(maze, start, end)
-    start = find_start(maze)
-    path = solve_maze(maze, start, verbose)
-    return path
+    collision_map = CollisionMap(maze, collision_block_char)
+    path = collision_map.find_path(start, end)
+    if verbose:
+        print(f"Nodes expanded: {collision_map.nodes_expanded}")
+        print_maze_with_path(maze, path)
+    return path or False
 
 def print_maze_with_path(maze, path):
     path_set = set(path)  # Convert the path list into a set for faster membership checks
@@ -90,24 +47,157 @@ class CollisionMap:
 
     Class which controls the pathfinding of entities on the map
 
+    The maze is flattened into a blocked-cell buffer once, and every search
+    runs A* over that buffer. An array-backed maze (GameMap with
+    use_array=True) is read in place, so later tile changes are seen
+    without calling build() again, and so is a map file (see mapfile.py),
+    whose chunks are only read from disk when the search reaches them. Weights are an optional per-tile cost of
+    entering a tile (a 2D list the size of the maze), all of which must be
+    at least 1 for the heuristic to stay admissible.
+
     """
-    def __init__(self, maze, collision_block_char):
+    def __init__(self, maze, collision_block_char, diagonal=False, weights=None):
         self.maze = maze
         self.collision_block_char = collision_block_char
+        self.diagonal = diagonal
+        self.weights = weights
 
-    def find_path(self, start, end):
-        pathfinding_maze = self.convert_to_pathfinding_format()
-        path = path_finder(pathfinding_maze, start, end, self.collision_block_char)
-        return path
+        # Search statistics
+        self.nodes_expanded = 0
+        self.total_nodes_expanded = 0
+        self.searches = 0
+
+        self.build()
+
+    # Rebuild the search grid. Call this after the underlying maze changes.
+    def build(self):
+        if hasattr(self.maze, 'flat_cells'):
+            # A map file: the search reads its chunks as it reaches them
+            self.height, self.width = self.maze.height, self.maze.width
+            self.cells = self.maze.flat_cells()
+            self.blocked = TILE_CODES.get(self.collision_block_char, self.collision_block_char)
+        else:
+            self.height = len(self.maze)
+            self.width = len(self.maze[0]) if self.height else 0
+            if hasattr(self.maze, 'dtype'):
+                # Zero-copy flat view over the map's tile codes
+                self.cells = memoryview(self.maze).cast('B')
+                self.blocked = TILE_CODES.get(self.collision_block_char, self.collision_block_char)
+            else:
+                self.cells = self.convert_to_pathfinding_format()
+                self.blocked = 1
+
+        if self.weights is None:
+            self.costs = None
+            self.min_cost = 1.0
+        else:
+            self.costs = [float(cost) for row in self.weights for cost in row]
+            self.min_cost = min(self.costs) if self.costs else 1.0
+            if self.min_cost < 1:
+                raise ValueError("Tile weights must be at least 1")
 
+        self.moves = ORTHOGONAL_MOVES + DIAGONAL_MOVES if self.diagonal else ORTHOGONAL_MOVES
+
+    # Output: A flat bytearray with 1 for every blocked cell and 0 for every open cell
     def convert_to_pathfinding_format(self):
-        pathfinding_maze = []
-        for row in self.maze:
-            pathfinding_row = []
-            for cell in row:
-                if cell == self.collision_block_char:
-                    pathfinding_row.append("#")
-                else:
-                    pathfinding_row.append(" ")
-            pathfinding_maze.append(pathfinding_row)
-        return pathfinding_maze
+        block = self.collision_block_char
+        return bytearray(1 if cell == block else 0 for row in self.maze for cell in row)
+
+    def in_bounds(self, position):
+        return 0 <= position[0] < self.height and 0 <= position[1] < self.width
+
+    def is_blocked(self, position):
+        return self.cells[position[0] * self.width + position[1]] == self.blocked
+
+    def heuristic(self, row, col, end_row, end_col):
+        d_row = abs(row - end_row)
+        d_col = abs(col - end_col)
+        if self.diagonal:
+            # Octile distance, since Manhattan overestimates once diagonal steps are allowed
+            return self.min_cost * (d_row + d_col + (SQRT2 - 2) * min(d_row, d_col))
+        return self.min_cost * (d_row + d_col)
+
+    # Input: The start and end (row, col) positions, and (row, col) tiles to treat as blocked this search
+    # Output: The optimal path from start to end (both included) as a list of (row, col), or [] if unreachable
+    def find_path(self, start, end, obstacles=None):
+        with TRACER.span('pathfinding.find_path') as span:
+            path = self.search(start, end, obstacles)
+            span['nodes_expanded'] = self.nodes_expanded
+            span['path_length'] = len(path)
+        return path
+
+    def search(self, start, end, obstacles=None):
+        self.searches += 1
+        self.nodes_expanded = 0
+        if not self.in_bounds(start) or not self.in_bounds(end):
+            return []
+
+        width = self.width
+        height = self.height
+        cells = self.cells
+        blocked = self.blocked
+        costs = self.costs
+        moves = self.moves
+        diagonal = self.diagonal
+        heuristic = self.heuristic
+        end_row, end_col = end
+
+        start_index = start[0] * width + start[1]
+        end_index = end_row * width + end_col
+        extra = {row * width + col for row, col in obstacles} if obstacles else ()
+
+        # The start and end tiles are always enterable, as locations sit on blocked tiles
+        g_score = {start_index: 0.0}
+        came_from = {start_index: -1}
+        closed = set()
+        start_h = heuristic(start[0], start[1], end_row, end_col)
+        open_heap = [(start_h, start_h, start_index)]
+        expanded = 0
+
+        while open_heap:
+            _, _, current = heapq.heappop(open_heap)
+            if current in closed:
+                continue
+            if current == end_index:
+                break
+            closed.add(current)
+            expanded += 1
+
+            row, col = divmod(current, width)
+            current_g = g_score[current]
+            for d_row, d_col, step in moves:
+                n_row = row + d_row
+                n_col = col + d_col
+                if not (0 <= n_row < height and 0 <= n_col < width):
+                    continue
+                neighbour = n_row * width + n_col
+                if neighbour in closed:
+                    continue
+                if (cells[neighbour] == blocked or neighbour in extra) and neighbour != end_index:
+                    continue
+                if diagonal and d_row and d_col:
+                    # Do not cut corners around blocked tiles
+                    if cells[row * width + n_col] == blocked or cells[n_row * width + col] == blocked:
+                        continue
+
+                tentative_g = current_g + (step * costs[neighbour] if costs is not None else step)
+                if tentative_g < g_score.get(neighbour, math.inf):
+                    g_score[neighbour] = tentative_g
+                    came_from[neighbour] = current
+                    h = heuristic(n_row, n_col, end_row, end_col)
+                    heapq.heappush(open_heap, (tentative_g + h, h, neighbour))
+        else:
+            self.nodes_expanded = expanded
+            self.total_nodes_expanded += expanded
+            return []
+
+        self.nodes_expanded = expanded
+        self.total_nodes_expanded += expanded
+
+        path = []
+        index = end_index
+        while index != -1:
+            path.append(divmod(index, width))
+            index = came_from[index]
+        path.reverse()
+        return path
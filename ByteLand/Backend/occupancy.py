@@ -0,0 +1,126 @@
+""" occupancy.py
+
+File containing the index of which characters are where
+
+"""
+
+class OccupancyIndex:
+    """ OccupancyIndex()
+
+    Class which tracks the characters at every named location and in every
+    tile bucket, so "who is here" and "who is nearby" queries cost time
+    proportional to the answer instead of the population. The PEOPLE string
+    of everyone at a location is cached once, in name order, until someone
+    enters or leaves it, and each character's own name is cut out of it.
+
+    """
+    def __init__(self, bucket_size=8):
+        self.bucket_size = bucket_size
+        self.locations = {}     # location -> {name: None}, an insertion-ordered set
+        self.buckets = {}       # (bucket row, bucket col) -> {name: (row, col)}
+        self.positions = {}     # name -> (location, (row, col))
+        self.people_cache = {}  # location -> (people string, {name: where it starts in the string})
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def bucket_of(self, coordinates):
+        return (coordinates[0] // self.bucket_size, coordinates[1] // self.bucket_size)
+
+    def add(self, character):
+        if character.name in self.positions:
+            self.remove(character.name)
+        coordinates = tuple(character.coordinates)
+        self.positions[character.name] = (character.location, coordinates)
+        self.locations.setdefault(character.location, {})[character.name] = None
+        self.buckets.setdefault(self.bucket_of(coordinates), {})[character.name] = coordinates
+        self.people_cache.pop(character.location, None)
+
+    def remove(self, name):
+        location, coordinates = self.positions.pop(name)
+        self._discard_location(name, location)
+        self._discard_bucket(name, coordinates)
+
+    # Input: A character whose location and/or coordinates may have changed
+    def update(self, character):
+        if character.name not in self.positions:
+            self.add(character)
+            return
+
+        old_location, old_coordinates = self.positions[character.name]
+        location = character.location
+        coordinates = tuple(character.coordinates)
+
+        if location != old_location:
+            self._discard_location(character.name, old_location)
+            self.locations.setdefault(location, {})[character.name] = None
+            self.people_cache.pop(location, None)
+
+        if coordinates != old_coordinates:
+            old_bucket = self.bucket_of(old_coordinates)
+            bucket = self.bucket_of(coordinates)
+            if bucket != old_bucket:
+                self._discard_bucket(character.name, old_coordinates)
+            self.buckets.setdefault(bucket, {})[character.name] = coordinates
+
+        self.positions[character.name] = (location, coordinates)
+
+    def _discard_location(self, name, location):
+        occupants = self.locations.get(location)
+        if occupants is not None:
+            occupants.pop(name, None)
+            if not occupants:
+                del self.locations[location]
+        self.people_cache.pop(location, None)
+
+    def _discard_bucket(self, name, coordinates):
+        bucket = self.bucket_of(coordinates)
+        occupants = self.buckets.get(bucket)
+        if occupants is not None:
+            occupants.pop(name, None)
+            if not occupants:
+                del self.buckets[bucket]
+
+    # Output: The names of every character at the location, in order of arrival
+    def people_at(self, location):
+        return list(self.locations.get(location, ()))
+
+    # Output: The names of every character within radius tiles (straight-line) of the coordinates
+    def within_radius(self, coordinates, radius):
+        row, col = coordinates
+        size = self.bucket_size
+        radius_squared = radius * radius
+        found = []
+        for bucket_row in range((row - radius) // size, (row + radius) // size + 1):
+            for bucket_col in range((col - radius) // size, (col + radius) // size + 1):
+                occupants = self.buckets.get((bucket_row, bucket_col))
+                if not occupants:
+                    continue
+                for name, (other_row, other_col) in occupants.items():
+                    if (other_row - row) ** 2 + (other_col - col) ** 2 <= radius_squared:
+                        found.append(name)
+        return found
+
+    # Output: A string like 'JOAN, JOHN' of everyone at the location except the excluded name
+    def format_people(self, location, exclude=None):
+        cached = self.people_cache.get(location)
+        if cached is None:
+            names = sorted(self.locations.get(location, ()))
+            starts = {}
+            position = 0
+            for name in names:
+                starts[name] = position
+                position += len(name) + 2
+            cached = self.people_cache[location] = (", ".join(names), starts)
+
+        people, starts = cached
+        start = starts.get(exclude)
+        if start is None:
+            return people
+        end = start + len(exclude)
+        if start == 0:
+            return people[end + 2:]
+        return people[:start - 2] + people[end:]
@@ -0,0 +1,111 @@
+""" prompts.py
+
+File containing the prompt templates of the AI agents and their token budgeting
+
+"""
+
+import threading
+
+COMMAND_RULES = 'You must follow these rules: Commands must be enclosed in []. Input one total command. Enclosed text must be all uppercase. End commands with a "|". Your commands are: [MOVE] (LOCATION) and [TALK] (NAME) and [PICKUP] (ITEM) and [USE] - this uses the item in your hand'
+
+# The static prefix comes first so it is identical on every call
+TURN_TEMPLATE = '{prefix}\nHistory: {history}\nYou are at {location} | PEOPLE: {people} | ITEMS: {items} | IN HAND ITEM: {hand_item}\nEnter a single command:'
+TALK_TEMPLATE = '{prefix}\nHistory: {history}\nYou are talking to {other_char} at the {location}. They said "{prev_dialogue}"\nYour response:'
+TALK_PREFIX = 'Enter command [STOPTALKING] to end dialogue.'
+
+class TokenCounter:
+    """ TokenCounter()
+
+    Class which counts tokens with tiktoken. If the encoding cannot be
+    loaded (e.g. offline with no cached BPE file) it estimates four
+    characters per token instead.
+
+    """
+    def __init__(self, encoding_name="p50k_base"):
+        self.encoding_name = encoding_name
+        self.encoding = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def count(self, text):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    try:
+                        import tiktoken
+                        self.encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception:
+                        self.encoding = None
+                    self.loaded = True
+        if self.encoding is None:
+            return (len(text) + 3) // 4
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+COUNTER = TokenCounter()
+
+class TokenBudgetError(Exception):
+    pass
+
+class PromptBuilder:
+    """ PromptBuilder()
+
+    Class which precompiles an agent's prompts. The static prefix (bio,
+    command rules and location list) is rendered and counted once, and each
+    call only counts the short dynamic part, so the history can be trimmed
+    to keep the whole prompt within token_budget. Token usage is recorded
+    per call.
+
+    """
+    def __init__(self, bio, locations=('TOWNSQUARE', 'TAVERN', 'MARKET'), token_budget=1024, counter=COUNTER, strict=False):
+        # Imported here so importing the module does not load LangChain
+        from langchain.prompts import PromptTemplate
+
+        self.counter = counter
+        self.token_budget = token_budget
+        self.strict = strict
+
+        location_list = ", ".join(locations[:-1]) + f", and {locations[-1]}" if len(locations) > 1 else locations[0]
+        self.turn_prefix = f'{bio}\n{COMMAND_RULES}\nYou can only [MOVE] to these locations: {location_list}.'
+        self.turn_template = PromptTemplate(
+            input_variables=['input', 'history', 'location', 'people', 'items', 'hand_item'],
+            template=TURN_TEMPLATE,
+            partial_variables={'prefix': self.turn_prefix},
+        )
+        self.talk_template = PromptTemplate(
+            input_variables=['input', 'history', 'other_char', 'location', 'prev_dialogue'],
+            template=TALK_TEMPLATE,
+            partial_variables={'prefix': TALK_PREFIX},
+        )
+
+        self.prefix_tokens = {
+            'turn': counter.count(TURN_TEMPLATE.format(prefix=self.turn_prefix, history='', location='', people='', items='', hand_item='')),
+            'talk': counter.count(TALK_TEMPLATE.format(prefix=TALK_PREFIX, history='', other_char='', location='', prev_dialogue='')),
+        }
+
+        self.last_usage = {}
+        self.usage = {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'over_budget': 0, 'over_budget_tokens': 0}
+
+    # Input: Which prompt ('turn' or 'talk') and the inputs that change every call
+    # Output: The tokens of the prompt without history, and how many tokens the history may use.
+    #         A prompt over budget before any history raises TokenBudgetError when strict, and
+    #         is otherwise sent with no history and counted in usage['over_budget'].
+    def history_budget(self, kind, inputs):
+        dynamic = " ".join(str(value) for key, value in inputs.items() if key not in ('input', 'stop'))
+        used = self.prefix_tokens[kind] + self.counter.count(dynamic)
+        if used > self.token_budget:
+            if self.strict:
+                raise TokenBudgetError(f"The {kind} prompt is {used} tokens before any history, over the budget of {self.token_budget}")
+            if not self.usage['over_budget']:
+                print(f"Warning: the {kind} prompt is {used} tokens before any history, over the budget of {self.token_budget}")
+            self.usage['over_budget'] += 1
+            self.usage['over_budget_tokens'] += used - self.token_budget
+            return used, 0
+        return used, self.token_budget - used
+
+    def record_usage(self, kind, prompt_tokens, completion):
+        completion_tokens = self.counter.count(completion)
+        self.last_usage = {'kind': kind, 'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens}
+        self.usage['calls'] += 1
+        self.usage['prompt_tokens'] += prompt_tokens
+        self.usage['completion_tokens'] += completion_tokens
+        return self.last_usage
@@ -0,0 +1,110 @@
+""" scheduler.py
+
+File containing the per-tick agent scheduler
+
+"""
+
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import ExitStack
+
+Decision = namedtuple('Decision', ['character', 'command', 'variable'])
+
+class TickScheduler:
+    """ TickScheduler()
+
+    Class which runs one simulation tick: every agent decides concurrently
+    from the same snapshot of the world, then the decisions are applied one
+    at a time in a fixed order, so a tick takes about as long as the slowest
+    LLM call instead of the sum of them. Every Character's turn prompt is
+    submitted inside its batcher's gather() before any is sent, so the whole
+    tick goes out in as few requests as the batch size allows, however many
+    workers there are. Agents without begin_turn run turn() on the workers.
+
+    """
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='agent-turn')
+        self.last_timings = {'decide': 0.0, 'apply': 0.0}
+
+    # Input: The characters taking a turn, a function giving each one's PEOPLE string,
+    #        a function applying (character, command, variable) and an optional ITEMS function
+    # Output: The decisions that were applied, in the order they were applied
+    def run_tick(self, characters, people_for, apply, items_for=None):
+        started = time.perf_counter()
+
+        # Snapshot the world before anyone acts so every agent sees the same tick
+        snapshot = [(character, people_for(character), items_for(character) if items_for else "")
+                    for character in characters]
+
+        futures = []
+        with ExitStack() as stack:
+            for batcher in batchers(characters):
+                stack.enter_context(batcher.gather())
+            for character, people, items in snapshot:
+                futures.append((character, self.begin(character, people, items)))
+
+        decisions = []
+        for character, future in futures:
+            try:
+                if hasattr(character, 'begin_turn'):
+                    command, variable = character.end_turn(future.result())
+                else:
+                    command, variable = future.result()
+            except Exception as exception:
+                print(f"{character.name} failed to take a turn: {exception}")
+                command, variable = None, None
+            decisions.append(Decision(character, command, variable))
+
+        decided = time.perf_counter()
+
+        decisions = self.resolve(decisions)
+        for decision in decisions:
+            apply(decision.character, decision.command, decision.variable)
+
+        self.last_timings = {'decide': decided - started, 'apply': time.perf_counter() - decided}
+        return decisions
+
+    # Output: A Future of the character's completion, or of its (command, variable) without begin_turn
+    def begin(self, character, people, items):
+        if not hasattr(character, 'begin_turn'):
+            return self.executor.submit(character.turn, people=people, items=items)
+        try:
+            return character.begin_turn(people, items)
+        except Exception as exception:
+            future = Future()
+            future.set_exception(exception)
+            return future
+
+    # Input: The decisions collected this tick
+    # Output: The decisions in application order, with conflicting ones dropped
+    def resolve(self, decisions):
+        # Apply in name order so results do not depend on which LLM call finished first
+        decisions = sorted(decisions, key=lambda decision: decision.character.name)
+
+        # A character can only be in one conversation per tick. The first [TALK] in
+        # name order claims both speakers and later ones involving either are dropped.
+        talking = set()
+        resolved = []
+        for decision in decisions:
+            if decision.command == "[TALK]":
+                speaker = decision.character.name
+                if speaker in talking or decision.variable in talking:
+                    continue
+                talking.add(speaker)
+                talking.add(decision.variable)
+            resolved.append(decision)
+        return resolved
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+# Output: The distinct prompt batchers behind the characters' LLMs
+def batchers(characters):
+    found = {}
+    for character in characters:
+        batcher = getattr(getattr(character, 'llm', None), 'batcher', None)
+        if batcher is not None:
+            found[id(batcher)] = batcher
+    return list(found.values())
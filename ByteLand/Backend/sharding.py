@@ -0,0 +1,358 @@
+""" sharding.py
+
+File containing the sharded engine, which splits the villagers across worker processes
+
+Each shard is a process with its own Simulation, owning the villagers at
+some of the named locations: their LLM calls, memories and pathfinding.
+Since a location belongs to one shard, everyone a villager can see is in
+the same process. What crosses shards is passed as messages at the tick
+barrier:
+
+    migration  a villager arrived at a location another shard owns, with its state
+    talk       one line of a conversation with a villager in another shard
+
+Because of this, shards only help up to the number of occupied locations:
+with the villagers at three locations, a fourth shard has nobody to run.
+add_villagers prints a warning when shards are left empty.
+
+A conversation across shards is open in both of them, in each shard's
+ConversationManager, with a RemoteSpeaker standing in for the villager
+who is not there. Each shard says the lines of its own villager, logs
+them and sends them over; the other shard hears them as the remote
+speaker's lines. Both sides apply the same busy check, line limit and
+[STOPTALKING] rule, so they agree on when the conversation is over.
+
+"""
+
+import collections
+import itertools
+import multiprocessing
+import time
+import traceback
+
+from Backend.character import run_command_headless
+from Backend.commands import CommandParser
+from Backend.scheduler import TickScheduler
+from Backend.simulation import Simulation
+
+class ShardError(Exception):
+    pass
+
+# Input: The options from configure_opt, how many shards there are and how to split them
+# Output: {location: shard} for every named location
+def partition_locations(opt, shards, partition='location'):
+    if partition == 'location':
+        # Round robin over the names, so busy locations spread out
+        return {location: number % shards for number, location in enumerate(sorted(opt['coordinates']))}
+    if partition == 'region':
+        # Vertical strips of the map
+        return {location: min(col * shards // opt['map_width'], shards - 1)
+                for location, (_, col) in opt['coordinates'].items()}
+    raise ValueError(f"Unknown partition {partition!r}")
+
+# Output: Everything needed to rebuild a character in another process
+def character_state(character):
+    stream = character.memory_stream
+    with stream.lock:
+        memories = (list(stream.texts), list(stream.timestamps), list(stream.importance))
+    return {
+        'name': character.name,
+        'bio': character.bio,
+        'location': character.location,
+        'hand_item': character.hand_item,
+        'coordinates': tuple(character.coordinates),
+        'memories': memories,
+    }
+
+class RemoteSpeaker:
+    """ RemoteSpeaker()
+
+    Class which stands in for a villager in another shard in a
+    Conversation. Its lines are not generated here: each arrives in a talk
+    message and is said when the conversation reaches its turn.
+
+    """
+    def __init__(self, name):
+        self.name = name
+        self.parser = CommandParser()
+        self.lines = collections.deque()
+
+    def ready(self):
+        return bool(self.lines)
+
+    def talk_stream(self, char, prev_dialogue=""):
+        yield self.lines.popleft()
+
+class ShardWorker:
+    """ ShardWorker()
+
+    Class which runs one shard inside its worker process. Commands which
+    stay inside the shard go to run_command_headless. A [TALK] with a
+    villager elsewhere opens a conversation with a RemoteSpeaker whose
+    lines come and go as talk messages, and a villager arriving at another
+    shard's location becomes a migration.
+
+    """
+    def __init__(self, shard, opt, character_factory, owners, max_workers=8, use_array=False):
+        self.shard = shard
+        self.owners = owners  # location -> shard
+        self.character_factory = character_factory
+        self.simulation = Simulation(opt, self.run_command, scheduler=TickScheduler(max_workers=max_workers), use_array=use_array)
+        # Conversations can be open in two shards, so their ids name the shard that started them
+        self.simulation.conversations.ids = (f"{shard}:{number}" for number in itertools.count())
+        self.everyone = set()
+        self.leaving = set()
+        self.reset_outbox()
+
+    def reset_outbox(self):
+        self.events = []
+        self.migrations = []
+        self.talks = []
+
+    # Conversations outlive a tick, so they emit through here into the current outbox
+    def emit(self, event):
+        self.events.append(event)
+
+    # Input: The character states to add and the name of every villager in any shard
+    def add(self, states, everyone=None):
+        if everyone is not None:
+            self.everyone = set(everyone)
+        for state in states:
+            character = self.character_factory(state['name'], state['bio'], state['location'], coordinates=state['coordinates'])
+            character.hand_item = state['hand_item']
+            if state['memories'][0]:
+                character.memory_stream.restore(*state['memories'])
+            self.simulation.add_character(character)
+        # [TALK] is valid towards anyone, not only the villagers in this shard
+        self.simulation.names.update(self.everyone)
+
+    def run_command(self, character, command, variable, collision_map, opt, CHARACTERS={}, occupancy=None, movement=None, conversations=None):
+        if command == "[TALK]" and variable not in CHARACTERS and variable in self.everyone:
+            conversation = conversations.start(character, RemoteSpeaker(variable), on_line=self.on_line)
+            if conversation is None:
+                self.events.append({'type': 'busy', 'name': character.name, 'to': variable})
+                return
+            self.events.append({'type': 'talk_start', 'conversation': conversation.id, 'name': character.name, 'to': variable})
+            return
+        run_command_headless(character, command, variable, collision_map, opt, CHARACTERS, occupancy,
+                             emit=self.emit, movement=movement, conversations=conversations)
+
+    # Called for every line of a conversation with a villager in another shard. The lines
+    # said here are logged and sent over, those heard from the other shard were logged there.
+    def on_line(self, conversation, name, line):
+        remote = next(speaker for speaker in conversation.speakers if isinstance(speaker, RemoteSpeaker))
+        if name == remote.name:
+            return
+        self.events.append({'type': 'talk', 'conversation': conversation.id, 'name': name, 'to': remote.name, 'dialogue': line})
+        if conversation.done:
+            self.events.append({'type': 'talk_end', 'conversation': conversation.id, 'lines': len(conversation.lines),
+                                'stopped_by': conversation.stopped_by})
+        self.talks.append({'conversation': conversation.id, 'from': name, 'to': remote.name, 'said': line,
+                           'first': len(conversation.lines) == 1, 'max_lines': conversation.max_lines})
+
+    # Input: A talk message from another shard. The first line of a conversation opens it here
+    #        too, unless the villager is busy, and a line of None means the other side refused.
+    def hear(self, talk):
+        conversations = self.simulation.conversations
+        conversation = conversations.get(talk['conversation'])
+        if conversation is None:
+            if not talk['first'] or talk['said'] is None:
+                return
+            character = self.simulation.characters.get(talk['to'])
+            if character is not None:
+                conversation = conversations.start(RemoteSpeaker(talk['from']), character, on_line=self.on_line,
+                                                   max_lines=talk['max_lines'], conversation_id=talk['conversation'])
+            if conversation is None:
+                self.events.append({'type': 'busy', 'name': talk['from'], 'to': talk['to']})
+                self.talks.append({'conversation': talk['conversation'], 'from': talk['to'], 'to': talk['from'], 'said': None,
+                                   'first': False, 'max_lines': talk['max_lines']})
+                return
+        if talk['said'] is None:
+            conversations.finish(conversation)
+            return
+        speaker, _ = conversation.turn()
+        speaker.lines.append(talk['said'])
+        conversation.advance()
+        if conversation.done:
+            conversations.finish(conversation)
+
+    # Input: The tick number, the villagers moving into the shard and the talk messages for it
+    # Output: The events, migrations and talks of the tick and this process's LLM statistics
+    def tick(self, tick_count, migrants, talks):
+        self.reset_outbox()
+        started = time.perf_counter()
+        self.add(migrants)
+        # Lines heard now are answered in this tick's conversation step
+        for talk in talks:
+            self.hear(talk)
+
+        self.simulation.tick_count = tick_count - 1
+        decisions = self.simulation.tick()
+        for name, location in self.simulation.last_arrivals:
+            self.events.append({'type': 'arrive', 'name': name, 'location': location})
+            if self.owners.get(location, self.shard) != self.shard:
+                self.leaving.add(name)
+        # Villagers in a conversation here finish it before they move shard
+        for name in sorted(self.leaving):
+            if not self.simulation.conversations.is_talking(name):
+                self.leaving.discard(name)
+                self.migrations.append(character_state(self.simulation.remove_character(name)))
+                self.simulation.names.add(name)
+
+        return {
+            'events': self.events,
+            'migrations': self.migrations,
+            'talks': self.talks,
+            'decisions': len(decisions),
+            'population': len(self.simulation.characters),
+            'seconds': time.perf_counter() - started,
+            'llm': self.llm_stats(),
+        }
+
+    def llm_stats(self):
+        from Backend.llm_backend import SHARED_LLM
+        if SHARED_LLM is None:
+            return {'prompts': 0, 'batches': 0}
+        return {'prompts': SHARED_LLM.batcher.prompts, 'batches': SHARED_LLM.batcher.batches}
+
+# The loop of a worker process: answer each message from the coordinator until told to stop
+def shard_main(connection, shard, opt, character_factory, owners, max_workers, cache_mode, use_array=False):
+    if cache_mode not in (None, 'off'):
+        from Backend.llm_cache import enable_completion_cache
+        enable_completion_cache(mode=cache_mode)
+    worker = ShardWorker(shard, opt, character_factory, owners, max_workers, use_array)
+    while True:
+        kind, payload = connection.recv()
+        if kind == 'stop':
+            break
+        try:
+            if kind == 'add':
+                worker.add(*payload)
+                reply = ('ok', len(worker.simulation.characters))
+            elif kind == 'tick':
+                reply = ('ok', worker.tick(*payload))
+            else:
+                reply = ('error', f"Unknown message {kind!r}")
+        except Exception:
+            reply = ('error', traceback.format_exc())
+        connection.send(reply)
+    connection.close()
+
+class ShardedSimulation:
+    """ ShardedSimulation()
+
+    Class which runs the simulation across a pool of worker processes, one
+    shard each, and passes messages between them at every tick barrier.
+    Workers are spawned, so character_factory must be picklable (a class
+    or a functools.partial of one). Headless only: events come back from
+    tick() instead of being shown.
+
+    """
+    def __init__(self, opt, character_factory, shards=None, partition='location', max_workers=8, cache_mode='off', use_array=False):
+        self.opt = opt
+        self.shards = shards or multiprocessing.cpu_count()
+        self.owners = partition_locations(opt, self.shards, partition)
+        self.home = {}  # villager name -> shard
+        self.inbox = [{'migrants': [], 'talks': []} for _ in range(self.shards)]
+        self.tick_count = 0
+        self.last_timings = {}
+        self.llm = [{'prompts': 0, 'batches': 0} for _ in range(self.shards)]
+
+        context = multiprocessing.get_context('spawn')
+        self.connections = []
+        self.processes = []
+        for shard in range(self.shards):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=shard_main, name=f"shard-{shard}", daemon=True,
+                args=(child, shard, opt, character_factory, self.owners, max_workers, cache_mode, use_array),
+            )
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def __len__(self):
+        return len(self.home)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def shard_of(self, location):
+        return self.owners.get(location, 0)
+
+    # Input: (name, bio, starting location) of every villager, e.g. VILLAGERS
+    def add_villagers(self, villagers):
+        everyone = set(self.home) | {name for name, _, _ in villagers}
+        states = [[] for _ in range(self.shards)]
+        for name, bio, location in villagers:
+            shard = self.shard_of(location)
+            self.home[name] = shard
+            states[shard].append({'name': name, 'bio': bio, 'location': location, 'hand_item': "",
+                                  'coordinates': self.opt['coordinates'][location], 'memories': ([], [], [])})
+        self.broadcast([('add', (states[shard], everyone)) for shard in range(self.shards)])
+
+        busy = len(set(self.home.values()))
+        if busy < self.shards:
+            locations = len({location for _, _, location in villagers})
+            print(f"Warning: only {busy} of {self.shards} shards have villagers. Each location belongs to one shard, "
+                  f"and the villagers are at {locations} locations.")
+
+    # Send one message to every shard and wait for all the replies: the tick barrier
+    def broadcast(self, messages):
+        for connection, message in zip(self.connections, messages):
+            connection.send(message)
+        replies = []
+        for shard, connection in enumerate(self.connections):
+            status, reply = connection.recv()
+            if status != 'ok':
+                raise ShardError(f"Shard {shard} failed:\n{reply}")
+            replies.append(reply)
+        return replies
+
+    # Output: Every event of the tick, in shard order
+    def tick(self):
+        self.tick_count += 1
+        started = time.perf_counter()
+        messages = [('tick', (self.tick_count, inbox['migrants'], inbox['talks'])) for inbox in self.inbox]
+        self.inbox = [{'migrants': [], 'talks': []} for _ in range(self.shards)]
+        replies = self.broadcast(messages)
+        barrier = time.perf_counter()
+
+        events = []
+        for shard, reply in enumerate(replies):
+            events.extend(reply['events'])
+            self.llm[shard] = reply['llm']
+            for state in reply['migrations']:
+                self.home[state['name']] = self.shard_of(state['location'])
+                self.inbox[self.home[state['name']]]['migrants'].append(state)
+        # Talks are routed after migrations so they follow a villager who moved shard
+        for reply in replies:
+            for talk in reply['talks']:
+                self.inbox[self.home[talk['to']]]['talks'].append(talk)
+
+        self.last_timings = {
+            'barrier': barrier - started,
+            'route': time.perf_counter() - barrier,
+            'shards': [reply['seconds'] for reply in replies],
+            # Counted from where each villager lives now, so villagers in transit are included
+            'population': [list(self.home.values()).count(shard) for shard in range(self.shards)],
+        }
+        return events
+
+    def llm_totals(self):
+        return {key: sum(stats[key] for stats in self.llm) for key in ('prompts', 'batches')}
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(('stop', None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+        self.connections = []
+        self.processes = []
@@ -0,0 +1,123 @@
+""" simulation.py
+
+File containing the simulation engine which holds the world and its agents between ticks
+
+"""
+
+import time
+
+from Backend.conversation import ConversationManager
+from Backend.events import event_name
+from Backend.map import GameMap
+from Backend.movement import MovementSystem
+from Backend.navigation import CollisionMap
+from Backend.occupancy import OccupancyIndex
+from Backend.scheduler import TickScheduler
+from Backend.utilities import VILLAGERS
+
+class Simulation:
+    """ Simulation()
+
+    Class which owns the world (map, collision map, occupancy) and every
+    agent, and advances them one tick at a time. command_runner is called
+    as command_runner(character, command, variable, collision_map, opt,
+    CHARACTERS=..., occupancy=..., movement=..., conversations=...) for each
+    applied decision, which is the signature of general.run_command. After
+    the decisions, every walking character advances steps_per_tick tiles
+    and every open conversation says its next line. Characters who are in
+    a conversation do not take a turn. last_timings holds the seconds each
+    phase of the last tick took.
+
+    """
+    def __init__(self, opt, command_runner, scheduler=None, use_array=False):
+        self.opt = opt
+        self.command_runner = command_runner
+        self.scheduler = scheduler or TickScheduler()
+
+        if opt.get('map_file'):
+            self.game_map = GameMap.open(opt['map_file'])
+        else:
+            self.game_map = GameMap(opt['map_width'], opt['map_height'], opt['tile_size'], use_array=use_array)
+        self.collision_map = CollisionMap(self.game_map.map_data, opt['collision_char'])
+        self.characters = {}
+        self.names = set()
+        self.occupancy = OccupancyIndex()
+        self.tick_count = 0
+        self.vision_radius = opt.get('vision_radius', 2)
+
+        # Named locations are buildings, so any number of characters may share them
+        self.movement = MovementSystem(self.collision_map, shared=opt['coordinates'].values(),
+                                       window=opt.get('movement_window', 8))
+        self.steps_per_tick = opt.get('steps_per_tick', 1)
+        self.last_arrivals = []
+
+        self.conversations = ConversationManager(max_workers=self.scheduler.max_workers,
+                                                 max_lines=opt.get('conversation_lines', 4))
+        self.last_lines = []
+        self.last_timings = {'decide': 0.0, 'apply': 0.0, 'walk': 0.0, 'talk': 0.0}
+
+    def add_character(self, character):
+        self.characters[character.name] = character
+        self.names.add(character.name)
+        self.occupancy.add(character)
+        # [TALK] is only valid towards someone who exists
+        character.parser.characters = self.names
+
+    # Output: The character, no longer in the world
+    def remove_character(self, name):
+        character = self.characters.pop(name)
+        self.names.discard(name)
+        self.occupancy.remove(name)
+        self.movement.cancel(name)
+        return character
+
+    def find_people(self, character):
+        return self.occupancy.format_people(character.location, exclude=character.name)
+
+    # Output: The ITEMS string of the events the character can see, e.g. 'NOTHING' or 'HAMMER, SHOVEL'
+    def find_items(self, character):
+        row, col = character.coordinates
+        events = self.game_map.get_nearby_events(col, row, self.vision_radius)
+        return ", ".join(event_name(event) for _, _, event in events) or "NOTHING"
+
+    def apply(self, character, command, variable):
+        self.command_runner(character, command, variable, self.collision_map, self.opt,
+                            CHARACTERS=self.characters, occupancy=self.occupancy, movement=self.movement,
+                            conversations=self.conversations)
+
+    # Output: The (name, location) of every character which arrived
+    def walk(self):
+        arrivals = []
+        for _ in range(self.steps_per_tick):
+            if not self.movement:
+                break
+            for walker in self.movement.step():
+                walker.character.location = walker.location
+                arrivals.append((walker.character.name, walker.location))
+            for walker in self.movement.walkers.values():
+                self.occupancy.update(walker.character)
+        for name, _ in arrivals:
+            self.occupancy.update(self.characters[name])
+        return arrivals
+
+    # Output: The decisions applied during the tick. Events time out in ticks.
+    def tick(self):
+        self.tick_count += 1
+        self.game_map.expire_events(self.tick_count)
+        deciding = [character for character in self.characters.values() if not self.conversations.is_talking(character.name)]
+        decisions = self.scheduler.run_tick(deciding, self.find_people, self.apply, self.find_items)
+        walk_started = time.perf_counter()
+        self.last_arrivals = self.walk()
+        talk_started = time.perf_counter()
+        self.last_lines = self.conversations.step()
+        self.last_timings = {**self.scheduler.last_timings, 'walk': talk_started - walk_started,
+                             'talk': time.perf_counter() - talk_started}
+        return decisions
+
+# Input: The options from configure_opt, the Character class to build agents with and the command runner
+# Output: A Simulation populated with the villagers
+def create_simulation(opt, character_class, command_runner, villagers=VILLAGERS, **kwargs):
+    simulation = Simulation(opt, command_runner, **kwargs)
+    for name, bio, location in villagers:
+        simulation.add_character(character_class(name, bio, location, coordinates=opt['coordinates'][location]))
+    return simulation
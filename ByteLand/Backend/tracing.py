@@ -0,0 +1,150 @@
+""" tracing.py
+
+File containing the span instrumentation of agent turns and the world
+
+"""
+
+import json
+import os
+import threading
+import time
+
+class NullSpan:
+    """ NullSpan()
+
+    Span handed out while tracing is off. It does nothing, so instrumented
+    code costs one function call when tracing is disabled.
+
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Span:
+    """ Span()
+
+    Times a block of code. Arguments such as token counts can be attached
+    while it is open with span['key'] = value.
+
+    """
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+    def __setitem__(self, key, value):
+        self.args[key] = value
+
+class Tracer:
+    """ Tracer()
+
+    Class which collects spans. Each span name keeps a running count,
+    total, max and a histogram of durations in power-of-two microsecond
+    buckets, and the first max_events spans are kept whole for the
+    Chrome trace export (chrome://tracing or https://ui.perfetto.dev).
+
+    """
+    def __init__(self, enabled=False, max_events=1000000):
+        self.enabled = enabled
+        self.max_events = max_events
+        self.origin = time.perf_counter()
+        self.events = []
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.origin = time.perf_counter()
+            self.events = []
+            self.stats = {}
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def record(self, name, start, duration, args):
+        micros = duration * 1e6
+        bucket = max(int(micros), 1).bit_length() - 1
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'buckets': {}}
+            stats['count'] += 1
+            stats['total_s'] += duration
+            stats['max_s'] = max(stats['max_s'], duration)
+            stats['buckets'][bucket] = stats['buckets'].get(bucket, 0) + 1
+            if len(self.events) < self.max_events:
+                self.events.append((name, (start - self.origin) * 1e6, micros, threading.get_ident(), args))
+
+    # Output: Per span name the count, total, mean and max seconds, approximate percentiles and
+    #         the histogram as {'<upper bound>us': count}
+    def histograms(self):
+        with self.lock:
+            summary = {}
+            for name, stats in self.stats.items():
+                buckets = sorted(stats['buckets'].items())
+                summary[name] = {
+                    'count': stats['count'],
+                    'total_s': stats['total_s'],
+                    'mean_s': stats['total_s'] / stats['count'],
+                    'max_s': stats['max_s'],
+                    'p50_s': self._percentile(buckets, stats['count'], 0.50),
+                    'p90_s': self._percentile(buckets, stats['count'], 0.90),
+                    'p99_s': self._percentile(buckets, stats['count'], 0.99),
+                    'histogram': {f"<{2 ** (bucket + 1)}us": count for bucket, count in buckets},
+                }
+            return summary
+
+    @staticmethod
+    def _percentile(buckets, count, fraction):
+        # The upper bound of the bucket holding the percentile
+        seen = 0
+        for bucket, bucket_count in buckets:
+            seen += bucket_count
+            if seen >= fraction * count:
+                return 2 ** (bucket + 1) / 1e6
+        return 0.0
+
+    def export_chrome_trace(self, path):
+        pid = os.getpid()
+        with self.lock:
+            trace_events = [
+                {'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'ts': start, 'dur': duration,
+                 'pid': pid, 'tid': tid, 'args': args}
+                for name, start, duration, tid, args in self.events
+            ]
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, trace_file, default=str)
+
+    def export_histograms(self, path):
+        with open(path, 'w') as histogram_file:
+            json.dump(self.histograms(), histogram_file, indent=2)
+
+# The tracer used by the whole simulation. Set BYTELAND_TRACE=1 to start with tracing on.
+TRACER = Tracer(enabled=os.environ.get('BYTELAND_TRACE') == '1')
@@ -3,12 +3,20 @@
 Configure the option which passes critical information
 
 """
+
+# Tile codes used by array-backed maps, and the character drawn for each code
+TILE_CODES = {0: 0, ' ': 0, '#': 1}
+TILE_CHARS = ' #'
+
 def configure_opt(opt):
     # Map dimensions
     MAP_WIDTH = 13
     MAP_HEIGHT = 7
     TILE_SIZE = 1
 
+    # Tiles a villager walks per tick
+    STEPS_PER_TICK = 4
+
     # Collision character
     COLLISION_CHAR = '#'
 
@@ -35,9 +43,18 @@ def configure_opt(opt):
         'map_width': MAP_WIDTH,
         'map_height': MAP_HEIGHT,
         'tile_size' : TILE_SIZE,
+        'steps_per_tick' : STEPS_PER_TICK,
         'collision_char' : COLLISION_CHAR,
         'coordinates': COORDINATES,
         'characters' : CHARACTERS
     }
 
-    return opt
\ No newline at end of file
+    return opt
+
+# The starting villagers as (name, bio, starting location)
+VILLAGERS = [
+    ("GABE", "You are a villager named GABE in a small medieval town of 4. You are new to this town and don't know many people. You are the new smith of the town.", "TOWNSQUARE"),
+    ("IZZY", "You are a villager named IZZY in a small medieval town of 4. You are the bartender of this town and heard there's a newcomer to the town. You want to meet him, his name is GABE.", "TOWNSQUARE"),
+    ("AIDEN", "You are a villager named AIDEN in a small medieval town of 4. You are the town leader, a retired wizard and you want to make sure the jester, MILES isn't too mischievous.", "MARKET"),
+    ("MILES", "You are a villager named MILES in a small medieval town of 4. You are the jester of this town and heard there's a newcomer to the town. You want to meet him, and prank him.", "MARKET"),
+]
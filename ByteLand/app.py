@@ -4,68 +4,64 @@ Create the web application for AI Civilization
 
 """
 
+import functools
+
 import streamlit as st
 from general import Character
 from general import *
-from Backend.map import *
-from Backend.navigation import *
 from Backend.utilities import *
-
-CHARACTERS = {}
-
-def find_people(prime_character):
-    output = ""
-
-    for index, name in enumerate(CHARACTERS.keys()):
-        if name != prime_character.name:
-            if CHARACTERS[name].location == prime_character.location:
-                if output == "":
-                    output = name
-                else:
-                    output += f", {name}"
-
-    return output
-
-def character_turn(person, game_map, options):
-    command, variable = person.turn(people=find_people(person))
-    run_command(person, command, variable, game_map, options, CHARACTERS=CHARACTERS)
+from Backend.simulation import create_simulation
+from Backend.llm_cache import enable_completion_cache
+
+IMAGE_PATH = './Backend/map.jpeg'
+
+@st.cache_resource
+def get_completion_cache():
+    # Set BYTELAND_CACHE_MODE=record, then replay, to re-run a simulation without API calls
+    return enable_completion_cache(mode=os.environ.get('BYTELAND_CACHE_MODE', 'cache'))
+
+@st.cache_data
+def load_map_image(image_path):
+    if not os.path.exists(image_path):
+        return None
+    with open(image_path, "rb") as image_file:
+        return image_file.read()
+
+# Output: This session's simulation, built on the first run and kept across reruns
+#         with the feed its conversations are shown and spoken through
+def get_engine():
+    if 'engine' not in st.session_state:
+        opt = {}
+        opt = configure_opt(opt)
+        feed = TalkFeed()
+        st.session_state['talk_feed'] = feed
+        # Set BYTELAND_ARRAY_MAP=1 to keep the map in a numpy array, see Backend/map.py
+        use_array = os.environ.get('BYTELAND_ARRAY_MAP') == '1'
+        st.session_state['engine'] = create_simulation(opt, Character, functools.partial(run_command, feed=feed), use_array=use_array)
+        st.session_state['tick_log'] = []
+    return st.session_state['engine']
 
 def main():
-    opt = {}
-    opt = configure_opt(opt)
-    game_map = GameMap(opt['map_width'], opt['map_height'], opt['tile_size'])
-    collision_map = CollisionMap(game_map.map_data, opt['collision_char'])
-
-    image_path = './Backend/map.jpeg'
-    
-
-    # Check if the image file exists
-    if os.path.exists(image_path):
-        # Open and display the background image
-        with open(image_path, "rb") as image_file:
-            st.title("AI Civilization")
-            background_image = image_file.read()
-            st.image(background_image, caption='Coordinate Grid', use_column_width=True, clamp=True, output_format='JPEG')
-
+    get_completion_cache()
+    engine = get_engine()
+    tick_log = st.session_state['tick_log']
+
+    st.title("AI Civilization")
+    background_image = load_map_image(IMAGE_PATH)
+    if background_image is not None:
+        st.image(background_image, caption='Coordinate Grid', use_column_width=True, clamp=True, output_format='JPEG')
     else:
         st.error("Background image not found. Please make sure the file 'map.jpeg' exists in the specified path.")
 
-    gabe = Character("GABE", "You are a villager named GABE in a small medieval town of 4. You are new to this town and don't know many people. You are the new smith of the town.", "TOWNSQUARE", coordinates=opt['coordinates']['TOWNSQUARE'])
-    CHARACTERS[gabe.name] = gabe
-    izzy = Character("IZZY", "You are a villager named IZZY in a small medieval town of 4. You are the bartender of this town and heard there's a newcomer to the town. You want to meet him, his name is GABE.", "TOWNSQUARE", coordinates=opt['coordinates']['TOWNSQUARE'])
-    CHARACTERS[izzy.name] = izzy
-    aiden = Character("AIDEN", "You are a villager named AIDEN in a small medieval town of 4. You are the town leader, a retired wizard and you want to make sure the jester, MILES isn't too mischievous.", "MARKET", coordinates=opt['coordinates']['MARKET'])
-    CHARACTERS[aiden.name] = aiden
-    miles = Character("MILES", "You are a villager named MILES in a small medieval town of 4. You are the jester of this town and heard there's a newcomer to the town. You want to meet him, and prank him.", "MARKET", coordinates=opt['coordinates']['MARKET'])
-    CHARACTERS[miles.name] = miles
-
-    character_turn(gabe, collision_map, opt)
-    character_turn(izzy, collision_map, opt)
-    character_turn(aiden, collision_map, opt)
-    character_turn(miles, collision_map, opt)
+    # Earlier ticks are replayed from the log, only the new tick runs the agents
+    if tick_log:
+        with st.expander(f"Previous ticks ({len(tick_log)})"):
+            for tick, lines in tick_log:
+                st.text(f"Tick {tick}\n" + "\n".join(lines))
 
     if st.button("Run AI Civilization"):
-        main()
+        decisions = run_tick_streamed(engine, st.session_state['talk_feed'])
+        tick_log.append((engine.tick_count, [f"{decision.character.name}: {decision.command} {decision.variable}" for decision in decisions]))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,169 @@
+""" audio.py
+
+Text to speech pipeline for the dialogue of the AI civilization
+
+Streamlit, gTTS and mutagen are imported on first use, so the
+pipeline can be created where they are not installed.
+
+"""
+
+import base64
+import hashlib
+import io
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from Backend.tracing import TRACER
+
+# Input: The text to speak
+# Output: The MP3 bytes and their duration in seconds, synthesized without touching the disk
+def synthesize(text):
+    from gtts import gTTS
+    from mutagen.mp3 import MP3
+
+    with TRACER.span('tts.synthesize', characters=len(text)):
+        buffer = io.BytesIO()
+        gTTS(text).write_to_fp(buffer)
+        data = buffer.getvalue()
+    with TRACER.span('tts.duration'):
+        duration = MP3(io.BytesIO(data)).info.length
+    return data, duration
+
+class ClipCache:
+    """ ClipCache()
+
+    Class which keeps the most recently used synthesized clips in memory,
+    keyed by a hash of their text
+
+    """
+    def __init__(self, max_clips=128):
+        self.max_clips = max_clips
+        self.clips = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, text):
+        key = self.key(text)
+        with self.lock:
+            clip = self.clips.get(key)
+            if clip is not None:
+                self.clips.move_to_end(key)
+            return clip
+
+    def put(self, text, clip):
+        key = self.key(text)
+        with self.lock:
+            self.clips[key] = clip
+            self.clips.move_to_end(key)
+            while len(self.clips) > self.max_clips:
+                self.clips.popitem(last=False)
+
+class PlaybackQueue:
+    """ PlaybackQueue()
+
+    Class which lines clips up back to back in the Streamlit page without
+    waiting for them. Each clip is written at once as an audio element
+    which starts itself when whatever is left of the previous clip (less
+    overlap seconds) has played, so play() returns immediately.
+
+    """
+    def __init__(self, overlap=1.0):
+        self.overlap = overlap
+        self.free_at = 0.0
+
+    # Output: The seconds from now until the clip starts
+    def play(self, clip):
+        data, duration = clip
+        now = time.monotonic()
+        offset = max(self.free_at - now, 0.0)
+        with TRACER.span('tts.emit', offset=offset):
+            from streamlit.components.v1 import html
+            html(audio_element(data, offset), height=0)
+        self.free_at = now + offset + max(duration - self.overlap, 0)
+        return offset
+
+# Output: An HTML audio element of the MP3 bytes which starts playing after offset seconds
+def audio_element(data, offset):
+    source = base64.b64encode(data).decode('ascii')
+    return (f'<audio id="clip" src="data:audio/mpeg;base64,{source}"></audio>'
+            f'<script>setTimeout(() => document.getElementById("clip").play(), {round(offset * 1000)});</script>')
+
+class AudioPipeline:
+    """ AudioPipeline()
+
+    Class which synthesizes clips on background threads through a ClipCache,
+    and plays conversations so the next reply and its audio are produced
+    while the current line is playing
+
+    """
+    def __init__(self, max_workers=2, max_clips=128, overlap=1.0):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tts')
+        self.cache = ClipCache(max_clips)
+        self.playback = PlaybackQueue(overlap)
+
+    def _clip(self, text):
+        clip = self.cache.get(text)
+        if clip is None:
+            clip = synthesize(text)
+            self.cache.put(text, clip)
+        return clip
+
+    # Output: A Future which resolves to the (bytes, duration) clip of the text
+    def prepare(self, text):
+        return self.executor.submit(self._clip, text)
+
+    # Input: An iterator of ('token', name, token) and ('line', name, line) events, e.g.
+    #        Conversation.events, which asks the LLM for each reply as it goes
+    # Shows every line token by token as it is generated and plays each finished line in
+    # order. The events are read on a producer thread at most one line ahead of the page.
+    def play_stream(self, events):
+        import streamlit as st
+        ready = queue.Queue()
+        ahead = threading.Semaphore(1)
+        done = object()
+
+        def produce():
+            try:
+                for kind, name, text in events:
+                    if kind == 'line':
+                        line = f"{name}: {text}"
+                        ready.put((kind, line, self.prepare(line)))
+                        ahead.acquire()
+                    else:
+                        ready.put((kind, name, text))
+            except Exception as exception:
+                ready.put(exception)
+                return
+            ready.put(done)
+
+        threading.Thread(target=produce, daemon=True).start()
+        placeholder = None
+        shown = ""
+        while True:
+            item = ready.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            kind, first, second = item
+            if kind == 'token':
+                if placeholder is None:
+                    placeholder = st.empty()
+                    shown = f"{first}: "
+                shown += second
+                placeholder.write(shown)
+                continue
+
+            # The line is finished: show it whole, then queue it to start once the previous clip ends
+            if placeholder is None:
+                placeholder = st.empty()
+            placeholder.write(first)
+            placeholder = None
+            self.playback.play(second.result())
+            ahead.release()
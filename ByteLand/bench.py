@@ -0,0 +1,240 @@
+""" bench.py
+
+Benchmarks for the hot paths of AI Civilization
+
+Times pathfinding, map operations, find_people, cooperative movement and whole ticks against a
+zero-latency local LLM, and writes the results (with peak memory) as JSON:
+
+    python bench.py --output bench.json
+    python bench.py --quick
+
+"""
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from Backend.map import GameMap
+from Backend.movement import MovementSystem
+from Backend.navigation import CollisionMap
+from Backend.occupancy import OccupancyIndex
+from Backend.utilities import *
+
+MAP_SIZES = [(13, 7), (100, 100), (500, 500), (1000, 1000), (2000, 2000)]
+QUICK_MAP_SIZES = [(13, 7), (100, 100), (250, 250)]
+DENSITIES = [0.0, 0.1, 0.25]
+POPULATIONS = [4, 50, 500, 5000]
+QUICK_POPULATIONS = [4, 50, 500]
+LOCATIONS = ('TOWNSQUARE', 'TAVERN', 'MARKET')
+
+# Input: A function and how many times to time it
+# Output: The best and mean time of one call in seconds, and the peak memory of one call in bytes
+def measure(function, repeat=5):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'best_s': min(times), 'mean_s': sum(times) / len(times), 'peak_bytes': peak}
+
+# Output: An array-backed map of random walls with open corners, as in configure_opt's layout
+def random_map(width, height, density, seed=0):
+    game_map = GameMap(width, height, 1, use_array=True)
+    rng = np.random.default_rng(seed)
+    game_map.map_data[:, :] = (rng.random((height, width)) < density).astype(np.uint8) * TILE_CODES['#']
+    game_map.map_data[0, 0] = game_map.map_data[-1, -1] = TILE_CODES[' ']
+    return game_map
+
+def bench_pathfinding(sizes, repeat):
+    results = []
+    for width, height in sizes:
+        for density in DENSITIES:
+            game_map = random_map(width, height, density)
+            collision_map = CollisionMap(game_map.map_data, '#')
+            start, end = (0, 0), (height - 1, width - 1)
+            path = collision_map.find_path(start, end)
+            result = measure(lambda: collision_map.find_path(start, end), repeat)
+            result.update({'width': width, 'height': height, 'density': density,
+                           'path_length': len(path), 'nodes_expanded': collision_map.nodes_expanded})
+            results.append(result)
+    return results
+
+def bench_map_ops(sizes, repeat, radius=5):
+    results = []
+    opt = configure_opt({})
+    for width, height in sizes:
+        # Scale the configured locations onto the larger map
+        coordinates = {name: (row * height // opt['map_height'], col * width // opt['map_width'])
+                       for name, (row, col) in opt['coordinates'].items()}
+        scaled = {**opt, 'coordinates': coordinates}
+        for use_array in (False, True):
+            game_map = GameMap(width, height, 1, use_array=use_array)
+            centres = [(random.randrange(width), random.randrange(height)) for _ in range(100)]
+            boundaries = measure(lambda: game_map.set_boundaries(scaled), repeat)
+            nearby = measure(lambda: [game_map.get_nearby_tiles(x, y, radius) for x, y in centres], repeat)
+            operations = [('set_boundaries', boundaries), ('get_nearby_tiles_x100', nearby)]
+            if use_array:
+                view = measure(lambda: [game_map.get_nearby_view(x, y, radius) for x, y in centres], repeat)
+                operations.append(('get_nearby_view_x100', view))
+            for operation, result in operations:
+                result.update({'operation': operation, 'width': width, 'height': height, 'use_array': use_array})
+                results.append(result)
+    return results
+
+class BenchCharacter:
+    def __init__(self, name, location, coordinates):
+        self.name = name
+        self.location = location
+        self.coordinates = coordinates
+
+# The find_people scan app.py and run.py used before the occupancy index
+def find_people_scan(characters, prime_character):
+    output = ""
+    for name in characters:
+        if name != prime_character.name and characters[name].location == prime_character.location:
+            output = name if output == "" else output + f", {name}"
+    return output
+
+def bench_find_people(populations, repeat):
+    results = []
+    rng = random.Random(0)
+    for population in populations:
+        characters = {}
+        occupancy = OccupancyIndex()
+        for number in range(population):
+            character = BenchCharacter(f"VILLAGER{number}", rng.choice(LOCATIONS), (rng.randrange(100), rng.randrange(100)))
+            characters[character.name] = character
+            occupancy.add(character)
+        everyone = list(characters.values())
+        movers = everyone[:max(1, population // 10)]
+
+        # One tick: a tenth of the population moves, then everyone asks who is with them
+        def indexed_tick():
+            for character in movers:
+                character.location = rng.choice(LOCATIONS)
+                occupancy.update(character)
+            for character in everyone:
+                occupancy.format_people(character.location, exclude=character.name)
+
+        def scan_tick():
+            for character in everyone:
+                find_people_scan(characters, character)
+
+        for method, function in (('occupancy_index', indexed_tick), ('scan', scan_tick)):
+            result = measure(function, repeat if population <= 500 or method != 'scan' else 1)
+            result.update({'method': method, 'population': population})
+            results.append(result)
+    return results
+
+# Input: How many villagers walk at once and how many steps to time
+def bench_movement(populations, steps, size=100, density=0.1):
+    results = []
+    game_map = random_map(size, size, density)
+    collision_map = CollisionMap(game_map.map_data, '#')
+    free = [tuple(cell) for cell in np.argwhere(game_map.map_data == TILE_CODES[' '])]
+    for population in populations:
+        rng = random.Random(0)
+        walkers = [BenchCharacter(f"VILLAGER{number}", None, cell) for number, cell in enumerate(rng.sample(free, population))]
+        goals = rng.sample(free, population)
+        movement = MovementSystem(collision_map)
+
+        def walk():
+            for character, goal in zip(walkers, goals):
+                movement.set_destination(character, goal)
+            for _ in range(steps):
+                movement.step()
+
+        result = measure(walk, repeat=1)
+        result.update({'population': population, 'steps': steps, 'map': [size, size], 'density': density,
+                       'steps_per_second': steps / result['best_s'],
+                       'local_repaths': movement.local_repaths, 'waits': movement.waits,
+                       'full_repaths': movement.full_repaths, 'yields': movement.yields})
+        results.append(result)
+    return results
+
+def bench_ticks(populations, ticks):
+    # Imported here so the other benchmarks run without the LLM stack installed
+    from Backend.character import Character, run_command_headless
+    from Backend.llm_backend import BatchedLLM, LocalBackend, PromptBatcher
+    from Backend.simulation import create_simulation
+
+    results = []
+    for population in populations:
+        # max_batch=1 sends every prompt straight away, so the LLM adds no latency
+        llm = BatchedLLM(batcher=PromptBatcher(LocalBackend(), max_batch=1))
+        villagers = [(f"VILLAGER{number}", f"You are VILLAGER{number}.", LOCATIONS[number % len(LOCATIONS)])
+                     for number in range(population)]
+        simulation = create_simulation(
+            configure_opt({}),
+            lambda *args, **kwargs: Character(*args, llm=llm, verbose=False, **kwargs),
+            lambda *args, **kwargs: run_command_headless(*args, emit=lambda event: None, **kwargs),
+            villagers=villagers,
+        )
+        result = measure(lambda: [simulation.tick() for _ in range(ticks)], repeat=1)
+        result.update({'population': population, 'ticks': ticks, 'ticks_per_second': ticks / result['best_s']})
+        results.append(result)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the AI civilization hot paths")
+    parser.add_argument('--quick', action='store_true', help="Smaller maps and populations")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per case")
+    parser.add_argument('--ticks', type=int, default=5, help="Ticks per end-to-end case")
+    parser.add_argument('--steps', type=int, default=50, help="Steps per movement case")
+    parser.add_argument('--only', choices=('pathfinding', 'map_ops', 'find_people', 'movement', 'ticks'), action='append')
+    parser.add_argument('--output', help="File to write the JSON results to, defaults to stdout")
+    args = parser.parse_args(argv)
+
+    random.seed(0)
+    sizes = QUICK_MAP_SIZES if args.quick else MAP_SIZES
+    populations = QUICK_POPULATIONS if args.quick else POPULATIONS
+    suites = {
+        'pathfinding': lambda: bench_pathfinding(sizes, args.repeat),
+        'map_ops': lambda: bench_map_ops(sizes, args.repeat),
+        'find_people': lambda: bench_find_people(populations, args.repeat),
+        'movement': lambda: bench_movement([population for population in populations if population <= 500], args.steps),
+        'ticks': lambda: bench_ticks([population for population in populations if population <= 500], args.ticks),
+    }
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'commit': git_commit(),
+        'quick': args.quick,
+        'benchmarks': {},
+    }
+    for name, suite in suites.items():
+        if args.only and name not in args.only:
+            continue
+        print(f"Running {name}...", file=sys.stderr, flush=True)
+        results['benchmarks'][name] = suite()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+    return results
+
+
+if __name__ == '__main__':
+    main()
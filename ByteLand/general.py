@@ -2,181 +2,138 @@
 
 Collection of functions to generate and run the AI civilization
 
-"""
-import streamlit as st
-
-from langchain.llms import OpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from langchain.chains import SequentialChain
-from langchain.memory import ConversationSummaryMemory
+Streamlit and the text to speech pipeline are only imported once a command
+needs them, and the OpenAI key is read when the LLM client is created (see
+Backend/llm_backend.py), so importing this module is cheap.
 
-from Backend.navigation import *
-from gtts import gTTS
-import tempfile
+"""
 import os
-from apikey2 import apikey
-from IPython.display import Audio
+import queue
+import threading
 import time
-from mutagen.mp3 import MP3
 
-os.environ['OPENAI_API_KEY'] = apikey
+from Backend.navigation import *
+from Backend.character import Character, command_span, move_character
+from Backend.conversation import Conversation
 
 # [USE] {SWORD}   [MOVE] {SMITHERY}
 
-def play_audio_and_wait(file_path):
-    audio = Audio(file_path, autoplay=True)
-    st.write(audio)
-    audio
-
-def get_audio_duration(file_path):
-    audio = MP3(file_path)
-    return audio.info.length
+def write(text):
+    import streamlit as st
+    st.write(text)
 
-class Character():
-    """ Character()
+class TalkFeed:
+    """ TalkFeed()
 
-    Class which controls the functionality of the AI agents
+    Class which collects what the open conversations say while
+    Simulation.tick advances them on its worker threads. The page drains it
+    on the script thread, see run_tick_streamed. Each finished line starts
+    synthesizing straight away, so its clip is ready when it is played.
+    Every Streamlit session keeps its own feed and audio pipeline next to
+    its simulation, so sessions never see each other's conversations.
 
     """
-    def __init__(self, name = "", bio = "", location = "TOWNSQUARE", hand_item = "", coordinates = (0,0)):
-        self.name = name
-        self.location = location
-        self.hand_item = hand_item
-        self.coordinates = coordinates
-        
-        self.llm = OpenAI(temperature=0.9)
-        self.memory = ConversationSummaryMemory(llm=self.llm, memory_key='history', input_key='input', human_prefix='instructions', ai_prefix=f"Human {self.name}")
-        
-        command = 'You must follow these rules: Commands must be enclosed in []. Input one total command. Enclosed text must be all uppercase. End commands with a "|". Your commands are: [MOVE] (LOCATION) and [TALK] (NAME) and [PICKUP] (ITEM) and [USE] - this uses the item in your hand'
-        
-        turn_template = PromptTemplate(
-            input_variables=['input', 'history', 'bio', 'location', 'people', 'items', 'hand_item'],
-            template='{bio}\nHistory: {history}\nYou can only [MOVE] to these locations: TOWNSQUARE, TAVERN, and MARKET.\nYou are at {location} | PEOPLE: {people} | ITEMS: {items} | IN HAND ITEM: {hand_item}\nEnter a single command:'
-        )
-        
-        talk_template = PromptTemplate(
-            input_variables=['input', 'history', 'other_char', 'location' 'prev_dialogue'],
-            template='History: {history}\nEnter command [STOPTALKING] to end dialogue. You are talking to {other_char} at the {location}. They said "{prev_dialogue}"\nYour response:'
-        )
-        
-        self.bio = f'{bio}\n{command}'
-        self.turn_template = turn_template
-        self.talk_template = talk_template
-    
-    # Input: A string of a list of people, and a string of a list of items
-    # Output: The command given and the variable for that command. Both are None if input was invalid
-    def turn(self, people="", items = ""):
-        # People looks like 'NOBODY' or 'JOAN, JOHN'. Items looks like 'NOTHING' or 'HAMMER, SHOVEL, SINK'
-        
-        turn_chain = LLMChain(llm=self.llm, prompt=self.turn_template, memory=self.memory, verbose=True, output_key='command')
-        
-        response = turn_chain({'bio':self.bio, 'input':"", 'location':self.location, 'people':people, 'items':items, 'hand_item':self.hand_item})
-        command, variable = self.command_parsing(response['command'])
-        print(f"\n\n|||RESPONSE: {response['command']}")
-        
-        return command, variable
-
-    # Input: The command the AI gives
-    # Output: Divides the command into the command itself and the variable for that command
-    def command_parsing(self, input):
-        # Commands are: [MOVE] (LOCATION) | [TALK] (NAME) | [PICKUP] (ITEM) | [USE] (ITEM)
-        if input.find("[MOVE]"):
-            variable = input[input.find("]") + 1:input.find("|")].replace(" ", "")
-            command = input[input.find("["):input.find("]") + 1]
-            return command, variable
-            
-        elif input.find("[TALK]"):
-            variable = input[input.find("]") + 1:input.find("|")].replace(" ", "")
-            command = input[input.find("["):input.find("]") + 1]
-            return command, variable
-            
-        elif input.find("[PICKUP]"):
-            variable = input[input.find("]") + 1:input.find("|")].replace(" ", "")
-            command = input[input.find("["):input.find("]") + 1]
-            return command, variable
-        
-        elif input.find("[USE]"):
-            if self.hand_item == "NOTHING":
-                return None, None
-            else:
-                return "[USE]", None
-        elif input.find("[STOPTALKING]"):
-            return "[STOPTALKING]", None
-        else:
-            return None, None
-        
-    # Input: Other character's name and their previous dialogue
-    # Output: This character's respone, and a true/false if they ended conversation.
-    def talk(self, char, prev_dialogue = ""):
-        
-        talking_chain = LLMChain(llm=self.llm, prompt=self.talk_template, verbose=True, output_key='dialogue', memory=self.memory)
-        response = talking_chain({'input':"", 'other_char':char, 'location':self.location, 'prev_dialogue':prev_dialogue})
-        
-        command, v = self.command_parsing(response['dialogue'])
-        if command.find("STOPTALKING") != -1:
-            return response['dialogue'], True
-        
-        return response['dialogue'], False
-    
-def run_command(character, command, variable, collision_map, opt, CHARACTERS={}):
-    if command == "[MOVE]":
-        if variable in opt['coordinates']:
-            st.write(f"[{character.name} moved from {character.location} to {variable} ]")
-            character.location = variable
-            path = collision_map.find_path(character.coordinates, opt['coordinates'][variable])
-            # Directly iterate over the path
-            for location in path:
-                #TODO: Interface with frontend here
-                character.coordinates = location
-        else:
-            pass
-    elif command == "[TALK]":
-        # Implement logic for the [TALK] command
-        prev_dialogue = ""
+    def __init__(self):
+        self.events = queue.Queue()
+        self.audio = None
+        self.lock = threading.Lock()
+
+    # Output: This feed's AudioPipeline, created on first use
+    def get_audio(self):
+        with self.lock:
+            if self.audio is None:
+                from audio import AudioPipeline
+                self.audio = AudioPipeline()
+            return self.audio
+
+    def on_token(self, conversation, name, token):
+        self.events.put(('token', conversation.id, name, token))
+
+    def on_line(self, conversation, name, line):
+        line = f"{name}: {line}"
+        self.events.put(('line', conversation.id, line, self.get_audio().prepare(line)))
+
+    # Output: Every event put since the last call, in order
+    def drain(self):
+        drained = []
+        while True:
+            try:
+                drained.append(self.events.get_nowait())
+            except queue.Empty:
+                return drained
+
+# Input: The simulation of the page and the TalkFeed its run_command was given
+# Output: The decisions of the tick. The tick runs on a worker thread while this thread
+#         shows every conversation token by token and plays each finished line.
+def run_tick_streamed(engine, feed, poll_seconds=0.05):
+    import streamlit as st
+    from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+    result = {}
+    def tick():
         try:
-            other_char = CHARACTERS[variable]
+            result['decisions'] = engine.tick()
         except Exception as exception:
-            print("Made up a person")
-            return
-            
-        for i in range(2):
-            dialogue, end = character.talk(variable, prev_dialogue)
-            st.write(f"{character.name}: {dialogue}")  #TODO: Interface with frontend here
-            tts = gTTS(f"{character.name}: {dialogue}")
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-                tts.save(tmp_file.name)
-
-            play_audio_and_wait(tmp_file.name)
-            duration = get_audio_duration(tmp_file.name)
-            time.sleep(duration-1)
-            os.unlink(tmp_file.name)
-
-            if end:
-                break
+            result['error'] = exception
+
+    worker = add_script_run_ctx(threading.Thread(target=tick, daemon=True))
+    worker.start()
+    placeholders = {}  # conversation id -> (placeholder, text shown so far)
+    while True:
+        finished = not worker.is_alive()
+        for kind, conversation_id, first, second in feed.drain():
+            if kind == 'token':
+                placeholder, shown = placeholders.get(conversation_id) or (st.empty(), f"{first}: ")
+                shown += second
+                placeholder.write(shown)
+                placeholders[conversation_id] = (placeholder, shown)
+                continue
+            placeholder, _ = placeholders.pop(conversation_id, None) or (st.empty(), "")
+            placeholder.write(first)
+            feed.get_audio().playback.play(second.result())
+        if finished:
+            break
+        time.sleep(poll_seconds)
+
+    if 'error' in result:
+        raise result['error']
+    return result['decisions']
+
+# The page binds feed to its session's TalkFeed, see app.get_engine
+def run_command(character, command, variable, collision_map, opt, CHARACTERS={}, occupancy=None, movement=None, conversations=None, feed=None):
+    with command_span(character, command, variable):
+        if command == "[MOVE]":
+            if variable in opt['coordinates']:
+                write(f"[{character.name} moved from {character.location} to {variable} ]")
+                #TODO: Interface with frontend here
+                move_character(character, variable, collision_map, opt, occupancy, movement)
+            else:
+                pass
+        elif command == "[TALK]":
+            # Implement logic for the [TALK] command
+            try:
+                other_char = CHARACTERS[variable]
+            except Exception as exception:
+                print("Made up a person")
+                return
             
-            prev_dialogue, end = other_char.talk(character.name, dialogue)
-            st.write(f"{other_char.name}: {prev_dialogue}") #TODO: Interface with frontend here
-            tts = gTTS(f"{other_char.name}: {prev_dialogue}")
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-                tts.save(tmp_file.name)
-
-            play_audio_and_wait(tmp_file.name)
-            duration = get_audio_duration(tmp_file.name)
-            time.sleep(duration-1)
-            os.unlink(tmp_file.name)
-                    
-            if end:
-                break
+            if conversations is None:
+                (feed or TalkFeed()).get_audio().play_stream(Conversation(0, character, other_char).events())
+                return
+            # The simulation says the next line of every open conversation each tick
+            callbacks = {'on_token': feed.on_token, 'on_line': feed.on_line} if feed is not None else {}
+            conversation = conversations.start(character, other_char, **callbacks)
+            if conversation is None:
+                write(f"[{character.name} could not talk to {variable}, someone is already in a conversation ]")
+                return
+            write(f"[{character.name} started talking to {variable} ]")
             
-    elif command == "[PICKUP]":
-        # Implement logic for the [PICKUP] command
-        pass
-    elif command == "[USE]":
-        # Implement logic for the [USE] command
-        pass
-    else:
-        # Go Home
-        print("hello world")
\ No newline at end of file
+        elif command == "[PICKUP]":
+            # Implement logic for the [PICKUP] command
+            pass
+        elif command == "[USE]":
+            # Implement logic for the [USE] command
+            pass
+        else:
+            # Go Home
+            print("hello world")
\ No newline at end of file
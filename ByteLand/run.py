@@ -2,52 +2,242 @@
 
 Run project for AI Civilization
 
+Runs the simulation headless for a number of days, with no Streamlit or
+text to speech, and logs every event to a JSON Lines file. For example:
+
+    python run.py --days 3 --ticks-per-day 24 --population 50 --backend local
+
+With --shards N the villagers are split across N worker processes by
+location (see Backend/sharding.py). With --checkpoint-dir the world is checkpointed every --checkpoint-every
+ticks, and --resume carries on from the last checkpoint in that directory.
+With --map the world is read from a map file instead of configure_opt, and
+with --array-map the map is held in a numpy array (see Backend/map.py).
+Each run is appended to the --log file after a 'run' record, and --fresh
+truncates the file first.
+
 """
 
-from general import Character
-from general import *
-from Backend.map import *
-from Backend.navigation import *
+import argparse
+import functools
+import os
+import random
+import time
+
 from Backend.utilities import *
+from Backend.simulation import create_simulation
+from Backend.scheduler import TickScheduler
+from Backend.eventlog import EventLog
+from Backend.character import Character, run_command_headless
+from Backend.llm_backend import get_shared_llm
+from Backend.llm_cache import enable_completion_cache
+from Backend.tracing import TRACER
+from Backend.checkpoint import Checkpointer, CheckpointError, resume
+from Backend.sharding import ShardedSimulation
+from Backend.mapfile import configure_opt_from_map
+
+STARTING_LOCATIONS = ('TOWNSQUARE', 'TAVERN', 'MARKET')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the AI civilization headless")
+    parser.add_argument('--days', type=int, default=1, help="Number of days to simulate")
+    parser.add_argument('--ticks-per-day', type=int, default=1, help="Number of ticks in a day")
+    parser.add_argument('--population', type=int, default=len(VILLAGERS), help="Number of villagers")
+    parser.add_argument('--log', default='events.jsonl', help="File the events are appended to")
+    parser.add_argument('--fresh', action='store_true', help="Truncate the --log file before writing instead of appending")
+    parser.add_argument('--backend', choices=('openai', 'local'), default=None, help="LLM backend, defaults to $BYTELAND_LLM_BACKEND or openai")
+    parser.add_argument('--cache-mode', choices=('cache', 'record', 'replay', 'off'), default=os.environ.get('BYTELAND_CACHE_MODE', 'cache'))
+    parser.add_argument('--workers', type=int, default=8, help="Threads for conversations, and for agents whose LLM is not batched")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the starting locations of extra villagers")
+    parser.add_argument('--verbose', action='store_true', help="Print every prompt and response")
+    parser.add_argument('--trace', help="Write a Chrome trace of every span to this file")
+    parser.add_argument('--histograms', help="Write the span duration histograms to this JSON file")
+    parser.add_argument('--stream-talk', action='store_true', help="Log every token of a conversation as it is generated")
+    parser.add_argument('--shards', type=int, default=0, help="Worker processes to split the villagers across, 0 to run in this process. "
+                        "Shards own whole locations, so more shards than occupied locations sit idle")
+    parser.add_argument('--partition', choices=('location', 'region'), default='location', help="How locations are split across shards")
+    parser.add_argument('--map', help="Map file to load the world from (see Backend/mapfile.py)")
+    parser.add_argument('--array-map', action='store_true', help="Keep the map in a numpy array of tile codes (needs numpy, not used with --map)")
+    parser.add_argument('--checkpoint-dir', help="Directory to write checkpoints to")
+    parser.add_argument('--checkpoint-every', type=int, default=100, help="Ticks between checkpoints")
+    parser.add_argument('--resume', action='store_true', help="Carry on from the last checkpoint in --checkpoint-dir")
+    args = parser.parse_args(argv)
+    if args.fresh and args.resume:
+        parser.error("--fresh cannot be used with --resume, which carries on the existing log")
+    if args.shards:
+        unsupported = [flag for flag, value in (('--checkpoint-dir', args.checkpoint_dir), ('--resume', args.resume),
+                                                ('--trace', args.trace), ('--histograms', args.histograms)) if value]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be used with --shards")
+    return args
+
+# Output: The starting villagers, topped up with generated ones to reach the population
+def make_villagers(population, seed=0):
+    villagers = list(VILLAGERS[:population])
+    rng = random.Random(seed)
+    for number in range(len(villagers) + 1, population + 1):
+        name = f"VILLAGER{number}"
+        bio = f"You are a villager named {name} in a small medieval town of {population}."
+        villagers.append((name, bio, rng.choice(STARTING_LOCATIONS)))
+    return villagers
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.backend:
+        os.environ['BYTELAND_LLM_BACKEND'] = args.backend
+    if args.trace or args.histograms:
+        TRACER.enable()
+
+    started = time.perf_counter()
+    if args.cache_mode != 'off':
+        enable_completion_cache(mode=args.cache_mode)
+
+    if args.map:
+        opt = configure_opt_from_map(args.map)
+    else:
+        opt = {}
+        opt = configure_opt(opt)
+    if args.shards:
+        return run_sharded(args, opt, started)
+    batcher = get_shared_llm().batcher
+    timings = {'setup': 0.0, 'decide': 0.0, 'apply': 0.0, 'walk': 0.0, 'talk': 0.0, 'log': 0.0, 'checkpoint': 0.0}
+
+    with EventLog(args.log, append=not args.fresh, run=vars(args)) as event_log:
+        character_class = functools.partial(Character, verbose=args.verbose)
+        simulation = create_simulation(
+            opt,
+            character_class,
+            functools.partial(run_command_headless, emit=event_log.write, stream_tokens=args.stream_talk),
+            villagers=make_villagers(args.population, args.seed),
+            scheduler=TickScheduler(max_workers=args.workers),
+            use_array=args.array_map,
+        )
+        checkpointer = None
+        if args.checkpoint_dir:
+            try:
+                checkpointer = Checkpointer(args.checkpoint_dir, every=args.checkpoint_every, resuming=args.resume)
+            except CheckpointError as error:
+                raise SystemExit(f"run.py: {error}")
+        if args.resume and checkpointer is not None:
+            resumed = time.perf_counter()
+            if resume(simulation, args.checkpoint_dir, character_class, checkpointer) is not None:
+                print(f"Resumed at tick {simulation.tick_count} in {time.perf_counter() - resumed:.3f}s")
+        timings['setup'] = time.perf_counter() - started
+        first_tick = simulation.tick_count
+
+        for tick in range(first_tick, args.days * args.ticks_per_day):
+            day = tick // args.ticks_per_day + 1
+            event_log.context = {'day': day, 'tick': tick + 1}
+            simulation.tick()
+            for phase in ('decide', 'apply', 'walk', 'talk'):
+                timings[phase] += simulation.last_timings[phase]
+            for name, location in simulation.last_arrivals:
+                event_log.write({'type': 'arrive', 'name': name, 'location': location})
+
+            log_started = time.perf_counter()
+            event_log.flush()
+            timings['log'] += time.perf_counter() - log_started
+
+            if checkpointer is not None:
+                checkpoint_started = time.perf_counter()
+                checkpointer.maybe_save(simulation, day=day)
+                timings['checkpoint'] += time.perf_counter() - checkpoint_started
+
+        elapsed = time.perf_counter() - started
+        ticks = max(simulation.tick_count - first_tick, 1)
+        run_time = max(elapsed - timings['setup'], 1e-9)
+        report = {
+            'type': 'summary',
+            'days': args.days,
+            'ticks': simulation.tick_count - first_tick,
+            'population': len(simulation.characters),
+            'events': event_log.count,
+            'ticks_per_second': (simulation.tick_count - first_tick) / run_time,
+            'llm_calls_per_tick': batcher.prompts / ticks,
+            'llm_requests_per_tick': batcher.batches / ticks,
+            'conversations': {'started': simulation.conversations.started, 'finished': simulation.conversations.finished,
+                              'stopped_early': simulation.conversations.stopped_early},
+            'movement': {'local_repaths': simulation.movement.local_repaths, 'waits': simulation.movement.waits,
+                         'full_repaths': simulation.movement.full_repaths, 'yields': simulation.movement.yields},
+            'over_budget_calls': sum(character.prompts.usage['over_budget'] for character in simulation.characters.values()),
+            'wall_time': {'total': elapsed, **timings},
+        }
+        event_log.context = {}
+        event_log.write(report)
+
+    print(f"Simulated {report['ticks']} ticks of {report['population']} villagers in {elapsed:.2f}s")
+    print(f"  ticks/sec:         {report['ticks_per_second']:.3f}")
+    print(f"  LLM calls/tick:    {report['llm_calls_per_tick']:.2f} in {report['llm_requests_per_tick']:.2f} requests")
+    print(f"  conversations:     {report['conversations']['started']} started, {report['conversations']['stopped_early']} ended by [STOPTALKING]")
+    print(f"  movement:          {report['movement']['local_repaths']} local repaths, {report['movement']['waits']} waits, "
+          f"{report['movement']['full_repaths']} full repaths, {report['movement']['yields']} yields")
+    if report['over_budget_calls']:
+        print(f"  over token budget: {report['over_budget_calls']} calls")
+    print("  wall time:         " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in report['wall_time'].items()))
+    print(f"  events written to: {args.log}")
+
+    if TRACER.enabled:
+        for name, stats in sorted(TRACER.histograms().items(), key=lambda item: -item[1]['total_s']):
+            print(f"  {name:<24} {stats['count']:>7} calls {stats['total_s']:>9.3f}s total {stats['mean_s'] * 1000:>9.3f}ms mean")
+    if args.trace:
+        TRACER.export_chrome_trace(args.trace)
+    if args.histograms:
+        TRACER.export_histograms(args.histograms)
+    return report
+
+# Runs the days across worker processes. Checkpoints are not taken in this mode.
+def run_sharded(args, opt, started):
+    timings = {'setup': 0.0, 'barrier': 0.0, 'route': 0.0, 'log': 0.0}
+    with EventLog(args.log, append=not args.fresh, run=vars(args)) as event_log, ShardedSimulation(
+        opt,
+        functools.partial(Character, verbose=args.verbose),
+        shards=args.shards,
+        partition=args.partition,
+        max_workers=args.workers,
+        cache_mode=args.cache_mode,
+        use_array=args.array_map,
+    ) as simulation:
+        simulation.add_villagers(make_villagers(args.population, args.seed))
+        timings['setup'] = time.perf_counter() - started
+
+        for tick in range(args.days * args.ticks_per_day):
+            events = simulation.tick()
+            timings['barrier'] += simulation.last_timings['barrier']
+            timings['route'] += simulation.last_timings['route']
+
+            log_started = time.perf_counter()
+            event_log.context = {'day': tick // args.ticks_per_day + 1, 'tick': tick + 1}
+            for event in events:
+                event_log.write(event)
+            event_log.flush()
+            timings['log'] += time.perf_counter() - log_started
+
+        elapsed = time.perf_counter() - started
+        ticks = max(simulation.tick_count, 1)
+        llm = simulation.llm_totals()
+        report = {
+            'type': 'summary',
+            'days': args.days,
+            'ticks': simulation.tick_count,
+            'population': len(simulation),
+            'shards': simulation.shards,
+            'shard_population': simulation.last_timings.get('population'),
+            'events': event_log.count,
+            'ticks_per_second': simulation.tick_count / max(elapsed - timings['setup'], 1e-9),
+            'llm_calls_per_tick': llm['prompts'] / ticks,
+            'llm_requests_per_tick': llm['batches'] / ticks,
+            'wall_time': {'total': elapsed, **timings},
+        }
+        event_log.context = {}
+        event_log.write(report)
+
+    print(f"Simulated {report['ticks']} ticks of {report['population']} villagers on {report['shards']} shards in {elapsed:.2f}s")
+    print(f"  ticks/sec:         {report['ticks_per_second']:.3f}")
+    print(f"  LLM calls/tick:    {report['llm_calls_per_tick']:.2f} in {report['llm_requests_per_tick']:.2f} requests")
+    print(f"  villagers/shard:   {report['shard_population']}")
+    print("  wall time:         " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in report['wall_time'].items()))
+    print(f"  events written to: {args.log}")
+    return report
+
 
-CHARACTERS = {}
-
-def find_people(prime_character):
-    output = ""
-    
-    for index, name in enumerate(CHARACTERS.keys()):
-        if name != prime_character.name:
-            if CHARACTERS[name].location == prime_character.location:
-                if output == "":
-                    output = name
-                else:
-                    output += f", {name}"
-                    
-    return output
-
-def character_turn(person, map, options):
-    command, variable = person.turn(people=find_people(person))
-    run_command(person, command, variable, map, options, CHARACTERS=CHARACTERS)
-
-def main():
-    opt = {}
-    opt = configure_opt(opt)
-    game_map = GameMap(opt['map_width'], opt['map_height'], opt['tile_size'])
-    collision_map = CollisionMap(game_map.map_data, opt['collision_char'])
-
-    gabe = Character("GABE", "You are a villager named GABE in a small medieval town of 4. You are new to this town and don't know many people. You are the new smith of the town.", "TOWNSQUARE", coordinates=opt['coordinates']['TOWNSQUARE'])
-    CHARACTERS[gabe.name] = gabe
-    izzy = Character("IZZY", "You are a villager named IZZY in a small medieval town of 4. You are the bartender of this town and heard there's a newcomer to the town. You want to meet him, his name is GABE.", "TOWNSQUARE", coordinates=opt['coordinates']['TOWNSQUARE'])
-    CHARACTERS[izzy.name] = izzy
-    aiden = Character("AIDEN", "You are a villager named AIDEN in a small medieval town of 4. You are the town leader, a retired wizard and you want to make sure the jester, MILES isn't too mischievous.", "MARKET", coordinates=opt['coordinates']['MARKET'])
-    CHARACTERS[aiden.name] = aiden
-    miles = Character("MILES", "You are a villager named MILES in a small medieval town of 4. You are the jester of this town and heard there's a newcomer to the town. You want to meet him, and prank him.", "MARKET", coordinates=opt['coordinates']['MARKET'])
-    CHARACTERS[miles.name] = miles
-    
-    character_turn(gabe, collision_map, opt)
-    character_turn(izzy, collision_map, opt)
-    character_turn(aiden, collision_map, opt)
-    character_turn(miles, collision_map, opt)
-
-
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
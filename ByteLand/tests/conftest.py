@@ -0,0 +1,11 @@
+""" conftest.py
+
+Lets the tests import the Backend package the way run.py does, from the ByteLand directory
+
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BYTELAND_LLM_BACKEND', 'local')
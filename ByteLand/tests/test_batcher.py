@@ -0,0 +1,56 @@
+""" test_batcher.py
+
+Tests of how the prompt batcher groups prompts into backend requests
+
+"""
+
+import pytest
+
+from Backend.llm_backend import LocalBackend, PromptBatcher
+
+class FailingBackend(LocalBackend):
+    """ FailingBackend()
+
+    Local backend whose every request fails
+
+    """
+    def generate(self, prompts, stop=None, max_tokens=None):
+        raise RuntimeError("backend down")
+
+def prompt(number):
+    return f"You are VILLAGER{number} | PEOPLE: NOBODY | ITEMS: NOTHING\nEnter a single command:"
+
+def test_gather_sends_a_tick_in_full_batches():
+    backend = LocalBackend()
+    batcher = PromptBatcher(backend, max_batch=20, window=60)
+    with batcher.gather():
+        futures = [batcher.submit(prompt(number), ['|'], 24) for number in range(30)]
+        assert not any(future.done() for future in futures[20:])
+    assert all(future.done() for future in futures)
+    assert (backend.requests, backend.prompts) == (2, 30)
+    assert [future.result() for future in futures] == backend.generate([prompt(number) for number in range(30)], stop=['|'])
+
+def test_a_lone_prompt_is_sent_after_the_window():
+    backend = LocalBackend()
+    batcher = PromptBatcher(backend, window=0.01)
+    assert batcher.submit(prompt(0)).result(timeout=5) == backend.complete(prompt(0))
+    assert backend.requests == 1
+
+def test_prompts_with_different_parameters_go_in_different_batches():
+    backend = LocalBackend()
+    batcher = PromptBatcher(backend, window=60)
+    with batcher.gather():
+        batcher.submit(prompt(0), ['|'], 24)
+        batcher.submit(prompt(1), ['|'], 24)
+        batcher.submit(prompt(2), None, 24)
+        batcher.submit(prompt(3), ['|'], None)
+    assert (backend.requests, backend.prompts) == (3, 4)
+    assert batcher.batches == 3
+
+def test_a_failed_request_fails_every_prompt_in_it():
+    batcher = PromptBatcher(FailingBackend(), window=60)
+    with batcher.gather():
+        futures = [batcher.submit(prompt(number)) for number in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result()
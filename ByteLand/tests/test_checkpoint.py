@@ -0,0 +1,83 @@
+""" test_checkpoint.py
+
+Round-trip tests of the binary checkpoints
+
+"""
+
+import functools
+import json
+import os
+
+import pytest
+
+from Backend.character import Character, run_command_headless
+from Backend.checkpoint import Checkpointer, CheckpointError, checkpoint_chain, grid_bytes, read_checkpoint, resume
+from Backend.llm_backend import BatchedLLM, LocalBackend, PromptBatcher
+from Backend.scheduler import TickScheduler
+from Backend.simulation import create_simulation
+from Backend.utilities import VILLAGERS, configure_opt
+
+def make_simulation():
+    character_class = functools.partial(Character, llm=BatchedLLM(batcher=PromptBatcher(LocalBackend())), verbose=False)
+    simulation = create_simulation(configure_opt({}), character_class, functools.partial(run_command_headless, emit=lambda event: None),
+                                   villagers=VILLAGERS[:6], scheduler=TickScheduler(max_workers=4))
+    return simulation, character_class
+
+# Output: Everything a checkpoint should bring back, in a comparable form
+def state(simulation):
+    characters = {}
+    for name, character in simulation.characters.items():
+        stream = character.memory_stream
+        characters[name] = (character.location, tuple(character.coordinates), character.hand_item,
+                            list(stream.texts), list(stream.timestamps))
+    return {
+        'tick_count': simulation.tick_count,
+        'movement_time': simulation.movement.time,
+        'grid': grid_bytes(simulation.game_map),
+        'characters': characters,
+        'events': sorted((x, y, json.dumps(event, default=str), expires_at)
+                         for x, y, event, expires_at in simulation.game_map.events.records.values()),
+        'walkers': {name: (walker.goal, walker.location, list(walker.planned) + list(walker.path))
+                    for name, walker in simulation.movement.walkers.items()},
+    }
+
+def test_full_and_incremental_checkpoints_round_trip(tmp_path):
+    simulation, character_class = make_simulation()
+    checkpointer = Checkpointer(str(tmp_path), every=0)
+    for _ in range(3):
+        simulation.tick()
+    simulation.game_map.set_event(2, 1, {'type': 'note', 'text': 'a sword was dropped'}, expires_at=50)
+    simulation.game_map.set_tile(4, 3, '#')
+    checkpointer.save(simulation, full=True)
+    for _ in range(2):
+        simulation.tick()
+    # Someone still on their way, so the walkers are part of the checkpoint too
+    walker = next(iter(simulation.characters.values()))
+    goal, location = max(((coordinates, name) for name, coordinates in simulation.opt['coordinates'].items()),
+                         key=lambda item: abs(item[0][0] - walker.coordinates[0]) + abs(item[0][1] - walker.coordinates[1]))
+    assert simulation.movement.set_destination(walker, goal, location)
+    simulation.movement.step()
+    incremental = checkpointer.save(simulation, day=1)
+    assert incremental.endswith('.incr')
+    expected = state(simulation)
+    assert expected['walkers'] and expected['events']
+
+    restored, _ = make_simulation()
+    meta = resume(restored, str(tmp_path), character_class)
+    assert meta['extra'] == {'day': 1}
+    assert state(restored) == expected
+
+def test_directory_with_checkpoints_is_refused_unless_resuming(tmp_path):
+    simulation, _ = make_simulation()
+    Checkpointer(str(tmp_path)).save(simulation)
+    with pytest.raises(CheckpointError):
+        Checkpointer(str(tmp_path))
+    Checkpointer(str(tmp_path), resuming=True)
+
+def test_chain_stops_at_a_gap_in_sequence_numbers(tmp_path):
+    simulation, _ = make_simulation()
+    checkpointer = Checkpointer(str(tmp_path), every=0)
+    paths = [checkpointer.save(simulation, full=(number == 0)) for number in range(4)]
+    os.remove(paths[2])
+    assert checkpoint_chain(str(tmp_path)) == paths[:2]
+    assert [read_checkpoint(path)[1] for path in paths[:2]] == [0, 1]
@@ -0,0 +1,71 @@
+""" test_commands.py
+
+Tests of the parser of the commands the AI agents give
+
+"""
+
+import pytest
+
+from Backend.commands import Command, CommandParser, split_items
+
+LOCATIONS = ('TOWNSQUARE', 'TAVERN', 'MARKET', 'WIZARD_HOUSE')
+CHARACTERS = ('JOAN', 'JOHN', 'WIZARD')
+
+@pytest.fixture
+def parser():
+    return CommandParser(locations=LOCATIONS, characters=CHARACTERS)
+
+@pytest.mark.parametrize('text, expected', [
+    (" [MOVE] TAVERN ", Command('[MOVE]', 'TAVERN')),
+    ("[move] market", Command('[MOVE]', 'MARKET')),
+    ("[ MOVE ] (WIZARD HOUSE)", Command('[MOVE]', 'WIZARD_HOUSE')),
+    ("[TALK] JOHN | and then some", Command('[TALK]', 'JOHN')),
+    ("Thinking... [MOVE] TAVERN [TALK] JOAN", Command('[MOVE]', 'TAVERN')),
+    ("[STOPTALKING]", Command('[STOPTALKING]', None)),
+])
+def test_well_formed_commands_parse_as_written(parser, text, expected):
+    assert parser.parse(text, speaker='JOAN') == expected
+    assert parser.stats == {'parsed': 1, 'repaired': 0, 'invalid': 0}
+
+@pytest.mark.parametrize('text, expected', [
+    ("[MOVE] TOWN SQUARE", Command('[MOVE]', 'TOWNSQUARE')),
+    ("[MOVE] TAVER", Command('[MOVE]', 'TAVERN')),
+    ("[MOVE] TAVERN TO DRINK", Command('[MOVE]', 'TAVERN')),
+    ("I will MOVE to the MARKET.", Command('[MOVE]', 'MARKET')),
+    ("talk to John", Command('[TALK]', 'JOHN')),
+])
+def test_near_misses_are_repaired_locally(parser, text, expected):
+    assert parser.parse(text, speaker='JOAN') == expected
+    assert parser.stats == {'parsed': 0, 'repaired': 1, 'invalid': 0}
+
+@pytest.mark.parametrize('text, kwargs', [
+    ("I think I will rest here a while.", {}),
+    ("[MOVE] THE MOON", {}),
+    ("[MOVE]", {}),
+    ("[TALK] WIZARD", {'speaker': 'WIZARD'}),
+    ("[USE] HAMMER", {'hand_item': ""}),
+    ("[PICKUP] SWORD", {'items': ['HAMMER', 'SHOVEL']}),
+    ("", {}),
+])
+def test_unreadable_commands_are_invalid(parser, text, kwargs):
+    assert parser.parse(text, **kwargs) == Command(None, None)
+    assert parser.stats == {'parsed': 0, 'repaired': 0, 'invalid': 1}
+
+def test_pickup_is_checked_against_the_items_in_view(parser):
+    assert parser.parse("[PICKUP] SHOVEL", items=['HAMMER', 'SHOVEL']) == Command('[PICKUP]', 'SHOVEL')
+    assert parser.parse("[PICKUP] HAMER", items=['HAMMER', 'SHOVEL']) == Command('[PICKUP]', 'HAMMER')
+
+def test_use_needs_something_in_hand(parser):
+    assert parser.parse("[USE]", hand_item="HAMMER") == Command('[USE]', None)
+    assert parser.parse("[USE]", hand_item="NOTHING") == Command(None, None)
+
+def test_without_known_names_any_variable_is_accepted():
+    assert CommandParser().parse("[TALK] STRANGER") == Command('[TALK]', 'STRANGER')
+
+def test_is_stop_finds_stoptalking_anywhere():
+    assert CommandParser.is_stop("Farewell for now. [ stoptalking ]")
+    assert not CommandParser.is_stop("Farewell for now, I will stop talking.")
+
+def test_split_items():
+    assert split_items("HAMMER, shovel ,SINK") == ['HAMMER', 'SHOVEL', 'SINK']
+    assert split_items("NOTHING") == []
@@ -0,0 +1,25 @@
+""" test_eventlog.py
+
+Tests that runs are appended to the event log unless it is started afresh
+
+"""
+
+from Backend.eventlog import EventLog, read_runs
+
+def write_run(path, number, **kwargs):
+    with EventLog(path, run={'number': number}, **kwargs) as event_log:
+        event_log.write({'type': 'move', 'name': "GABE"})
+
+def test_runs_are_appended_by_default(tmp_path):
+    path = tmp_path / "events.jsonl"
+    write_run(path, 1)
+    write_run(path, 2)
+    runs = read_runs(path)
+    assert [run['number'] for run, _ in runs] == [1, 2]
+    assert all(len(events) == 1 for _, events in runs)
+
+def test_append_false_truncates(tmp_path):
+    path = tmp_path / "events.jsonl"
+    write_run(path, 1)
+    write_run(path, 2, append=False)
+    assert [run['number'] for run, _ in read_runs(path)] == [2]
@@ -0,0 +1,64 @@
+""" test_events.py
+
+Tests of the spatial event index and its expiry
+
+"""
+
+import random
+
+from Backend.events import EventIndex
+from Backend.map import GameMap
+
+def test_events_expire_in_time_order():
+    index = EventIndex(chunk_size=4)
+    index.add(1, 1, 'FIRE', expires_at=5)
+    index.add(2, 2, 'SONG', expires_at=2)
+    index.add(3, 3, 'STATUE')
+    assert index.expire(1) == []
+    assert index.expire(2) == [(2, 2, 'SONG')]
+    assert index.expire(10) == [(1, 1, 'FIRE')]
+    assert len(index) == 1
+    assert index.at(3, 3) == ['STATUE']
+    assert index.at(1, 1) == [] and (1, 1) not in index.tiles
+
+def test_removed_events_are_skipped_when_they_expire():
+    index = EventIndex()
+    first = index.add(0, 0, 'FIRE', expires_at=1)
+    index.add(0, 0, 'FIRE', expires_at=3)
+    assert index.remove(first) == 'FIRE'
+    assert index.remove(first) is None
+    assert index.expire(2) == []
+    assert index.expire(3) == [(0, 0, 'FIRE')]
+    assert len(index) == 0 and not index.tiles and not index.chunks
+
+def test_add_many_expires_like_add():
+    events = [(x, x, f'EVENT{x}', float(x % 7)) for x in range(50)]
+    one_at_a_time = EventIndex(chunk_size=8)
+    for event in events:
+        one_at_a_time.add(*event)
+    batched = EventIndex(chunk_size=8)
+    batched.add(0, 0, 'EARLY', expires_at=0)
+    batched.add_many(events)
+    for now in range(7):
+        assert sorted(batched.expire(now)) == sorted(one_at_a_time.expire(now) + ([(0, 0, 'EARLY')] if now == 0 else []))
+    assert len(batched) == len(one_at_a_time) == 0
+
+def test_window_queries_match_a_scan():
+    rng = random.Random(0)
+    index = EventIndex(chunk_size=5)
+    events = [(rng.randrange(40), rng.randrange(30), number) for number in range(200)]
+    for x, y, event in events:
+        index.add(x, y, event)
+    for _ in range(50):
+        x, y, radius = rng.randrange(40), rng.randrange(30), rng.randrange(8)
+        expected = [event for event in events if abs(event[0] - x) <= radius and abs(event[1] - y) <= radius]
+        assert sorted(index.within_radius(x, y, radius), key=lambda event: event[2]) == expected
+
+def test_game_map_drops_off_map_events_and_expires_the_rest():
+    game_map = GameMap(10, 8, 1)
+    assert game_map.set_event(10, 0, 'FIRE', expires_at=1) is None
+    game_map.set_events([(1, 1, 'FIRE', 1), (-1, 1, 'LOST', 1), (9, 7, 'SONG', None)])
+    assert game_map.get_nearby_events(0, 0, 2) == [(1, 1, 'FIRE')]
+    assert game_map.expire_events(1) == [(1, 1, 'FIRE')]
+    assert game_map.get_events(1, 1) == []
+    assert game_map.get_events(9, 7) == ['SONG']
@@ -0,0 +1,80 @@
+""" test_llm_cache.py
+
+Tests of the completion cache: its key, record and replay, and streamed completions
+
+"""
+
+import pytest
+from langchain.globals import set_llm_cache
+
+from Backend.llm_backend import BatchedLLM, LocalBackend, PromptBatcher, stream_completion
+from Backend.llm_cache import CompletionCache, ReplayMissError
+
+class CountingBackend(LocalBackend):
+    """ CountingBackend()
+
+    Local backend whose completions are cut to max_tokens words, so a wrong
+    cache key shows up as a completion of the wrong length
+
+    """
+    def generate(self, prompts, stop=None, max_tokens=None):
+        completions = super().generate(prompts, stop, max_tokens)
+        if max_tokens is None:
+            return completions
+        return [" ".join(completion.split()[:max_tokens]) for completion in completions]
+
+@pytest.fixture
+def cache_path(tmp_path):
+    yield str(tmp_path / 'cache.sqlite')
+    set_llm_cache(None)
+
+def make_llm(cache_path, mode):
+    cache = CompletionCache(cache_path, mode=mode)
+    set_llm_cache(cache)
+    backend = CountingBackend()
+    return BatchedLLM(batcher=PromptBatcher(backend)), backend, cache
+
+def complete(llm, prompt, **kwargs):
+    return llm.generate([prompt], **kwargs).generations[0][0].text
+
+def test_max_tokens_is_part_of_the_key(cache_path):
+    llm, backend, _ = make_llm(cache_path, 'cache')
+    short = complete(llm, "Tell me about the village", max_tokens=2)
+    long = complete(llm, "Tell me about the village", max_tokens=5)
+    assert len(short.split()) == 2 and len(long.split()) == 5
+    assert complete(llm, "Tell me about the village", max_tokens=2) == short
+    assert backend.prompts == 2
+
+def test_replay_returns_the_recording_in_order(cache_path):
+    llm, backend, _ = make_llm(cache_path, 'record')
+    prompts = ["first", "second", "first"]
+    recorded = [complete(llm, prompt) for prompt in prompts]
+    assert backend.prompts == 3
+
+    llm, backend, _ = make_llm(cache_path, 'replay')
+    assert [complete(llm, prompt) for prompt in prompts] == recorded
+    assert backend.prompts == 0
+    with pytest.raises(ReplayMissError):
+        complete(llm, "never recorded")
+
+def test_hits_are_not_written_until_flushed(cache_path):
+    llm, _, cache = make_llm(cache_path, 'cache')
+    complete(llm, "hello")
+    changes = cache.connection.total_changes
+    for _ in range(5):
+        complete(llm, "hello")
+    assert cache.hits == 5
+    assert cache.connection.total_changes == changes
+    cache.flush()
+    assert cache.connection.total_changes == changes + 1
+    cache.close()
+
+def test_streamed_completions_are_cached(cache_path):
+    llm, backend, _ = make_llm(cache_path, 'cache')
+    prompt = "Greet your neighbour. Your response:"
+    streamed = "".join(stream_completion(llm, prompt))
+    assert "".join(stream_completion(llm, prompt)) == streamed
+    assert backend.prompts == 1
+    # A different max_tokens is a different key, so it is asked for again
+    "".join(stream_completion(llm, prompt, max_tokens=2))
+    assert backend.prompts == 2
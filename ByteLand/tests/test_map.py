@@ -0,0 +1,38 @@
+""" test_map.py
+
+Tests that the GameMap answers the same whichever way it is stored
+
+"""
+
+import pytest
+
+from Backend.map import GameMap
+from Backend.utilities import TILE_CODES, configure_opt
+
+@pytest.fixture
+def maps():
+    opt = configure_opt({})
+    maps = [GameMap(opt['map_width'], opt['map_height'], opt['tile_size'], use_array=use_array) for use_array in (False, True)]
+    for game_map in maps:
+        game_map.set_boundaries(opt)
+    return maps
+
+@pytest.mark.parametrize('x, y, radius', [(0, 0, 2), (6, 3, 1), (12, 6, 3), (5, 2, 10)])
+def test_nearby_tiles_are_coordinates_in_every_mode(maps, x, y, radius):
+    listed, arrayed = maps
+    assert listed.get_nearby_tiles(x, y, radius) == arrayed.get_nearby_tiles(x, y, radius)
+
+def test_nearby_view_holds_the_tiles_of_the_window(maps):
+    listed, arrayed = maps
+    x_min, y_min, _, _ = arrayed.nearby_bounds(6, 3, 2)
+    view = arrayed.get_nearby_view(6, 3, 2)
+    for x, y in arrayed.get_nearby_tiles(6, 3, 2):
+        assert view[y - y_min][x - x_min] == TILE_CODES[listed.get_tile(x, y)]
+    with pytest.raises(ValueError):
+        listed.get_nearby_view(6, 3, 2)
+
+@pytest.mark.parametrize('use_array', [False, True])
+def test_boundaries_with_no_locations(use_array):
+    game_map = GameMap(5, 4, 1, use_array=use_array)
+    game_map.set_boundaries({'coordinates': {}})
+    assert game_map.get_tile(0, 0) == '#' and game_map.get_tile(2, 2) == ' '
@@ -0,0 +1,51 @@
+""" test_mapfile.py
+
+Round-trip tests of the memory-mapped map files
+
+"""
+
+import pytest
+
+from Backend.map import GameMap
+from Backend.mapfile import MapFile, MapFileError, configure_opt_from_map, convert_opt
+from Backend.navigation import CollisionMap
+from Backend.utilities import TILE_CODES, configure_opt
+
+def test_converted_map_matches_set_boundaries(tmp_path):
+    opt = configure_opt({})
+    path = convert_opt(opt, str(tmp_path / 'village.bymap'), chunk_size=4)
+    game_map = GameMap(opt['map_width'], opt['map_height'], opt['tile_size'], use_array=True)
+    game_map.set_boundaries(opt)
+
+    with MapFile(path) as map_file:
+        assert (map_file.width, map_file.height, map_file.tile_size) == (opt['map_width'], opt['map_height'], opt['tile_size'])
+        assert map_file.locations == opt['coordinates']
+        assert [map_file.row(y) for y in range(map_file.height)] == [bytes(row) for row in game_map.map_data]
+
+        in_memory = CollisionMap(game_map.map_data, opt['collision_char'])
+        from_file = CollisionMap(map_file, opt['collision_char'])
+        for start in opt['coordinates'].values():
+            for end in opt['coordinates'].values():
+                assert from_file.find_path(start, end) == in_memory.find_path(start, end)
+
+    assert configure_opt_from_map(path)['coordinates'] == opt['coordinates']
+
+def test_tiles_written_across_chunks_read_back(tmp_path):
+    path = MapFile.create(str(tmp_path / 'world.bymap'), 37, 21, locations={'WELL': (20, 36)}, chunk_size=8)
+    cells = [(0, 0), (7, 7), (7, 8), (8, 7), (20, 36), (13, 30)]
+    with MapFile(path, writable=True) as map_file:
+        for row, col in cells:
+            map_file.set(row, col, TILE_CODES['#'])
+    game_map = GameMap.open(path)
+    try:
+        walls = {(y, x) for y in range(game_map.height) for x in range(game_map.width) if game_map.get_tile(x, y) == '#'}
+        assert walls == set(cells)
+        assert game_map.map_file.locations == {'WELL': (20, 36)}
+    finally:
+        game_map.close()
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / 'not-a-map.bymap'
+    path.write_bytes(b'\0' * 128)
+    with pytest.raises(MapFileError):
+        MapFile(str(path))
@@ -0,0 +1,105 @@
+""" test_movement.py
+
+Tests that villagers walking at once never share a tile and never deadlock
+
+"""
+
+import random
+
+import pytest
+
+from Backend.movement import MovementSystem, ReservationTable
+from Backend.navigation import CollisionMap
+
+# Two rooms joined by a corridor one tile wide
+CORRIDOR = ["###############",
+            "#   #######   #",
+            "#             #",
+            "#   #######   #",
+            "###############"]
+WEST, EAST = (2, 1), (2, 13)
+
+class Walker:
+    """ Walker()
+
+    Stand-in for a Character, which is all the movement system reads
+
+    """
+    def __init__(self, name, coordinates):
+        self.name = name
+        self.coordinates = coordinates
+
+# Input: The movement system, the walkers and how many steps they get to arrive
+# Output: The step every walker had arrived by. Fails if two walkers still on their way
+#         share a tile that is not a location, or swap tiles, or if any has not arrived.
+def walk_all(movement, walkers, max_steps):
+    arrived = set()
+    for step in range(max_steps):
+        before = {walker.name: tuple(walker.coordinates) for walker in walkers}
+        arrived.update(walker.character.name for walker in movement.step())
+
+        moving = [walker for walker in walkers if movement.is_moving(walker.name)]
+        cells = [tuple(walker.coordinates) for walker in moving if tuple(walker.coordinates) not in movement.table.shared]
+        assert len(cells) == len(set(cells)), f"walkers share a tile at step {step}"
+        after = {tuple(walker.coordinates): walker.name for walker in walkers}
+        for walker in walkers:
+            other = after.get(before[walker.name])
+            if other is not None and other != walker.name and before[other] == tuple(walker.coordinates) != before[walker.name]:
+                pytest.fail(f"{walker.name} and {other} swapped tiles at step {step}")
+        if len(arrived) == len(walkers):
+            return step
+    pytest.fail(f"{sorted(walker.name for walker in walkers if walker.name not in arrived)} never arrived")
+
+@pytest.mark.parametrize('window', [3, 8])
+def test_crowds_pass_each_other_in_a_corridor(window):
+    collision_map = CollisionMap([list(row) for row in CORRIDOR], '#')
+    movement = MovementSystem(collision_map, shared=(WEST, EAST), window=window)
+    walkers = ([Walker(f"WEST{number}", cell) for number, cell in enumerate([(1, 2), (2, 2), (3, 2), (1, 3), (3, 3)])] +
+               [Walker(f"EAST{number}", cell) for number, cell in enumerate([(1, 12), (2, 12), (3, 12), (1, 11)])])
+    for walker in walkers:
+        assert movement.set_destination(walker, EAST if walker.name.startswith("WEST") else WEST)
+    walk_all(movement, walkers, 400)
+    assert movement.yields > 0
+
+def test_a_walker_in_a_dead_end_gets_out():
+    # The walker at the end of the passage must leave before the other can reach its goal there
+    maze = ["#######",
+            "#     #",
+            "### ###",
+            "### ###",
+            "#######"]
+    collision_map = CollisionMap([list(row) for row in maze], '#')
+    movement = MovementSystem(collision_map)
+    inside, outside = Walker("A", (3, 3)), Walker("B", (1, 3))
+    assert movement.set_destination(inside, (1, 1))
+    assert movement.set_destination(outside, (3, 3))
+    walk_all(movement, [inside, outside], 100)
+
+@pytest.mark.parametrize('seed', range(10))
+def test_crowded_random_maps_have_no_deadlocks(seed):
+    rng = random.Random(seed)
+    size = 16
+    maze = [['#' if row in (0, size - 1) or col in (0, size - 1) or rng.random() < 0.2 else ' '
+             for col in range(size)] for row in range(size)]
+    free = [(row, col) for row in range(size) for col in range(size) if maze[row][col] == ' ']
+    collision_map = CollisionMap(maze, '#')
+    movement = MovementSystem(collision_map)
+    walkers = []
+    for number, (start, goal) in enumerate(zip(rng.sample(free, 25), rng.sample(free, 25))):
+        walker = Walker(f"VILLAGER{number:02d}", start)
+        if movement.set_destination(walker, goal):
+            walkers.append(walker)
+    walk_all(movement, walkers, 1000)
+
+def test_is_free_forbids_swaps_even_with_a_building():
+    table = ReservationTable(shared=[(0, 1)])
+    table.reserve("A", 1, (0, 1), previous=(0, 0))
+    assert not table.is_free("B", 0, (0, 1), (0, 0))
+    assert table.is_free("B", 0, (0, 1), (0, 2))
+
+def test_can_rest_only_where_nobody_passes_later():
+    table = ReservationTable()
+    table.reserve("A", 5, (1, 1), previous=(1, 0))
+    assert not table.can_rest("B", 3, (1, 1))
+    assert table.can_rest("B", 6, (1, 1))
+    assert table.can_rest("A", 3, (1, 1))
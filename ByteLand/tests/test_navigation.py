@@ -0,0 +1,92 @@
+""" test_navigation.py
+
+Tests that A* in CollisionMap finds optimal paths, with and without tile weights
+
+"""
+
+import heapq
+import math
+import random
+
+import pytest
+
+from Backend.navigation import CollisionMap, path_finder
+
+def random_maze(rng, height, width, density):
+    return [['#' if rng.random() < density else ' ' for _ in range(width)] for _ in range(height)]
+
+# Output: The cost of entering each tile along the path, with diagonal steps costing sqrt(2) times as much
+def path_cost(path, weights):
+    cost = 0.0
+    for (row, col), (n_row, n_col) in zip(path, path[1:]):
+        step = math.sqrt(2) if row != n_row and col != n_col else 1.0
+        cost += step * (weights[n_row][n_col] if weights else 1.0)
+    return cost
+
+# Output: The cost of the cheapest path by Dijkstra's algorithm, following the same rules as
+#         CollisionMap, or None if there is none
+def dijkstra(maze, start, end, weights=None, diagonal=False):
+    height, width = len(maze), len(maze[0])
+    moves = [(-1, 0), (1, 0), (0, -1), (0, 1)] + ([(-1, -1), (-1, 1), (1, -1), (1, 1)] if diagonal else [])
+    best = {start: 0.0}
+    heap = [(0.0, start)]
+    while heap:
+        cost, (row, col) = heapq.heappop(heap)
+        if (row, col) == end:
+            return cost
+        if cost > best[(row, col)]:
+            continue
+        for d_row, d_col in moves:
+            n_row, n_col = row + d_row, col + d_col
+            if not (0 <= n_row < height and 0 <= n_col < width):
+                continue
+            if maze[n_row][n_col] == '#' and (n_row, n_col) != end:
+                continue
+            if d_row and d_col and (maze[row][n_col] == '#' or maze[n_row][col] == '#'):
+                continue
+            step = math.sqrt(2) if d_row and d_col else 1.0
+            next_cost = cost + step * (weights[n_row][n_col] if weights else 1.0)
+            if next_cost < best.get((n_row, n_col), math.inf):
+                best[(n_row, n_col)] = next_cost
+                heapq.heappush(heap, (next_cost, (n_row, n_col)))
+    return None
+
+def check_paths(diagonal=False, weighted=False):
+    rng = random.Random(1)
+    for _ in range(40):
+        maze = random_maze(rng, 12, 15, 0.25)
+        weights = [[rng.randint(1, 5) for _ in range(15)] for _ in range(12)] if weighted else None
+        collision_map = CollisionMap(maze, '#', diagonal=diagonal, weights=weights)
+        for _ in range(5):
+            start = (rng.randrange(12), rng.randrange(15))
+            end = (rng.randrange(12), rng.randrange(15))
+            expected = dijkstra(maze, start, end, weights, diagonal)
+            path = collision_map.find_path(start, end)
+            if expected is None:
+                assert path == []
+                continue
+            assert path[0] == start and path[-1] == end
+            for (row, col), (n_row, n_col) in zip(path, path[1:]):
+                assert max(abs(row - n_row), abs(col - n_col)) == 1
+                assert maze[n_row][n_col] != '#' or (n_row, n_col) == end
+            assert math.isclose(path_cost(path, weights), expected)
+
+def test_paths_are_optimal():
+    check_paths()
+
+def test_diagonal_paths_are_optimal():
+    check_paths(diagonal=True)
+
+def test_weighted_paths_are_optimal():
+    check_paths(weighted=True)
+    check_paths(diagonal=True, weighted=True)
+
+def test_weights_below_one_are_rejected():
+    with pytest.raises(ValueError):
+        CollisionMap([[' ', ' ']], '#', weights=[[1, 0.5]])
+
+def test_path_finder_returns_false_when_walled_off():
+    maze = [[' ', '#', ' '],
+            ['#', '#', ' '],
+            [' ', ' ', ' ']]
+    assert path_finder(maze, (0, 0), (0, 2), '#') is False
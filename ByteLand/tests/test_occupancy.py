@@ -0,0 +1,56 @@
+""" test_occupancy.py
+
+Tests of the index of which characters are where
+
+"""
+
+import random
+
+from Backend.occupancy import OccupancyIndex
+
+class Villager:
+    def __init__(self, name, location, coordinates):
+        self.name = name
+        self.location = location
+        self.coordinates = coordinates
+
+def test_people_match_a_scan_of_everyone():
+    rng = random.Random(3)
+    locations = ['TOWNSQUARE', 'TAVERN', 'MARKET']
+    villagers = [Villager(f"V{number}", rng.choice(locations), (rng.randrange(40), rng.randrange(40))) for number in range(60)]
+    index = OccupancyIndex(bucket_size=8)
+    for villager in villagers:
+        index.add(villager)
+
+    for _ in range(200):
+        villager = rng.choice(villagers)
+        villager.location = rng.choice(locations)
+        villager.coordinates = (rng.randrange(40), rng.randrange(40))
+        index.update(villager)
+        for location in locations:
+            here = sorted(other.name for other in villagers if other.location == location)
+            assert sorted(index.people_at(location)) == here
+            for name in [None, here[0] if here else None, here[-1] if here else None, villager.name]:
+                assert index.format_people(location, exclude=name) == ", ".join(other for other in here if other != name)
+        centre, radius = (rng.randrange(40), rng.randrange(40)), rng.randrange(1, 12)
+        near = [other.name for other in villagers
+                if (other.coordinates[0] - centre[0]) ** 2 + (other.coordinates[1] - centre[1]) ** 2 <= radius * radius]
+        assert sorted(index.within_radius(centre, radius)) == sorted(near)
+
+def test_removed_characters_are_forgotten():
+    index = OccupancyIndex()
+    alone = Villager("ALONE", "TAVERN", (1, 1))
+    index.add(alone)
+    assert index.format_people("TAVERN", exclude="ALONE") == ""
+    index.remove("ALONE")
+    assert "ALONE" not in index and len(index) == 0
+    assert index.format_people("TAVERN") == ""
+    assert index.within_radius((1, 1), 3) == []
+
+def test_people_string_is_cached_once_per_location():
+    index = OccupancyIndex()
+    for number in range(50):
+        index.add(Villager(f"V{number}", "TAVERN", (0, 0)))
+    for number in range(50):
+        index.format_people("TAVERN", exclude=f"V{number}")
+    assert len(index.people_cache) == 1
@@ -0,0 +1,86 @@
+""" test_scheduler.py
+
+Tests of the per-tick agent scheduler against the offline LLM backend
+
+"""
+
+import random
+import time
+
+from Backend.character import Character
+from Backend.commands import CommandParser
+from Backend.llm_backend import BatchedLLM, LocalBackend, PromptBatcher
+from Backend.scheduler import Decision, TickScheduler
+
+LATENCY = 0.2
+NAMES = [f"VILLAGER{number}" for number in range(8)]
+
+class Agent:
+    """ Agent()
+
+    Stand-in for a Character whose turn is one call to the local backend
+
+    """
+    def __init__(self, name, backend, jitter=0.0):
+        self.name = name
+        self.backend = backend
+        self.jitter = jitter
+        self.parser = CommandParser(locations=backend.locations, characters=NAMES)
+
+    def turn(self, people="", items=""):
+        time.sleep(self.jitter)
+        prompt = f"You are {self.name} | PEOPLE: {people} | ITEMS: {items}\nEnter a single command:"
+        return self.parser.parse(self.backend.generate([prompt])[0], speaker=self.name)
+
+def run_tick(seed, latency=0.0):
+    backend = LocalBackend(latency=latency)
+    rng = random.Random(seed)
+    # Shuffle the agents and the order their calls finish in
+    agents = [Agent(name, backend, jitter=rng.random() * 0.01) for name in NAMES]
+    rng.shuffle(agents)
+    applied = []
+    scheduler = TickScheduler(max_workers=len(agents))
+    try:
+        people = ", ".join(NAMES)
+        scheduler.run_tick(agents, lambda agent: people,
+                           lambda agent, command, variable: applied.append((agent.name, command, variable)))
+        return applied, scheduler.last_timings
+    finally:
+        scheduler.shutdown()
+
+def test_tick_takes_one_call_of_latency():
+    _, timings = run_tick(0, latency=LATENCY)
+    assert LATENCY <= timings['decide'] < LATENCY * 2
+
+def test_a_tick_is_sent_in_full_batches_whatever_the_worker_count():
+    backend = LocalBackend(latency=LATENCY)
+    llm = BatchedLLM(batcher=PromptBatcher(backend, max_batch=20, window=60))
+    characters = [Character(name=f"VILLAGER{number}", llm=llm, verbose=False) for number in range(30)]
+    applied = []
+    scheduler = TickScheduler(max_workers=1)
+    try:
+        scheduler.run_tick(characters, lambda character: "NOBODY",
+                           lambda character, command, variable: applied.append(character.name))
+    finally:
+        scheduler.shutdown()
+    assert (backend.requests, backend.prompts) == (2, 30)
+    assert scheduler.last_timings['decide'] < LATENCY * 3
+    assert len(applied) == 30
+    assert all(len(character.memory_stream) == 1 for character in characters)
+
+def test_resolve_applies_in_the_same_order_every_run():
+    first, _ = run_tick(0)
+    for seed in range(1, 5):
+        assert run_tick(seed)[0] == first
+    assert [name for name, _, _ in first] == sorted(name for name, _, _ in first)
+
+def test_resolve_drops_a_second_talk_with_a_busy_speaker():
+    class Named:
+        def __init__(self, name):
+            self.name = name
+
+    decisions = [Decision(Named('C'), '[TALK]', 'A'), Decision(Named('A'), '[TALK]', 'B'), Decision(Named('D'), '[MOVE]', 'TAVERN')]
+    scheduler = TickScheduler(max_workers=1)
+    resolved = scheduler.resolve(decisions)
+    scheduler.shutdown()
+    assert [(decision.character.name, decision.command) for decision in resolved] == [('A', '[TALK]'), ('D', '[MOVE]')]
@@ -0,0 +1,84 @@
+""" test_sharding.py
+
+Tests that conversations across shards follow the same rules as those inside one
+
+"""
+
+import functools
+
+from Backend.character import Character
+from Backend.scheduler import Decision
+from Backend.sharding import ShardWorker, character_state
+from Backend.utilities import configure_opt
+
+class ScriptedScheduler:
+    """ ScriptedScheduler()
+
+    Stand-in for a TickScheduler which applies the commands it is given in
+    its first tick and has everyone idle after that
+
+    """
+    def __init__(self, commands=()):
+        self.commands = list(commands)
+        self.last_timings = {'decide': 0.0, 'apply': 0.0}
+
+    def run_tick(self, characters, find_people, apply, find_items=None):
+        deciding = {character.name: character for character in characters}
+        decisions = [Decision(deciding[name], command, variable) for name, command, variable in self.commands if name in deciding]
+        self.commands = []
+        for decision in decisions:
+            apply(*decision)
+        return decisions
+
+# Input: Two shard workers and how many ticks to run them, passing the talk messages between them
+# Output: Every event of the run, in order
+def run_shards(workers, ticks):
+    events = []
+    inboxes = [[], []]
+    for tick in range(1, ticks + 1):
+        replies = [worker.tick(tick, [], inbox) for worker, inbox in zip(workers, inboxes)]
+        inboxes = [[], []]
+        for reply in replies:
+            events.extend(reply['events'])
+            for talk in reply['talks']:
+                inboxes[0 if talk['to'] in workers[0].simulation.characters else 1].append(talk)
+    return events
+
+def make_workers(commands, max_lines=4):
+    opt = configure_opt({})
+    owners = {location: 0 for location in opt['coordinates']}
+    owners['MARKET'] = 1
+    character_class = functools.partial(Character, verbose=False)
+    workers = [ShardWorker(shard, opt, character_class, owners) for shard in range(2)]
+    everyone = ["GABE", "IZZY", "MILES"]
+    villagers = [[("GABE", "TOWNSQUARE"), ("IZZY", "TOWNSQUARE")], [("MILES", "MARKET")]]
+    for worker, shard_villagers in zip(workers, villagers):
+        worker.simulation.scheduler = ScriptedScheduler(commands if worker.shard == 0 else ())
+        worker.simulation.conversations.max_lines = max_lines
+        characters = [character_class(name, f"You are {name}.", location, coordinates=opt['coordinates'][location])
+                      for name, location in shard_villagers]
+        worker.add([character_state(character) for character in characters], everyone)
+    return workers
+
+def test_a_conversation_across_shards_runs_through_both_managers():
+    workers = make_workers([("GABE", "[TALK]", "MILES")], max_lines=3)
+    events = run_shards(workers, 6)
+
+    lines = [event for event in events if event['type'] == 'talk']
+    assert 2 <= len(lines) <= 3
+    assert [event['name'] for event in lines] == ["GABE", "MILES", "GABE"][:len(lines)]
+    assert len({event['conversation'] for event in lines}) == 1
+    ends = [event for event in events if event['type'] == 'talk_end']
+    assert len(ends) == 1 and ends[0]['lines'] == len(lines)
+    assert ends[0]['stopped_by'] in (None, lines[-1]['name'])
+    for worker in workers:
+        assert len(worker.simulation.conversations) == 0
+        assert worker.simulation.conversations.finished == 1
+
+def test_a_busy_villager_in_another_shard_refuses():
+    workers = make_workers([("GABE", "[TALK]", "MILES")])
+    workers[1].simulation.conversations.talking["MILES"] = "elsewhere"
+    events = run_shards(workers, 3)
+
+    assert {'type': 'busy', 'name': "GABE", 'to': "MILES"} in events
+    assert not workers[0].simulation.conversations.is_talking("GABE")